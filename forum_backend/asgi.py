@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "forum_backend.settings")
 
-application = get_asgi_application()
+# 与 get_asgi_application() 相同，换成支持 SSE 长连接的处理器（见 fuzhuxian/sse.py）
+django.setup(set_prefix=False)
+
+from fuzhuxian.sse import EventStreamASGIHandler  # noqa: E402
+
+application = EventStreamASGIHandler()
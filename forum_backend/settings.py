@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "fuzhuxian.guard.RequestGuardMiddleware",  # 非法 Host / 不存在的路径在这里直接拒绝
+    "fuzhuxian.instrumentation.RequestMetricsMiddleware",  # 统计整个请求的耗时
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -93,6 +95,86 @@ DATABASES = {
 }
 
 
+# Cache
+# 默认使用进程内缓存；多个 uwsgi 进程想共享缓存时可以换成
+# django.core.cache.backends.filebased.FileBasedCache 或 Redis 后端（如 django-redis）。
+# 缓存失效靠数据库里的版本号（fuzhuxian.CacheVersion），换后端不影响正确性。
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "forum_backend",
+    }
+}
+
+# 帖子列表/详情的响应缓存，见 fuzhuxian/response_cache.py
+RESPONSE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+# 帖子全文检索，见 fuzhuxian/search.py
+SEARCH = {
+    'MAX_RESULTS': 1000,
+}
+
+# 扫描器流量：非法 Host、不存在的路径在中间件最前面拒绝，见 fuzhuxian/guard.py
+REQUEST_GUARD = {
+    'ENABLED': True,
+}
+
+# 令牌桶限流，(桶容量, 补满所需秒数)；桶放在本机 SQLite 文件里，uwsgi 各进程共用，见 fuzhuxian/throttling.py
+THROTTLE = {
+    'ENABLED': True,
+    'RATES': {
+        'posts': {'ip': (120, 60), 'user': (60, 60)},
+        'similar_posts': {'ip': (30, 60), 'user': (30, 60)},
+        'login': {'ip': (20, 60), 'number': (5, 300)},
+    },
+}
+
+# 按请求统计耗时（Server-Timing 响应头、JSON 日志、/metrics/ 直方图），见 fuzhuxian/instrumentation.py
+METRICS = {
+    'ENABLED': True,
+    'FLUSH_EVERY': 50,
+    'FLUSH_SECONDS': 10,
+    'LOG': True,
+}
+
+# 每个请求一行 JSON 写到标准输出，uwsgi 会收进 uwsgi.log
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'metrics': {'class': 'logging.StreamHandler', 'formatter': 'message'},
+    },
+    'loggers': {
+        'fuzhuxian.metrics': {'handlers': ['metrics'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# 帖子和评论的实时推送（SSE），事件经本机 SQLite 文件在各进程间分发，见 fuzhuxian/events.py、fuzhuxian/sse.py
+EVENTS = {
+    'ENABLED': True,
+    'HISTORY': 1000,
+    'BUFFER': 100,
+    'HEARTBEAT': 15,
+    'MAX_CONNECTIONS': 1000,
+}
+
+# 帖子流精简表示（/posts/?compact=true），见 fuzhuxian/fieldsets.py
+POST_LIST = {
+    'EXCERPT_LENGTH': 120,
+}
+
+# 批量创建（标签、评论的 create 接口接受对象列表），见 fuzhuxian/batch.py
+BATCH_CREATE = {
+    'MAX_ITEMS': 100,
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -112,6 +194,25 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# 首选 scrypt（标准库实现，参数见 PASSWORD_HASHING）；其余算法用于校验已有的哈希，
+# 用户登录成功时会自动升级为首选算法和当前参数
+PASSWORD_HASHERS = [
+    'fuzhuxian.hashers.ScryptPasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+# scrypt 的参数：N 每翻一倍，耗时和内存（约 128*N*r 字节）也翻一倍。
+# 用 python manage.py bench_password_hashers 在目标机器上选择
+PASSWORD_HASHING = {
+    'SCRYPT_N': 2 ** 14,
+    'SCRYPT_R': 8,
+    'SCRYPT_P': 1,
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -151,10 +252,12 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'fuzhuxian.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 5  # 每页显示的数据量，你可以自行调整
+    'PAGE_SIZE': 5,  # 每页显示的数据量，你可以自行调整
+    # uwsgi 直接收到客户端地址（REMOTE_ADDR），不信任客户端自带的 X-Forwarded-For
+    'NUM_PROXIES': 0,
 }
 
 # settings.py
@@ -162,16 +265,42 @@ REST_FRAMEWORK = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 上传图片的后台处理（压缩、缩略图、WebP），见 fuzhuxian/image_pipeline.py
+IMAGE_PIPELINE = {
+    'MODE': 'process',  # 'sync' 表示在请求内同步处理
+    'WORKERS': 2,
+    'MAX_UPLOAD_BYTES': 20 * 1024 * 1024,
+    'MAX_PIXELS': 40_000_000,
+}
+
+# 超过 1MB 的上传直接写到临时文件，不在 worker 内存里整体缓存
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+
 DEFAULT_CHARSET = 'utf-8'
 
 
 AUTH_USER_MODEL = 'fuzhuxian.CustomUser'
 
+# 学号登录（user/custom-token/）走 NumberBackend，用户名登录仍由 ModelBackend 处理
+AUTHENTICATION_BACKENDS = [
+    'fuzhuxian.backends.NumberBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 
 from datetime import timedelta
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=3650),  # 例如，有效期为60分钟
     'REFRESH_TOKEN_LIFETIME': timedelta(days=3650),     # 刷新token有效期为1天
+    # token 中带上用户声明，认证时不查库（见 fuzhuxian/authentication.py）
+    'TOKEN_OBTAIN_SERIALIZER': 'fuzhuxian.authentication.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'fuzhuxian.authentication.RevocationCheckingTokenRefreshSerializer',
     # 其他配置...
-}
\ No newline at end of file
+}
+
+# 基于 token 声明的认证：旧 token 的用户缓存时间、吊销列表的刷新间隔（秒）
+JWT_CLAIMS_AUTH = {
+    'USER_CACHE_TTL': 60,
+    'REVOCATION_REFRESH': 30,
+}
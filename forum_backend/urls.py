@@ -4,10 +4,14 @@ from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested import routers
-from fuzhuxian.views import CustomUserViewSet, TagViewSet, PostViewSet, CommentViewSet, SimilarPostsByTags, CustomTokenObtainView,ImageViewSet
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from fuzhuxian.views import CustomUserViewSet, TagViewSet, PostViewSet, CommentViewSet, SimilarPostsByTags, CustomTokenObtainView,ImageViewSet, ResponseCacheStats, RequestMetricsView, LoginTokenObtainPairView
+from rest_framework_simplejwt.views import TokenRefreshView
+from fuzhuxian import async_views, sse
 
 
+# 不存在的 admin 地址直接 404，不再被 catch-all 视图接住（RequestGuardMiddleware 据此提前拒绝）
+admin.site.final_catch_all_view = False
+
 router = DefaultRouter()
 router.register(r'users', CustomUserViewSet)
 router.register(r'tags', TagViewSet)
@@ -25,8 +29,18 @@ urlpatterns = [
     path('api-auth/', include('rest_framework.urls')),
     path('', include(router.urls)),
     path('', include(comments_router.urls)),
-    path('user/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('user/token/', LoginTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('user/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('user/custom-token/', CustomTokenObtainView.as_view(), name='custom_token_obtain'),
+    path('cache/stats/', ResponseCacheStats.as_view(), name='response_cache_stats'),
+    path('metrics/', RequestMetricsView.as_view(), name='request_metrics'),
+    # 只读接口的异步版本，ASGI 部署时使用，见 fuzhuxian/async_views.py
+    path('async/posts/', async_views.post_list, name='async-post-list'),
+    path('async/posts/<int:pk>/', async_views.post_detail, name='async-post-detail'),
+    path('async/posts/<int:post_pk>/comments/', async_views.comment_list, name='async-post-comments-list'),
+    path('async/similar_posts/', async_views.similar_posts, name='async-similar-posts'),
+    # SSE 推送，见 fuzhuxian/sse.py
+    path('events/', sse.feed_events, name='feed-events'),
+    path('posts/<int:post_pk>/events/', sse.post_events, name='post-events'),
 
  ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -2,6 +2,7 @@ from django.contrib import admin
 from .models import Tag, Post, Comment, Image,CustomUser
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from django.contrib.auth.admin import UserAdmin
+from . import search
 
 class CustomUserCreationForm(UserCreationForm):
     class Meta(UserCreationForm):
@@ -54,6 +55,12 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('created_at','author', 'tags','status')  # 右侧筛选栏
     date_hierarchy = 'created_at'  # 顶部时间导航栏
 
+    def get_search_results(self, request, queryset, search_term):
+        # 走全文检索索引，不再对标题和正文做 LIKE '%q%' 扫描；后台只过滤不排序，不受 MAX_RESULTS 限制
+        if not search_term:
+            return queryset, False
+        return queryset.filter(pk__in=search.matching_posts(search_term)), False
+
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
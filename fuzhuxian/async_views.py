@@ -0,0 +1,48 @@
+"""
+只读接口的异步版本，在 ASGI 服务器（uvicorn / daphne，入口 forum_backend.asgi）下使用：
+
+    GET  /async/posts/                     同 /posts/（过滤、分页、?compact= / ?fields= 都相同）
+    GET  /async/posts/<id>/                同 /posts/<id>/
+    GET  /async/posts/<post_pk>/comments/  同 /posts/<post_pk>/comments/
+    POST /async/similar_posts/             同 /similar_posts/
+
+同步部署下，一个 uwsgi 进程在等数据库或写文件时什么也做不了。这里的视图是协程：
+查询和序列化放到线程池里执行，等待期间事件循环继续接收和处理别的请求。
+Django 3.2 还没有异步 ORM（QuerySet.aget()、async for 从 4.1 开始），所以这里复用同步的 DRF 视图，
+用 sync_to_async(thread_sensitive=False) 放进线程池：不经过 Django 默认的单一同步线程，
+多个请求的查询可以同时进行。返回的内容和限流与同步接口一致；ETag 和响应缓存的机制相同，
+但键里带着完整路径（含 /async/），两边各有各的校验值和缓存条目，不共用——
+分页响应里的 next / previous 是完整的 URL，共用条目会把另一边的链接发给客户端。
+线程池里的每个线程有自己的数据库连接，每次请求前后按 CONN_MAX_AGE 检查是否需要关闭，
+与 WSGI 下 request_started / request_finished 的处理相同。
+"""
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from .views import CommentViewSet, PostViewSet, SimilarPostsByTags
+
+
+def in_thread_pool(view):
+    def run(request, *args, **kwargs):
+        close_old_connections()
+        try:
+            response = view(request, *args, **kwargs)
+            # 在线程里渲染完，事件循环拿到的是已经生成好的字节
+            return response.render() if hasattr(response, 'render') else response
+        finally:
+            close_old_connections()
+    run = sync_to_async(run, thread_sensitive=False)
+
+    async def async_view(request, *args, **kwargs):
+        return await run(request, *args, **kwargs)
+
+    # DRF 视图本身不做 Django 的 CSRF 检查；csrf_exempt 装饰器在 Django 3.2 不支持协程，直接设置属性
+    async_view.csrf_exempt = True
+    return async_view
+
+
+# basename 与路由注册时相同（响应缓存和 ETag 按 basename + 完整路径区分接口）
+post_list = in_thread_pool(PostViewSet.as_view({'get': 'list'}, basename='post'))
+post_detail = in_thread_pool(PostViewSet.as_view({'get': 'retrieve'}, basename='post'))
+comment_list = in_thread_pool(CommentViewSet.as_view({'get': 'list'}, basename='post-comments'))
+similar_posts = in_thread_pool(SimilarPostsByTags.as_view({'post': 'create'}, basename='similar_posts'))
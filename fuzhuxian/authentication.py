@@ -0,0 +1,157 @@
+"""
+基于 token 声明 (claims) 的 JWT 认证。
+
+签发 token 时把 username / number / is_staff / is_superuser 写进 payload，
+认证时直接用这些声明构造 CustomUser 实例，不查询数据库。
+构造出来的实例只带这几个字段，可以用于外键赋值和过滤，但不要调用 save()。
+
+为了让声明不会长期失效：
+- 用户的密码、用户名、学号、权限、启用状态变化或用户被删除时，
+  写入 TokenRevocation，此前（含同一秒内）签发的 token 全部作废；
+- 每个进程缓存吊销列表，每 REVOCATION_REFRESH 秒从数据库重新读取一次；
+- 不带声明的旧 token 仍按 user_id 查库，结果在进程内缓存 USER_CACHE_TTL 秒。
+
+配置 settings.JWT_CLAIMS_AUTH：USER_CACHE_TTL（默认 60）、REVOCATION_REFRESH（默认 30）。
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import TokenRevocation
+
+USER_CLAIMS = ('username', 'number', 'is_staff', 'is_superuser')
+
+
+def get_config():
+    config = {'USER_CACHE_TTL': 60, 'REVOCATION_REFRESH': 30}
+    config.update(getattr(settings, 'JWT_CLAIMS_AUTH', {}))
+    return config
+
+
+def add_user_claims(token, user):
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+def user_from_claims(token):
+    User = get_user_model()
+    fields = {claim: token[claim] for claim in USER_CLAIMS}
+    user = User(**{api_settings.USER_ID_FIELD: token[api_settings.USER_ID_CLAIM]}, **fields)
+    # 标记为已存在于数据库的实例，外键赋值和过滤时按主键处理
+    user._state.adding = False
+    return user
+
+
+class RevocationList:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._not_before = {}
+        self._loaded_at = None
+
+    def _refresh(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._loaded_at is not None and now - self._loaded_at < get_config()['REVOCATION_REFRESH']:
+                return
+            self._not_before = dict(TokenRevocation.objects.values_list('user_id', 'not_before'))
+            self._loaded_at = now
+
+    def is_revoked(self, user_id, issued_at):
+        self._refresh()
+        not_before = self._not_before.get(int(user_id))
+        # iat 只精确到秒，与吊销发生在同一秒内签发的 token 也按作废处理
+        return not_before is not None and (issued_at or 0) <= not_before
+
+    def revoke(self, user_id):
+        not_before = int(time.time())
+        TokenRevocation.objects.update_or_create(user_id=user_id, defaults={'not_before': not_before})
+        with self._lock:
+            self._not_before[int(user_id)] = not_before
+
+    def clear(self):
+        with self._lock:
+            self._not_before = {}
+            self._loaded_at = None
+
+
+class UserCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or entry[1] < time.monotonic():
+                self._users.pop(user_id, None)
+                return None
+            return entry[0]
+
+    def set(self, user_id, user):
+        with self._lock:
+            self._users[user_id] = (user, time.monotonic() + get_config()['USER_CACHE_TTL'])
+
+    def discard(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+revocations = RevocationList()
+user_cache = UserCache()
+
+
+def revoke_user_tokens(user_id):
+    revocations.revoke(user_id)
+    user_cache.discard(user_id)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """带声明的 token 不查库；吊销检查使用进程内缓存的吊销列表"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        if revocations.is_revoked(user_id, validated_token.get('iat')):
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+
+        if all(claim in validated_token for claim in USER_CLAIMS):
+            return user_from_claims(validated_token)
+
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+        return user
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """user/token/ 签发的 token 同样带上用户声明"""
+
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+
+class RevocationCheckingTokenRefreshSerializer(TokenRefreshSerializer):
+    """刷新时检查吊销列表，避免用已作废的 refresh token 换出带旧声明的 access token"""
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        if revocations.is_revoked(refresh.get(api_settings.USER_ID_CLAIM, 0), refresh.get('iat')):
+            raise InvalidToken('Token has been revoked')
+        return super().validate(attrs)
@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+class NumberBackend(ModelBackend):
+    """
+    用学号登录：authenticate(request, number=..., password=...)。
+    一次按唯一索引 number 查询 + 一次密码校验；用户名登录仍交给 ModelBackend。
+    """
+
+    def authenticate(self, request, number=None, password=None, **kwargs):
+        if number is None or password is None:
+            return None
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.get(number=number)
+        except UserModel.DoesNotExist:
+            # 和 ModelBackend 一样做一次哈希，避免通过响应时间判断学号是否存在
+            UserModel().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,33 @@
+"""
+批量创建：create 接口除了单个对象，也接受对象列表。
+
+整批先全部校验，有任何一项不合法就返回 400，错误列表与请求中的各项一一对应（合法的项为 {}）；
+全部合法时在一个事务里批量写入，返回 201 和与请求顺序一致的创建结果。
+批量写入由序列化器的 list_serializer_class 实现（见 serializers.TagListSerializer / CommentListSerializer）。
+
+配置 settings.BATCH_CREATE：
+    MAX_ITEMS  每次请求最多的对象数，默认 100
+"""
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def get_config():
+    config = {'MAX_ITEMS': 100}
+    config.update(getattr(settings, 'BATCH_CREATE', {}))
+    return config
+
+
+class BatchCreateMixin:
+
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
+        max_items = get_config()['MAX_ITEMS']
+        if not request.data or len(request.data) > max_items:
+            return Response({'detail': f'批量创建需要 1 到 {max_items} 个对象'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -0,0 +1,56 @@
+"""
+管理命令里的基准测试共用的小工具。
+"""
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def scratch_data():
+    """在事务里造数据跑基准，结束后整体回滚，不污染当前数据库"""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """samples 单位为秒，返回毫秒级的统计"""
+    total = sum(samples)
+    return {
+        'n': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'mean_ms': round(total / len(samples) * 1000, 3) if samples else 0.0,
+        'per_sec': round(len(samples) / total, 1) if total else 0.0,
+    }
+
+
+def measure(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def format_row(name, stats):
+    return '{:<28} n={n:<6} p50={p50_ms:>9.3f}ms p95={p95_ms:>9.3f}ms p99={p99_ms:>9.3f}ms {per_sec:>9.1f}/s'.format(name, **stats)
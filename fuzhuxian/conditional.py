@@ -0,0 +1,77 @@
+"""
+列表/详情接口的条件请求（ETag / Last-Modified）。
+
+校验值只用一次聚合查询得到：列表取过滤后的 (行数, max(update_at))，
+详情取该行的 update_at。客户端带 If-None-Match / If-Modified-Since 且没有变化时
+直接返回 304，不执行分页查询也不做序列化。
+
+列表只发 ETag，不发 Last-Modified：删掉最近修改的那一行会让 max(update_at) 变小，
+只带 If-Modified-Since 的客户端会一直拿到 304；ETag 里有行数，删除也会让它变化。
+
+这依赖 update_at 能反映表示内容的变化：图片增删/处理完成、标签改名等会通过
+signals 刷新所属帖子或评论的 update_at。帖子的表示里还有作者的用户名，改名只给
+响应缓存的版本号加一，帖子的视图用 validator_versions() 把版本号也放进 ETag。
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+class ConditionalGetMixin:
+    """给 ModelViewSet 的 list 加上 ETag，retrieve 加上 ETag 和 Last-Modified"""
+    last_modified_field = 'update_at'
+
+    def validator_versions(self):
+        """放进 ETag 的 CacheVersion 版本号，默认没有"""
+        return ()
+
+    def list_validators(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        stats = queryset.order_by().aggregate(count=Count('pk'), last=Max(self.last_modified_field))
+        etag = make_etag(
+            self.basename, self.request.get_full_path(), self.request.user.pk,
+            stats['count'], stats['last'], *self.validator_versions(),
+        )
+        return etag, None
+
+    def object_validators(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        row = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}) \
+            .values_list('pk', self.last_modified_field).first()
+        if row is None:
+            return None, None
+        return make_etag(self.basename, self.request.get_full_path(), *row, *self.validator_versions()), row[1]
+
+    def conditional(self, validators, render, request, *args, **kwargs):
+        etag, last_modified = validators()
+        last_modified = int(last_modified.timestamp()) if last_modified is not None else None
+        if etag is not None:
+            not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                return not_modified
+        response = render(request, *args, **kwargs)
+        if etag is not None and response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def use_list_validators(self):
+        # 游标分页就是为了不扫描整个结果集，这种情况下不计算列表的校验值
+        use_cursor = getattr(self, 'use_cursor_pagination', None)
+        return not (use_cursor and use_cursor())
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_list_validators():
+            return super().list(request, *args, **kwargs)
+        return self.conditional(self.list_validators, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(self.object_validators, super().retrieve, request, *args, **kwargs)
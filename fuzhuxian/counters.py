@@ -0,0 +1,122 @@
+"""
+Post 上的冗余计数：comment_count、image_count、last_activity_at。
+
+每次变化都是对帖子行的一条 UPDATE ... SET x = x ± 1，在数据库里原子完成，
+并发写入不会丢失更新。计数出现在帖子的序列化结果里，所以同时刷新 update_at，
+让条件请求失效（见 conditional.py）。
+
+last_activity_at 是帖子最新一条评论的时间，没有评论时等于发帖时间。
+bulk_create 等不发送信号的写入会让计数偏离，用 reconcile() 校正。
+"""
+from django.db.models import Count, DateTimeField, F, IntegerField, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Comment, Image, Post
+
+
+def _decrement(field):
+    # 计数已经偏离时不减到负数，交给 reconcile() 校正
+    return Greatest(F(field) - 1, Value(0))
+
+
+def _latest_comment():
+    return Subquery(
+        Comment.objects.filter(post=OuterRef('pk')).order_by()
+        .values('post').annotate(latest=Max('created_at')).values('latest'),
+        output_field=DateTimeField(),
+    )
+
+
+def comment_added(comment):
+    Post.objects.filter(pk=comment.post_id).update(
+        comment_count=F('comment_count') + 1,
+        last_activity_at=Greatest(F('last_activity_at'), Value(comment.created_at, output_field=DateTimeField())),
+        update_at=timezone.now(),
+    )
+
+
+def comments_added(comments):
+    """批量插入（不发送信号）的评论：每个帖子一条 UPDATE"""
+    by_post = {}
+    for comment in comments:
+        count, latest = by_post.get(comment.post_id, (0, comment.created_at))
+        by_post[comment.post_id] = (count + 1, max(latest, comment.created_at))
+    now = timezone.now()
+    for post_id, (count, latest) in by_post.items():
+        Post.objects.filter(pk=post_id).update(
+            comment_count=F('comment_count') + count,
+            last_activity_at=Greatest(F('last_activity_at'), Value(latest, output_field=DateTimeField())),
+            update_at=now,
+        )
+
+
+def comment_removed(comment):
+    # 评论行已经删除，子查询取到的是剩下评论里最新的时间
+    Post.objects.filter(pk=comment.post_id).update(
+        comment_count=_decrement('comment_count'),
+        last_activity_at=Coalesce(_latest_comment(), F('created_at')),
+        update_at=timezone.now(),
+    )
+
+
+def image_added(image):
+    if image.post_id is not None:
+        Post.objects.filter(pk=image.post_id).update(image_count=F('image_count') + 1, update_at=timezone.now())
+
+
+def image_removed(image):
+    if image.post_id is not None:
+        Post.objects.filter(pk=image.post_id).update(image_count=_decrement('image_count'), update_at=timezone.now())
+
+
+def _actual_count(model):
+    return Coalesce(Subquery(
+        model.objects.filter(post=OuterRef('pk')).order_by()
+        .values('post').annotate(n=Count('pk')).values('n'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+def reconcile(post_ids=None, chunk_size=1000, touch=True):
+    """
+    按实际的评论/图片重新计算计数，只改写有偏差的帖子。
+    touch=False 时不刷新 update_at（导入数据时保留原来的时间）。
+    返回被校正的帖子 id 列表。
+    """
+    queryset = Post.objects.order_by('pk')
+    if post_ids is not None:
+        queryset = queryset.filter(pk__in=post_ids)
+    fixed = []
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk).values_list('pk', flat=True)[:chunk_size])
+        if not chunk:
+            return fixed
+        last_pk = chunk[-1]
+        drifted = list(
+            Post.objects.filter(pk__in=chunk)
+            .annotate(
+                actual_comments=_actual_count(Comment),
+                actual_images=_actual_count(Image),
+                latest_comment=_latest_comment(),
+            )
+            .filter(
+                ~Q(comment_count=F('actual_comments'))
+                | ~Q(image_count=F('actual_images'))
+                | Q(actual_comments__gt=0) & ~Q(last_activity_at=F('latest_comment'))
+                # 新帖的 last_activity_at 取默认值时比 created_at 早几微秒，不算偏差
+                | Q(actual_comments=0, last_activity_at__gt=F('created_at'))
+            )
+            .values_list('pk', flat=True)
+        )
+        if drifted:
+            values = {
+                'comment_count': _actual_count(Comment),
+                'image_count': _actual_count(Image),
+                'last_activity_at': Coalesce(_latest_comment(), F('created_at')),
+            }
+            if touch:
+                values['update_at'] = timezone.now()
+            Post.objects.filter(pk__in=drifted).update(**values)
+            fixed.extend(drifted)
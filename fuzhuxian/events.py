@@ -0,0 +1,338 @@
+"""
+帖子和评论的实时事件，SSE 推送（fuzhuxian/sse.py）的数据来源。
+
+写操作在事务提交后发布事件，每个事件进入两个频道：
+    feed        所有帖子的变化（帖子流页面）
+    post:<id>   某一个帖子的变化（帖子详情页）
+
+事件类型和数据：
+    post.created     {id, title, status, author, created_at}
+    post.updated     {id, status, update_at, fields}    fields 为这次保存的字段，未知时为 null
+    post.status      {id, status}                       n → i → a 的状态变化
+    post.deleted     {id}
+    comment.created  {id, post, body, author, created_at}
+    comment.updated  {id, post, update_at}
+    comment.deleted  {id, post}
+
+hub 给事件编号，保留最近 HISTORY 个事件（客户端按 Last-Event-ID 重连时补发），
+并把事件分发给本进程里订阅了对应频道的连接。每个连接最多积压 BUFFER 个事件，
+超过后连接被关闭，客户端重连时从历史里补齐：慢连接不会让内存无限增长。
+发布失败只记日志，不影响写操作。
+
+配置 settings.EVENTS：
+    ENABLED          默认 True
+    STORE_PATH       SQLite 文件路径，默认系统临时目录下的 forum_backend-events.sqlite3：
+                     事件写进这个文件，uwsgi 的各进程和 ASGI 进程都能收到。None 时只在进程内存里分发（测试/单进程）
+    BACKEND          hub 类的路径，默认 None（按 STORE_PATH 选择）。多台机器时换成基于 Redis pub/sub 等的实现，
+                     接口与 MemoryHub 相同
+    POLL_SECONDS     SqliteHub 检查新事件的间隔，默认 0.2
+    HISTORY          保留的事件数，默认 1000
+    BUFFER           每个连接最多积压的事件数，默认 100
+    HEARTBEAT        没有事件时每隔多少秒发一行注释保持连接，默认 15
+    RETRY_MS         客户端断开后等待多久重连，默认 3000
+    WSGI_RETRY_MS    WSGI 下每次请求都会结束，客户端按这个间隔重连轮询，默认 15000
+    MAX_CONNECTIONS  每个进程同时保持的连接数上限，超过时返回 503，默认 1000
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import deque, namedtuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+FEED = 'feed'
+PRUNE_EVERY = 100
+
+# data 是编码好的 JSON 字符串，每个连接直接写出，不再重复编码
+Event = namedtuple('Event', 'id channels kind data')
+
+
+def get_config():
+    config = {
+        'ENABLED': True,
+        'STORE_PATH': os.path.join(tempfile.gettempdir(), 'forum_backend-events.sqlite3'),
+        'BACKEND': None,
+        'POLL_SECONDS': 0.2,
+        'HISTORY': 1000,
+        'BUFFER': 100,
+        'HEARTBEAT': 15,
+        'RETRY_MS': 3000,
+        'WSGI_RETRY_MS': 15000,
+        'MAX_CONNECTIONS': 1000,
+    }
+    config.update(getattr(settings, 'EVENTS', {}))
+    return config
+
+
+def post_channel(post_id):
+    return f'post:{post_id}'
+
+
+class Subscription:
+    """一个连接的订阅：hub 在任意线程里 push()，连接在自己的事件循环里 get()"""
+
+    def __init__(self, channels, buffer, loop):
+        self.channels = frozenset(channels)
+        self.buffer = buffer
+        self.loop = loop
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.wakeup = asyncio.Event()
+        self.overflowed = False
+        self.closed = False
+
+    def push(self, event):
+        with self.lock:
+            if len(self.pending) >= self.buffer:
+                self.overflowed = True
+            else:
+                self.pending.append(event)
+        try:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+        except RuntimeError:  # 连接所在的事件循环已经关闭
+            self.closed = True
+
+    async def get(self, timeout):
+        """等到有新事件，返回积压的事件（可能是空列表）；超时返回 None"""
+        if not self.pending and not self.overflowed:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        self.wakeup.clear()
+        with self.lock:
+            events, self.pending = list(self.pending), deque()
+        return events
+
+
+class MemoryHub:
+    """
+    进程内的分发。其它实现需要提供相同的方法：
+        publish(channels, kind, data) -> Event    任意线程调用
+        replay(channels, last_event_id) -> (events, latest_id)
+        subscribe(channels, last_event_id, buffer) -> (Subscription, events, latest_id)   在连接的事件循环里调用
+        unsubscribe(subscription)
+        connections() -> 本进程的订阅数
+    replay/subscribe 返回 last_event_id 之后的事件；历史里已经找不到（断线太久、服务重启）时 events 为 None。
+    """
+
+    def __init__(self, config):
+        self.buffer = config['BUFFER']
+        self.history = deque(maxlen=config['HISTORY'])
+        self.lock = threading.Lock()
+        self.latest = 0
+        self.subscriptions = set()
+
+    def publish(self, channels, kind, data):
+        with self.lock:
+            self.latest += 1
+            event = Event(self.latest, frozenset(channels), kind, data)
+            self.history.append(event)
+        self.dispatch(event)
+        return event
+
+    def dispatch(self, event):
+        with self.lock:
+            targets = [subscription for subscription in self.subscriptions if subscription.channels & event.channels]
+        for subscription in targets:
+            subscription.push(event)
+            if subscription.closed:
+                self.unsubscribe(subscription)
+
+    def replay(self, channels, last_event_id):
+        with self.lock:
+            return self.since(frozenset(channels), last_event_id)
+
+    def since(self, channels, last_event_id):
+        if last_event_id is None:
+            return [], self.latest
+        oldest = self.history[0].id if self.history else self.latest + 1
+        if last_event_id < oldest - 1 or last_event_id > self.latest:
+            return None, self.latest
+        return [event for event in self.history if event.id > last_event_id and event.channels & channels], self.latest
+
+    def subscribe(self, channels, last_event_id=None, buffer=None):
+        subscription = Subscription(channels, buffer or self.buffer, asyncio.get_running_loop())
+        # 注册和读取历史在同一把锁里，两者之间发布的事件不会漏掉也不会重复
+        with self.lock:
+            self.subscriptions.add(subscription)
+            events, latest = self.since(subscription.channels, last_event_id)
+        return subscription, events, latest
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def connections(self):
+        return len(self.subscriptions)
+
+    def clear(self):
+        with self.lock:
+            self.history.clear()
+
+
+class SqliteHub(MemoryHub):
+    """
+    事件写进本机的 SQLite 文件，编号由 SQLite 分配，各进程一致；
+    每个进程一个线程每隔 POLL_SECONDS 读出新事件，分发给本进程的连接。
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.path = config['STORE_PATH']
+        self.poll_seconds = config['POLL_SECONDS']
+        self.keep = config['HISTORY']
+        self.local = threading.local()
+        self.published = 0
+        self.cursor = None
+        self.poller = None
+        self.stopped = threading.Event()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # 事件丢了客户端会收到 reset，不需要每次落盘
+            conn.execute('CREATE TABLE IF NOT EXISTS event (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'channels TEXT NOT NULL, kind TEXT NOT NULL, data TEXT NOT NULL)')
+            self.local.conn = conn
+        return conn
+
+    def publish(self, channels, kind, data):
+        conn = self.connection()
+        event_id = conn.execute('INSERT INTO event (channels, kind, data) VALUES (?, ?, ?)',
+                                (' '.join(sorted(channels)), kind, data)).lastrowid
+        self.published += 1
+        if self.published % PRUNE_EVERY == 0:
+            conn.execute('DELETE FROM event WHERE id <= ?', (event_id - self.keep,))
+        return Event(event_id, frozenset(channels), kind, data)
+
+    def read(self, after):
+        rows = self.connection().execute('SELECT id, channels, kind, data FROM event WHERE id > ? ORDER BY id',
+                                         (after,))
+        return [Event(event_id, frozenset(channels.split()), kind, data) for event_id, channels, kind, data in rows]
+
+    def poll(self):
+        """把上次之后写入的事件分发给本进程的连接"""
+        if self.cursor is None:
+            self.cursor = self.connection().execute('SELECT COALESCE(MAX(id), 0) FROM event').fetchone()[0]
+        for event in self.read(self.cursor):
+            self.dispatch(event)
+            self.cursor = event.id
+
+    def run(self):
+        while not self.stopped.wait(self.poll_seconds):
+            try:
+                self.poll()
+            except sqlite3.Error:
+                logger.warning('event store unavailable', exc_info=True)
+
+    def clear(self):
+        self.connection().execute('DELETE FROM event')
+
+    def close(self):
+        self.stopped.set()
+        if self.poller is not None:
+            self.poller.join()
+
+    def replay(self, channels, last_event_id):
+        oldest, latest = self.connection().execute('SELECT MIN(id), COALESCE(MAX(id), 0) FROM event').fetchone()
+        if last_event_id is None:
+            return [], latest
+        if last_event_id > latest or (oldest is not None and last_event_id < oldest - 1):
+            return None, latest
+        channels = frozenset(channels)
+        return [event for event in self.read(last_event_id) if event.channels & channels], latest
+
+    def subscribe(self, channels, last_event_id=None, buffer=None):
+        with self.lock:
+            if self.poller is None:
+                # 从当前位置开始分发，之前的事件只用于补发
+                self.cursor = self.connection().execute('SELECT COALESCE(MAX(id), 0) FROM event').fetchone()[0]
+                self.poller = threading.Thread(target=self.run, name='event-hub', daemon=True)
+                self.poller.start()
+        subscription = Subscription(channels, buffer or self.buffer, asyncio.get_running_loop())
+        # 先注册再读历史：之后写入的事件一定会被分发到；两边都有的事件由连接按编号去重
+        with self.lock:
+            self.subscriptions.add(subscription)
+        events, latest = self.replay(subscription.channels, last_event_id)
+        return subscription, events, latest
+
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def get_hub():
+    config = get_config()
+    key = (config['BACKEND'], config['STORE_PATH'])
+    with _hubs_lock:
+        if key not in _hubs:
+            if config['BACKEND']:
+                hub_class = import_string(config['BACKEND'])
+            else:
+                hub_class = SqliteHub if config['STORE_PATH'] else MemoryHub
+            _hubs[key] = hub_class(config)
+        return _hubs[key]
+
+
+def publish(kind, data, post_id):
+    """事务提交后把事件发到 feed 和帖子自己的频道"""
+    if not get_config()['ENABLED']:
+        return
+    channels = (FEED, post_channel(post_id))
+    payload = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+    transaction.on_commit(lambda: send(channels, kind, payload))
+
+
+def send(channels, kind, payload):
+    try:
+        get_hub().publish(channels, kind, payload)
+    except Exception:
+        logger.warning('event hub unavailable, event %s dropped', kind, exc_info=True)
+
+
+def post_created(post):
+    publish('post.created', {'id': post.pk, 'title': post.title, 'status': post.status, 'author': post.author_id,
+                             'created_at': post.created_at}, post.pk)
+
+
+def post_updated(post, fields=None, status_changed=False):
+    fields = sorted(fields) if fields is not None else None
+    publish('post.updated', {'id': post.pk, 'status': post.status, 'update_at': post.update_at, 'fields': fields},
+            post.pk)
+    if status_changed:
+        post_status(post.pk, post.status)
+
+
+def post_status(post_id, status):
+    publish('post.status', {'id': post_id, 'status': status}, post_id)
+
+
+def post_deleted(post_id):
+    publish('post.deleted', {'id': post_id}, post_id)
+
+
+def comments_created(comments):
+    for comment in comments:
+        publish('comment.created', {'id': comment.pk, 'post': comment.post_id, 'body': comment.body,
+                                    'author': comment.author_id, 'created_at': comment.created_at}, comment.post_id)
+
+
+def comment_updated(comment):
+    publish('comment.updated', {'id': comment.pk, 'post': comment.post_id, 'update_at': comment.update_at},
+            comment.post_id)
+
+
+def comment_deleted(comment):
+    publish('comment.deleted', {'id': comment.pk, 'post': comment.post_id}, comment.post_id)
@@ -0,0 +1,62 @@
+"""
+稀疏字段集：读接口按查询参数裁剪序列化的字段。
+
+    ?fields=id,title,status   只输出列出的字段（不认识的名字忽略）
+    ?expand=author,tags       把 expandable_fields 中的字段换成完整的嵌套表示
+
+只对顶层序列化器的 GET/HEAD 请求生效，嵌套的序列化器和写接口的字段不受影响。
+视图可以用 requested_fields() 得到同样的字段集合，据此少取关联数据。
+
+配置 settings.POST_LIST：
+    EXCERPT_LENGTH  精简列表（?compact=true）中正文摘要的最大字数，默认 120
+"""
+from django.conf import settings
+from rest_framework import serializers
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def get_config():
+    config = {'EXCERPT_LENGTH': 120}
+    config.update(getattr(settings, 'POST_LIST', {}))
+    return config
+
+
+def split_param(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def requested_fields(request):
+    """返回 (fields, expand)；没有带 ?fields= 时 fields 为 None，表示全部字段"""
+    if request is None or request.method not in SAFE_METHODS:
+        return None, set()
+    fields = split_param(request.query_params.get('fields'))
+    return (set(fields) if fields else None), set(split_param(request.query_params.get('expand')))
+
+
+def is_nested(serializer):
+    """是否嵌套在另一个序列化器里（many=True 时外面的 ListSerializer 不算）"""
+    parent = serializer.parent
+    if isinstance(parent, serializers.ListSerializer):
+        parent = parent.parent
+    return parent is not None
+
+
+class SparseFieldsMixin:
+    """
+    expandable_fields = {字段名: 返回完整字段实例的函数}，
+    默认输出精简表示，?expand= 里列出的字段换成完整表示。
+    """
+    expandable_fields = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if is_nested(self):
+            return fields
+        only, expand = requested_fields(self.context.get('request'))
+        for name in expand:
+            if name in self.expandable_fields:
+                fields[name] = self.expandable_fields[name]()
+        if only is not None:
+            fields = {name: field for name, field in fields.items() if name in only}
+        return fields
@@ -0,0 +1,70 @@
+"""
+放在 MIDDLEWARE 最前面的请求过滤，扫描器的请求在进入 session/CSRF/认证之前就被拒绝。
+
+  - Host 不在 ALLOWED_HOSTS 里：400，空的纯文本响应（不生成 DEBUG 错误页，也不记 DisallowedHost 日志）
+  - 路径匹配不到任何 URL（加上结尾的 / 也匹配不到）：404，空的纯文本响应
+
+配置 settings.REQUEST_GUARD：
+    ENABLED  默认 True
+"""
+import asyncio
+
+from django.conf import settings
+from django.core.exceptions import DisallowedHost
+from django.http import HttpResponse
+from django.urls import Resolver404, get_resolver
+
+
+def get_config():
+    config = {'ENABLED': True}
+    config.update(getattr(settings, 'REQUEST_GUARD', {}))
+    return config
+
+
+def is_known_path(path, urlconf=None):
+    resolver = get_resolver(urlconf)
+    candidates = [path]
+    if settings.APPEND_SLASH and not path.endswith('/'):
+        candidates.append(path + '/')  # CommonMiddleware 会重定向到带 / 的地址
+    for candidate in candidates:
+        try:
+            resolver.resolve(candidate)
+            return True
+        except Resolver404:
+            pass
+    return False
+
+
+def rejection(status):
+    return HttpResponse(b'', status=status, content_type='text/plain')
+
+
+class RequestGuardMiddleware:
+    """WSGI 和 ASGI 下都可以用；只做字符串和 URL 匹配，ASGI 下直接在事件循环里执行"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.check(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.check(request) or await self.get_response(request)
+
+    def check(self, request):
+        """请求应当被拒绝时返回响应"""
+        if not get_config()['ENABLED']:
+            return None
+        try:
+            request.get_host()
+        except DisallowedHost:
+            return rejection(400)
+        if not is_known_path(request.path_info, getattr(request, 'urlconf', None)):
+            return rejection(404)
+        return None
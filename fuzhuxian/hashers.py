@@ -0,0 +1,105 @@
+"""
+可调参数的 scrypt 密码哈希（基于标准库 hashlib.scrypt）。
+
+编码格式与 Django 4.0 自带的 ScryptPasswordHasher 相同：
+    scrypt$<N>$<salt>$<r>$<p>$<base64 hash>
+以后升级 Django 可以直接换成官方实现，已有的哈希不用迁移。
+
+参数来自 settings.PASSWORD_HASHING（SCRYPT_N / SCRYPT_R / SCRYPT_P）。
+参数调整后，已有哈希会在用户下次登录成功时按新参数重新计算（must_update）；
+PBKDF2 等旧算法的哈希同样会在登录时升级为首选算法。
+"""
+import base64
+import hashlib
+import secrets
+
+from django.conf import settings
+from django.contrib.auth.hashers import BasePasswordHasher, mask_hash
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import gettext_noop as _
+
+DEFAULTS = {
+    'SCRYPT_N': 2 ** 14,
+    'SCRYPT_R': 8,
+    'SCRYPT_P': 1,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'PASSWORD_HASHING', {}))
+    return config
+
+
+class ScryptPasswordHasher(BasePasswordHasher):
+    algorithm = 'scrypt'
+    dklen = 64
+
+    @property
+    def work_factor(self):
+        return get_config()['SCRYPT_N']
+
+    @property
+    def block_size(self):
+        return get_config()['SCRYPT_R']
+
+    @property
+    def parallelism(self):
+        return get_config()['SCRYPT_P']
+
+    def salt(self):
+        return secrets.token_urlsafe(16)
+
+    def _derive(self, password, salt, n, r, p):
+        # scrypt 需要约 128 * n * r * p 字节内存，留出一倍余量
+        return hashlib.scrypt(
+            password.encode(), salt=salt.encode(), n=n, r=r, p=p,
+            maxmem=256 * n * r * p, dklen=self.dklen,
+        )
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        assert password is not None
+        assert salt and '$' not in salt
+        n = n or self.work_factor
+        r = r or self.block_size
+        p = p or self.parallelism
+        hash_ = base64.b64encode(self._derive(password, salt, n, r, p)).decode('ascii')
+        return '%s$%d$%s$%d$%d$%s' % (self.algorithm, n, salt, r, p, hash_)
+
+    def decode(self, encoded):
+        algorithm, n, salt, r, p, hash_ = encoded.split('$', 5)
+        assert algorithm == self.algorithm
+        return {
+            'algorithm': algorithm,
+            'work_factor': int(n),
+            'salt': salt,
+            'block_size': int(r),
+            'parallelism': int(p),
+            'hash': hash_,
+        }
+
+    def verify(self, password, encoded):
+        decoded = self.decode(encoded)
+        encoded_2 = self.encode(password, decoded['salt'], decoded['work_factor'],
+                                decoded['block_size'], decoded['parallelism'])
+        return constant_time_compare(encoded, encoded_2)
+
+    def safe_summary(self, encoded):
+        decoded = self.decode(encoded)
+        return {
+            _('algorithm'): decoded['algorithm'],
+            _('work factor'): decoded['work_factor'],
+            _('block size'): decoded['block_size'],
+            _('parallelism'): decoded['parallelism'],
+            _('salt'): mask_hash(decoded['salt']),
+            _('hash'): mask_hash(decoded['hash']),
+        }
+
+    def must_update(self, encoded):
+        decoded = self.decode(encoded)
+        return (decoded['work_factor'], decoded['block_size'], decoded['parallelism']) != \
+            (self.work_factor, self.block_size, self.parallelism)
+
+    def harden_runtime(self, password, encoded):
+        # 参数不同时 verify 的耗时不同，这里不做补偿（与 Django 4.0 一致）
+        pass
@@ -0,0 +1,305 @@
+"""
+后台图片处理。
+
+上传的原图直接保存，请求立即返回；事务提交后图片 id 被放进队列，
+由线程负责读写存储和数据库，Pillow 的压缩缩放交给进程池（CPU 密集，不受 GIL 限制）。
+
+配置 settings.IMAGE_PIPELINE：
+    MODE        'process'（默认）后台进程池；'sync' 在当前线程内同步处理（测试/脚本用）
+    WORKERS     进程池大小，默认 2
+    RENDITIONS  {名称: (最长边, 质量)}，默认见 imaging.DEFAULT_RENDITIONS
+    FORMATS     输出格式，默认 ('jpeg', 'webp')
+    MAX_UPLOAD_BYTES  单张上传的字节上限，默认 20MB
+    MAX_PIXELS        宽×高上限，默认 4000 万像素；上传时只读文件头检查，不解码
+    SPOOL_BYTES       非本地存储的原图超过该大小时先落到临时文件再交给子进程，默认 1MB
+    PYTHON      启动进程池子进程的 Python 解释器，默认 None（自动选择，见 python_executable）
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from rest_framework.exceptions import ValidationError
+
+from . import imaging, response_cache
+from .instrumentation import timed
+from .models import Comment, Image, ImageBlob, Post, touch
+from .storage import content_digest, digest_from_name
+
+logger = logging.getLogger(__name__)
+
+RENDITION_DIR = 'renditions'
+
+_lock = threading.Lock()
+_process_pool = None
+_dispatcher = None
+
+
+def get_config():
+    config = {
+        'MODE': 'process',
+        'WORKERS': 2,
+        'RENDITIONS': imaging.DEFAULT_RENDITIONS,
+        'FORMATS': imaging.DEFAULT_FORMATS,
+        'MAX_UPLOAD_BYTES': 20 * 1024 * 1024,
+        'MAX_PIXELS': imaging.DEFAULT_MAX_PIXELS,
+        'SPOOL_BYTES': 1024 * 1024,
+        'PYTHON': None,
+    }
+    config.update(getattr(settings, 'IMAGE_PIPELINE', {}))
+    return config
+
+
+def python_executable(config):
+    """
+    spawn 子进程用的解释器。uwsgi 里 sys.executable 是 uwsgi 程序本身，拿它启动子进程会再起一个 uwsgi，
+    这时用 PYTHON 配置或 sys.prefix（uwsgi 的 home/virtualenv 指向的虚拟环境）下的 python；都没有时返回 None
+    """
+    if config['PYTHON']:
+        return config['PYTHON']
+    if os.path.basename(sys.executable).startswith('python'):
+        return sys.executable
+    for name in ('python3', 'python'):
+        path = os.path.join(sys.prefix, 'bin', name)
+        if os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def _pools(config):
+    global _process_pool, _dispatcher
+    with _lock:
+        if _process_pool is None:
+            workers = config['WORKERS']
+            executable = python_executable(config)
+            if executable is None:
+                logger.warning('no python interpreter found for image workers, rendering in threads')
+                _process_pool = ThreadPoolExecutor(workers, thread_name_prefix='image-render')
+            else:
+                # spawn 出来的子进程只运行 imaging.render，不继承父进程的数据库连接和锁
+                context = multiprocessing.get_context('spawn')
+                context.set_executable(executable)
+                _process_pool = ProcessPoolExecutor(workers, mp_context=context)
+            _dispatcher = ThreadPoolExecutor(workers, thread_name_prefix='image-pipeline')
+        return _process_pool, _dispatcher
+
+
+def shutdown():
+    global _process_pool, _dispatcher
+    with _lock:
+        if _process_pool is not None:
+            _dispatcher.shutdown(wait=True)
+            _process_pool.shutdown(wait=True)
+        _process_pool = _dispatcher = None
+
+
+def validate_upload(upload, config=None):
+    """
+    在保存之前检查上传文件：大小、是否为可识别的图片、像素数。
+    只读取文件头，不会把像素解码进内存。不合格时抛出 ValidationError。
+    """
+    config = config or get_config()
+    if upload.size > config['MAX_UPLOAD_BYTES']:
+        raise ValidationError({'image': [f'Image larger than {config["MAX_UPLOAD_BYTES"]} bytes.']})
+    try:
+        with timed('image'):
+            _, width, height = imaging.inspect(upload)
+        imaging.check_pixels(width, height, config['MAX_PIXELS'])
+    except imaging.ImageTooLarge as exc:
+        raise ValidationError({'image': [str(exc)]})
+    except Exception:
+        raise ValidationError({'image': ['Upload a valid image.']})
+    finally:
+        upload.seek(0)
+
+
+def enqueue(image_id):
+    """提交一张图片去处理；在事务里调用时会等到提交之后才真正入队"""
+    transaction.on_commit(lambda: _submit(image_id))
+
+
+def enqueue_image(image):
+    """
+    新建的 Image：如果同一内容已经处理过，直接复用已有的各尺寸图片，
+    否则放进处理队列。
+    """
+    if image.blob_id is not None:
+        done = Image.objects.filter(blob_id=image.blob_id, status=Image.READY) \
+            .exclude(pk=image.pk).values_list('renditions', flat=True).first()
+        if done is not None:
+            Image.objects.filter(pk=image.pk).update(status=Image.READY, renditions=done)
+            image.status, image.renditions = Image.READY, done
+            return
+    enqueue(image.pk)
+
+
+def touch_owners(images):
+    """图片状态变化后刷新所属帖子/评论的 update_at"""
+    owners = list(images.values_list('post_id', 'comment_id'))
+    touch(Post, [post_id for post_id, _ in owners])
+    touch(Comment, [comment_id for _, comment_id in owners])
+    response_cache.bump_posts([post_id for post_id, _ in owners])
+
+
+def release_image(image):
+    """
+    Image 被删除后释放它对存储文件的引用，没有引用时在事务提交后删除文件。
+    删除前会锁住 blob 再检查一次：这期间同一内容又被上传、重新有了引用时保留文件
+    """
+    if image.blob_id is None or not ImageBlob.release(image.blob_id):
+        return
+    renditions = [path for files in (image.renditions or {}).values() for path in files.values()]
+
+    def delete_files(blob):
+        # 原图按 blob.name 删除：这才是同一内容唯一的那个文件
+        for path in [blob.name] + renditions:
+            image.image.storage.delete(path)
+    transaction.on_commit(lambda: ImageBlob.delete_unreferenced(image.blob_id, delete_files))
+
+
+def replace_images(queryset, uploads, **owner):
+    """
+    用新上传的文件替换 queryset 中的图片：内容相同的保留原来的 Image（不重新处理），
+    其余的删除，多出来的新建。owner 为新建 Image 时的 post= 或 comment=。
+    返回是否有图片被新建或删除。
+    """
+    existing = {}
+    changed = False
+    for image in queryset.select_related('blob'):
+        if image.blob is not None and image.blob.sha256 not in existing:
+            existing[image.blob.sha256] = image
+        else:
+            image.delete()
+            changed = True
+    for upload in uploads:
+        if existing.pop(content_digest(upload), None) is None:
+            Image.objects.create(image=upload, **owner)
+            changed = True
+    for image in existing.values():
+        image.delete()
+        changed = True
+    return changed
+
+
+def append_images(queryset, uploads, **owner):
+    """追加图片，已经有相同内容的跳过；返回是否新建了图片"""
+    existing = set(queryset.exclude(blob=None).values_list('blob__sha256', flat=True))
+    changed = False
+    for upload in uploads:
+        digest = content_digest(upload)
+        if digest not in existing:
+            Image.objects.create(image=upload, **owner)
+            existing.add(digest)
+            changed = True
+    return changed
+
+
+def remove_images(queryset, ids):
+    """删除 queryset 中 id 在 ids 里的图片；返回是否删除了图片"""
+    if not ids:
+        return False
+    removed = 0
+    for image in queryset.filter(id__in=ids):
+        image.delete()
+        removed += 1
+    return removed > 0
+
+
+def _submit(image_id):
+    config = get_config()
+    if config['MODE'] == 'sync':
+        process_image(image_id, config)
+        return
+    pool, dispatcher = _pools(config)
+    dispatcher.submit(_run_in_background, image_id, config, pool)
+
+
+def _run_in_background(image_id, config, pool):
+    close_old_connections()
+    try:
+        process_image(image_id, config, pool)
+    except Exception:
+        logger.exception('image %s processing failed', image_id)
+    finally:
+        close_old_connections()
+
+
+def _source(image, config):
+    """返回 (交给子进程的路径或字节, 需要清理的临时文件)"""
+    try:
+        return image.image.path, None
+    except NotImplementedError:
+        pass
+    # 非本地文件存储：小图直接读成字节，大图分块拷到临时文件，避免整张图读进内存
+    with image.image.open('rb') as f:
+        if image.image.size <= config['SPOOL_BYTES']:
+            return f.read(), None
+        tmp = tempfile.NamedTemporaryFile(suffix=os.path.splitext(image.image.name)[1], delete=False)
+        with tmp:
+            shutil.copyfileobj(f, tmp, 64 * 1024)
+        return tmp.name, tmp.name
+
+
+def rendition_name(image, name, fmt):
+    digest = digest_from_name(image.image.name)
+    if digest:
+        # 同一内容的各尺寸图片也只存一份
+        return f'{RENDITION_DIR}/{digest[:2]}/{digest}_{name}.{fmt}'
+    stem = os.path.splitext(os.path.basename(image.image.name))[0]
+    return f'{RENDITION_DIR}/{image.pk}/{stem}_{name}.{fmt}'
+
+
+def process_image(image_id, config=None, pool=None):
+    """生成所有规格并更新 Image.status / renditions；返回是否成功"""
+    config = config or get_config()
+    image = Image.objects.filter(pk=image_id).first()
+    if image is None:
+        return False
+    tmp_path = None
+    try:
+        source, tmp_path = _source(image, config)
+        args = (source, config['RENDITIONS'], config['FORMATS'], config['MAX_PIXELS'])
+        with timed('image'):  # 同步模式下计入当前请求
+            outputs = pool.submit(imaging.render, *args).result() if pool else imaging.render(*args)
+    except Exception:
+        logger.exception('image %s could not be rendered', image_id)
+        Image.objects.filter(pk=image_id).update(status=Image.FAILED)
+        touch_owners(Image.objects.filter(pk=image_id))
+        return False
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
+
+    renditions = {}
+    for (name, fmt), data in outputs.items():
+        path = rendition_name(image, name, fmt)
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        renditions.setdefault(name, {})[fmt] = default_storage.save(path, ContentFile(data))
+    same_content = Image.objects.filter(blob_id=image.blob_id) if image.blob_id else Image.objects.filter(pk=image_id)
+    same_content.update(status=Image.READY, renditions=renditions)
+    touch_owners(same_content)
+    return True
+
+
+def process_pending(statuses=(Image.PENDING,), limit=None):
+    """同步处理积压/失败的图片，供管理命令使用"""
+    config = get_config()
+    queryset = Image.objects.filter(status__in=statuses).order_by('id').values_list('id', flat=True)
+    if limit:
+        queryset = queryset[:limit]
+    done = failed = 0
+    for image_id in list(queryset):
+        if process_image(image_id, config):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
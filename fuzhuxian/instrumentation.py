@@ -0,0 +1,369 @@
+"""
+按请求统计耗时：SQL（次数和时间）、序列化、JSON 渲染、图片处理、响应大小。
+
+RequestMetricsMiddleware 对每个请求：
+  - 在响应头里加 Server-Timing（浏览器开发者工具和压测脚本都能直接看到）
+  - 往 logger 'fuzhuxian.metrics' 写一行 JSON
+  - 按接口（请求方法 + URL 名称，例如 GET:post-list）累加直方图，
+    由管理员接口 /metrics/ 查看（见 views.RequestMetricsView）
+
+代码里用 timed('image') 之类的上下文管理器给某一段计时；不在请求里（后台线程、管理命令）时不做任何事。
+直方图先在进程内累加，每 FLUSH_EVERY 个请求或 FLUSH_SECONDS 秒合并到本机的 SQLite 文件（STORE_PATH）一次，
+uwsgi 的各进程写同一个文件，/metrics/ 看到的是所有进程的合计（默认的 locmem 缓存是每个进程各一份，不能用来合计）。
+STORE_PATH 为 None 时只在进程内存里合计（测试/单进程）。写入失败只记日志，不影响请求。
+
+配置 settings.METRICS：
+    ENABLED        默认 True
+    STORE_PATH     SQLite 文件路径，默认系统临时目录下的 forum_backend-metrics.sqlite3
+    BUCKETS_MS     直方图的分桶上界（毫秒），默认 (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+    FLUSH_EVERY    默认 50
+    FLUSH_SECONDS  默认 10
+    LOG            是否写 JSON 日志，默认 True
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+logger = logging.getLogger('fuzhuxian.metrics')
+
+PHASES = ('db', 'serialize', 'render', 'image')
+HISTOGRAMS = ('total',) + PHASES
+
+_current = ContextVar('request_metrics', default=None)
+
+
+def get_config():
+    config = {
+        'ENABLED': True,
+        'STORE_PATH': os.path.join(tempfile.gettempdir(), 'forum_backend-metrics.sqlite3'),
+        'BUCKETS_MS': (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+        'FLUSH_EVERY': 50,
+        'FLUSH_SECONDS': 10,
+        'LOG': True,
+    }
+    config.update(getattr(settings, 'METRICS', {}))
+    return config
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.durations = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.depth = 0  # 序列化器嵌套深度，只给最外层计时
+
+    def add(self, phase, seconds):
+        self.durations[phase] += seconds
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.add('db', time.perf_counter() - start)
+
+
+def install_query_recorder(connection):
+    """
+    每个数据库连接（每个线程各有一个）建立时挂上 record_query（见 signals）。
+    按 contextvar 找到当前请求，ASGI 下在线程池里执行的查询也能记到发起它的请求上。
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def timed(phase):
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(phase, time.perf_counter() - start)
+
+
+class TimedSerializerMixin:
+    """给最外层的 to_representation 计时（列表按每个对象累加），嵌套的序列化器不重复计时"""
+
+    def to_representation(self, instance):
+        metrics = _current.get()
+        if metrics is None or metrics.depth:
+            return super().to_representation(instance)
+        metrics.depth += 1
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.depth -= 1
+            metrics.add('serialize', time.perf_counter() - start)
+
+
+def bucket_label(ms, bounds):
+    for bound in bounds:
+        if ms <= bound:
+            return f'le{bound}'
+    return 'inf'
+
+
+def endpoint_name(request):
+    match = getattr(request, 'resolver_match', None)
+    name = match.view_name if match is not None and match.view_name else 'unmatched'
+    return f'{request.method}:{name}'
+
+
+class Histograms:
+    """进程内累加，定期合并到 get_store()；计数的键为 (接口, 名称)，例如 ('GET:post-list', 'total:le50')"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = Counter()
+        self.requests = 0
+        self.flushed_at = time.monotonic()
+
+    def add(self, endpoint, timings_ms, queries, size):
+        config = get_config()
+        bounds = config['BUCKETS_MS']
+        with self.lock:
+            pending = self.pending
+            pending[(endpoint, 'count')] += 1
+            pending[(endpoint, 'queries')] += queries
+            pending[(endpoint, 'bytes')] += size or 0
+            for name in HISTOGRAMS:
+                ms = timings_ms[name]
+                pending[(endpoint, f'{name}:sum_us')] += int(ms * 1000)
+                pending[(endpoint, f'{name}:{bucket_label(ms, bounds)}')] += 1
+            self.requests += 1
+            due = self.requests >= config['FLUSH_EVERY'] or \
+                time.monotonic() - self.flushed_at >= config['FLUSH_SECONDS']
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            self.requests = 0
+            self.flushed_at = time.monotonic()
+        if not pending:
+            return
+        try:
+            get_store().add(pending)
+        except sqlite3.Error:
+            logger.warning('metrics store unavailable, %s counters dropped', len(pending), exc_info=True)
+
+    def clear(self):
+        with self.lock:
+            self.pending = Counter()
+            self.requests = 0
+
+
+histograms = Histograms()
+
+
+class MemoryMetricsStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def add(self, counts):
+        with self.lock:
+            self.counts.update(counts)
+
+    def read(self):
+        """返回 {接口: {名称: 值}}"""
+        result = {}
+        with self.lock:
+            for (endpoint, name), value in self.counts.items():
+                result.setdefault(endpoint, {})[name] = value
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.counts.clear()
+
+
+class SqliteMetricsStore:
+    """同一台机器上的多个进程共用的计数；每个线程一个连接，一次合并是一个短事务"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # 统计丢一点无所谓，不需要每次落盘
+            conn.execute('CREATE TABLE IF NOT EXISTS metric (endpoint TEXT NOT NULL, name TEXT NOT NULL, '
+                         'value INTEGER NOT NULL, PRIMARY KEY (endpoint, name)) WITHOUT ROWID')
+            self.local.conn = conn
+        return conn
+
+    def add(self, counts):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT INTO metric (endpoint, name, value) VALUES (?, ?, ?) '
+                             'ON CONFLICT (endpoint, name) DO UPDATE SET value = value + excluded.value',
+                             [(endpoint, name, value) for (endpoint, name), value in counts.items()])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def read(self):
+        result = {}
+        for endpoint, name, value in self.connection().execute('SELECT endpoint, name, value FROM metric'):
+            result.setdefault(endpoint, {})[name] = value
+        return result
+
+    def clear(self):
+        self.connection().execute('DELETE FROM metric')
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    path = get_config()['STORE_PATH']
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = SqliteMetricsStore(path) if path else MemoryMetricsStore()
+        return _stores[path]
+
+
+def estimate_percentile(buckets, count, pct, bounds):
+    """直方图只能给出分位数所在分桶的上界；落在最后一个桶（超过最大上界）时返回 None"""
+    seen = 0
+    for bound in bounds:
+        seen += buckets.get(f'le{bound}', 0)
+        if seen >= pct / 100 * count:
+            return bound
+    return None
+
+
+def snapshot():
+    """所有接口的统计，先把本进程还没合并的部分写进存储"""
+    histograms.flush()
+    bounds = get_config()['BUCKETS_MS']
+    labels = [f'le{bound}' for bound in bounds] + ['inf']
+    result = {}
+    for endpoint, values in sorted(get_store().read().items()):
+        count = values.get('count', 0)
+        if not count:
+            continue
+        timings = {}
+        for name in HISTOGRAMS:
+            buckets = {label: values.get(f'{name}:{label}', 0) for label in labels}
+            timings[name] = {
+                'mean_ms': round(values.get(f'{name}:sum_us', 0) / 1000 / count, 3),
+                'p50_ms': estimate_percentile(buckets, count, 50, bounds),
+                'p95_ms': estimate_percentile(buckets, count, 95, bounds),
+                'p99_ms': estimate_percentile(buckets, count, 99, bounds),
+                'buckets': buckets,
+            }
+        result[endpoint] = {
+            'count': count,
+            'queries_per_request': round(values.get('queries', 0) / count, 2),
+            'bytes_per_request': round(values.get('bytes', 0) / count),
+            'timings': timings,
+        }
+    return result
+
+
+def reset():
+    histograms.clear()
+    get_store().clear()
+
+
+def server_timing(timings_ms, queries):
+    parts = [f'db;dur={timings_ms["db"]:.1f};desc="{queries} queries"']
+    parts += [f'{name};dur={timings_ms[name]:.1f}' for name in ('serialize', 'render', 'image') if timings_ms[name]]
+    parts.append(f'total;dur={timings_ms["total"]:.1f}')
+    return ', '.join(parts)
+
+
+class RequestMetricsMiddleware:
+    """放在 MIDDLEWARE 的前面，total 才包含其它中间件的耗时；WSGI 和 ASGI 下都可以用"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # 和 Django 的 MiddlewareMixin 一样，让 ASGI 处理器把这个中间件当作协程调用
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not get_config()['ENABLED']:
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not get_config()['ENABLED']:
+            return await self.get_response(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF 的 Response 在所有中间件的 process_template_response 之后才渲染成 JSON
+        metrics = _current.get()
+        if metrics is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                metrics.add('render', time.perf_counter() - start)
+            response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, metrics, total):
+        timings_ms = {name: seconds * 1000 for name, seconds in metrics.durations.items()}
+        timings_ms['total'] = total * 1000
+        size = None if response.streaming else len(response.content)
+        endpoint = endpoint_name(request)
+        response['Server-Timing'] = server_timing(timings_ms, metrics.queries)
+        histograms.add(endpoint, timings_ms, metrics.queries, size)
+        if get_config()['LOG']:
+            logger.info(json.dumps({
+                'endpoint': endpoint,
+                'path': request.path,
+                'status': response.status_code,
+                'queries': metrics.queries,
+                'bytes': size,
+                **{f'{name}_ms': round(ms, 3) for name, ms in timings_ms.items()},
+            }))
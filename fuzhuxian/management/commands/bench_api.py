@@ -0,0 +1,195 @@
+import json
+import random
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from fuzhuxian import synthetic
+from fuzhuxian.benchmarks import format_row, scratch_data, summarize
+from fuzhuxian.models import Comment, Image, Post, Tag
+
+SCENARIOS = (
+    'post_list', 'post_list_compact', 'post_list_cursor', 'post_detail', 'post_comments',
+    'search', 'similar_posts', 'login', 'comment_create', 'image_upload',
+)
+
+
+class Workload:
+    """各个场景的一次请求；参数按 seed 随机抽取，可复现"""
+
+    def __init__(self, rng, password):
+        host = (settings.ALLOWED_HOSTS or ['localhost'])[0]
+        self.rng = rng
+        self.password = password
+        self.client = APIClient(SERVER_NAME=host)
+        self.user = synthetic.synthetic_users().order_by('id').first()
+        self.author = APIClient(SERVER_NAME=host)
+        self.author.force_authenticate(self.user)
+        self.numbers = list(synthetic.synthetic_users().values_list('number', flat=True)[:1000])
+        post_ids = list(Post.objects.order_by('id').values_list('id', flat=True))
+        self.post_ids = rng.sample(post_ids, min(len(post_ids), 1000))
+        self.pages = max(1, Post.objects.count() // settings.REST_FRAMEWORK['PAGE_SIZE'])
+        self.tags = list(Tag.objects.filter(post__isnull=False).distinct().values_list('name', flat=True)[:200])
+        titles = Post.objects.filter(pk__in=self.post_ids[:200]).values_list('title', flat=True)
+        self.words = [word for title in titles for word in title.split()] or ['post']
+        self.images = [synthetic.variant_image(i) for i in range(5)]
+
+    def post_list(self):
+        return self.client.get(f'/posts/?page={self.rng.randint(1, min(self.pages, 50))}')
+
+    def post_list_compact(self):
+        return self.client.get(f'/posts/?compact=true&page={self.rng.randint(1, min(self.pages, 50))}')
+
+    def post_list_cursor(self):
+        return self.client.get(f'/posts/?pagination=cursor&status={self.rng.choice("nia")}')
+
+    def post_detail(self):
+        return self.client.get(f'/posts/{self.rng.choice(self.post_ids)}/')
+
+    def post_comments(self):
+        return self.client.get(f'/posts/{self.rng.choice(self.post_ids)}/comments/')
+
+    def search(self):
+        return self.client.get('/posts/search/', {'q': ' '.join(self.rng.sample(self.words, self.rng.randint(1, 2)))})
+
+    def similar_posts(self):
+        tags = self.rng.sample(self.tags, min(len(self.tags), self.rng.randint(1, 3)))
+        return self.client.post('/similar_posts/', {'tags': tags}, format='json')
+
+    def login(self):
+        return self.client.post('/user/custom-token/',
+                                {'number': self.rng.choice(self.numbers), 'password': self.password}, format='json')
+
+    def comment_create(self):
+        return self.author.post('/comments/', {'post': self.rng.choice(self.post_ids), 'body': 'benchmark'},
+                                format='json')
+
+    def image_upload(self):
+        upload = SimpleUploadedFile('bench.png', self.rng.choice(self.images), content_type='image/png')
+        return self.author.post('/images/', {'post': self.rng.choice(self.post_ids), 'image': upload})
+
+
+class Command(BaseCommand):
+    help = ('在进程内依次压测主要接口（需要先运行 generate_forum），报告吞吐、p50/p95/p99 和每次请求的查询数；'
+            '结果可以保存为 JSON，和其它提交的结果对比。写请求在事务中执行，结束后回滚')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='逗号分隔，可选：' + ', '.join(SCENARIOS))
+        parser.add_argument('--password', default=synthetic.DEFAULT_PASSWORD)
+        parser.add_argument('--no-response-cache', action='store_true', help='关闭帖子接口的响应缓存')
+        parser.add_argument('--output', help='把结果写到这个 JSON 文件')
+        parser.add_argument('--compare', help='与之前保存的 JSON 结果对比')
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'unknown scenarios: {", ".join(sorted(unknown))}')
+        if not synthetic.synthetic_users().exists():
+            raise CommandError('no synthetic data, run generate_forum first')
+        baseline = self.load(options['compare']) if options['compare'] else None
+
+        # 测的是接口本身，不让限流把重复请求挡掉
+        overrides = {
+            'METRICS': dict(getattr(settings, 'METRICS', {}), LOG=False),
+            'THROTTLE': dict(getattr(settings, 'THROTTLE', {}), ENABLED=False),
+        }
+        if options['no_response_cache']:
+            overrides['RESPONSE_CACHE'] = dict(getattr(settings, 'RESPONSE_CACHE', {}), ENABLED=False)
+        results = {}
+        with override_settings(**overrides), scratch_data():
+            workload = Workload(random.Random(options['seed']), options['password'])
+            for name in names:
+                results[name] = self.run(getattr(workload, name), options['repeat'], options['warmup'])
+                self.stdout.write('{} q/req={:<6} errors={}'.format(
+                    format_row(name, results[name]), results[name]['queries_per_request'], results[name]['errors']))
+
+        report = {'meta': self.meta(options), 'results': results}
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f'saved {options["output"]}')
+        if baseline is not None:
+            self.compare(baseline, report)
+
+    @staticmethod
+    def run(request, repeat, warmup):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        samples = []
+        errors = 0
+        for i in range(warmup + repeat):
+            if i == warmup:
+                queries = 0
+            with connection.execute_wrapper(count):
+                start = time.perf_counter()
+                response = request()
+                elapsed = time.perf_counter() - start
+            if i >= warmup:
+                samples.append(elapsed)
+                errors += response.status_code >= 400
+        stats = summarize(samples)
+        stats['queries_per_request'] = round(queries / repeat, 2) if repeat else 0.0
+        stats['errors'] = errors
+        return stats
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'created_at': timezone.now().isoformat(),
+            'commit': commit,
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'dataset': {
+                'users': synthetic.synthetic_users().count(),
+                'posts': Post.objects.count(),
+                'comments': Comment.objects.count(),
+                'images': Image.objects.count(),
+                'tags': Tag.objects.count(),
+            },
+            'options': {key: options[key] for key in ('repeat', 'warmup', 'seed', 'no_response_cache')},
+        }
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'cannot read {path}: {exc}')
+
+    def compare(self, baseline, report):
+        self.stdout.write(f'compared with {baseline["meta"].get("commit")} ({baseline["meta"].get("created_at")})')
+        for name, new in report['results'].items():
+            old = baseline['results'].get(name)
+            if old is None:
+                continue
+            self.stdout.write('{:<28} p50 {:>9.3f} -> {:>9.3f}ms ({:+.1%})  p95 {:>9.3f} -> {:>9.3f}ms  '
+                              'q/req {} -> {}'.format(
+                                  name, old['p50_ms'], new['p50_ms'], change(old['p50_ms'], new['p50_ms']),
+                                  old['p95_ms'], new['p95_ms'], old['queries_per_request'],
+                                  new['queries_per_request']))
+
+
+def change(old, new):
+    return (new - old) / old if old else 0.0
@@ -0,0 +1,182 @@
+import asyncio
+import io
+import json
+import random
+import sys
+import time
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+
+from fuzhuxian.benchmarks import format_row, summarize
+from fuzhuxian.models import Post, Tag
+
+ENDPOINTS = ('list', 'detail', 'comments', 'similar')
+
+
+class SlowQueries:
+    """给每条 SQL 加上固定延迟，模拟 MySQL 的网络往返（SQLite 在本进程内，几乎没有等待）"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.seconds)
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = ('在同一个进程里比较 WSGI（同步接口，一个 worker 一次处理一个请求）和 ASGI（/async/ 接口，'
+            '一个 worker 的事件循环同时处理多个请求）的吞吐和延迟；需要先运行 generate_forum')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument('--concurrency', type=int, default=16, help='ASGI 同时在处理的请求数')
+        parser.add_argument('--db-latency-ms', type=float, default=2.0, help='每条 SQL 额外的等待，0 表示不加')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='逗号分隔，可选：' + ', '.join(ENDPOINTS))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='把结果写到这个 JSON 文件')
+
+    def handle(self, *args, **options):
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        if set(endpoints) - set(ENDPOINTS):
+            raise CommandError(f'unknown endpoints: {", ".join(sorted(set(endpoints) - set(ENDPOINTS)))}')
+        if not Post.objects.exists():
+            raise CommandError('no posts, run generate_forum first')
+
+        self.host = (settings.ALLOWED_HOSTS or ['localhost'])[0]
+        rng = random.Random(options['seed'])
+        self.post_ids = rng.sample(list(Post.objects.values_list('id', flat=True)), min(Post.objects.count(), 1000))
+        self.tags = list(Tag.objects.filter(post__isnull=False).distinct().values_list('name', flat=True)[:200])
+        self.pages = max(1, min(50, Post.objects.count() // settings.REST_FRAMEWORK['PAGE_SIZE']))
+
+        slow = SlowQueries(options['db_latency_ms'] / 1000)
+        if slow.seconds:
+            slow.install()
+            connection_created.connect(slow.install)
+        # 比较的是两种服务方式本身，不让响应缓存、限流和日志影响结果
+        overrides = {
+            'RESPONSE_CACHE': dict(getattr(settings, 'RESPONSE_CACHE', {}), ENABLED=False),
+            'THROTTLE': dict(getattr(settings, 'THROTTLE', {}), ENABLED=False),
+            'METRICS': dict(getattr(settings, 'METRICS', {}), LOG=False),
+        }
+        results = {}
+        try:
+            with override_settings(**overrides):
+                wsgi, asgi = WSGIHandler(), ASGIHandler()
+                for name in endpoints:
+                    plan = [self.make_request(name, rng) for _ in range(options['requests'])]
+                    results[name] = {
+                        'wsgi': self.run_wsgi(wsgi, plan),
+                        'asgi': asyncio.run(self.run_asgi(asgi, plan, options['concurrency'])),
+                    }
+                    self.report(name, results[name])
+        finally:
+            connection_created.disconnect(slow.install)
+            if slow in connection.execute_wrappers:
+                connection.execute_wrappers.remove(slow)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'options': {key: options[key] for key in ('requests', 'concurrency', 'db_latency_ms')},
+                           'results': results}, f, indent=2)
+            self.stdout.write(f'saved {options["output"]}')
+
+    def make_request(self, name, rng):
+        """返回 (方法, 同步路径, 异步路径, 查询串, 请求体)"""
+        post_id = rng.choice(self.post_ids)
+        if name == 'list':
+            return 'GET', '/posts/', '/async/posts/', f'page={rng.randint(1, self.pages)}', b''
+        if name == 'detail':
+            return 'GET', f'/posts/{post_id}/', f'/async/posts/{post_id}/', '', b''
+        if name == 'comments':
+            return 'GET', f'/posts/{post_id}/comments/', f'/async/posts/{post_id}/comments/', '', b''
+        body = json.dumps({'tags': rng.sample(self.tags, min(len(self.tags), rng.randint(1, 3)))}).encode()
+        return 'POST', '/similar_posts/', '/async/similar_posts/', '', body
+
+    def run_wsgi(self, handler, plan):
+        """uwsgi 的一个进程（没有开线程）：请求一个接一个处理"""
+        latencies = []
+        errors = 0
+        began = time.perf_counter()
+        for method, path, _, query, body in plan:
+            status = []
+            start = time.perf_counter()
+            result = handler(self.environ(method, path, query, body), lambda s, headers: status.append(s))
+            for _ in result:
+                pass
+            result.close()
+            latencies.append(time.perf_counter() - start)
+            errors += not status[0].startswith('2')
+        return throughput(latencies, time.perf_counter() - began, errors)
+
+    async def run_asgi(self, handler, plan, concurrency):
+        """一个 ASGI 进程：最多 concurrency 个请求同时在处理"""
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = 0
+
+        async def one(method, path, query, body):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                status = await self.call_asgi(handler, method, path, query, body)
+                latencies.append(time.perf_counter() - start)
+                errors += not 200 <= status < 300
+
+        began = time.perf_counter()
+        await asyncio.gather(*(one(method, path, query, body) for method, _, path, query, body in plan))
+        return throughput(latencies, time.perf_counter() - began, errors)
+
+    def environ(self, method, path, query, body):
+        return {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': self.host, 'SERVER_PORT': '80', 'HTTP_HOST': self.host, 'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0), 'wsgi.multithread': False, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+        }
+
+    async def call_asgi(self, handler, method, path, query, body):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+            'headers': [(b'host', self.host.encode()), (b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode())],
+            'client': ('127.0.0.1', 0), 'server': (self.host, 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()  # 客户端一直不断开
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await handler(scope, receive, send)
+        return status[0]
+
+    def report(self, name, result):
+        for mode in ('wsgi', 'asgi'):
+            self.stdout.write('{} errors={}'.format(format_row(f'{name} {mode}', result[mode]), result[mode]['errors']))
+
+
+def throughput(latencies, elapsed, errors):
+    """并发执行时各请求的耗时有重叠，每秒请求数按实际经过的时间算"""
+    stats = summarize(latencies)
+    stats['per_sec'] = round(len(latencies) / elapsed, 1) if elapsed else 0.0
+    stats['errors'] = errors
+    return stats
@@ -0,0 +1,72 @@
+import io
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from PIL import Image as PilImage
+
+from fuzhuxian import imaging
+
+
+def _legacy(path):
+    # 旧的 Image.save：上传整体在内存里，完整解码后以 quality=20 重新压缩到 BytesIO
+    with open(path, 'rb') as f:
+        upload = io.BytesIO(f.read())
+    im = PilImage.open(upload)
+    if im.mode in ('RGBA', 'P'):
+        im = im.convert('RGB')
+    output = io.BytesIO()
+    im.save(output, format=im.format or 'JPEG', quality=20)
+    return output.tell()
+
+
+def _streaming(path):
+    return sum(len(data) for data in imaging.render(path).values())
+
+
+def _measure(method, path):
+    """在独立子进程里运行，返回 (耗时秒, 峰值 RSS 增量 KB, 输出字节数)"""
+    func = {'legacy': _legacy, 'streaming': _streaming}[method]
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    size = func(path)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, peak - before, size
+
+
+class Command(BaseCommand):
+    help = '比较旧的整图解码方式和流式缩小方式处理单张大图时的耗时与峰值内存'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=6000)
+        parser.add_argument('--height', type=int, default=4000)
+        parser.add_argument('--format', default='JPEG', choices=['JPEG', 'PNG'])
+        parser.add_argument('--source', help='使用已有的图片文件，而不是生成一张')
+
+    def handle(self, *args, **options):
+        path = options['source']
+        tmp = None
+        if not path:
+            tmp = tempfile.NamedTemporaryFile(suffix='.' + options['format'].lower(), delete=False)
+            tmp.close()
+            path = tmp.name
+            # 带噪声的图片，避免压缩率过高导致结果失真
+            im = PilImage.effect_noise((options['width'], options['height']), 64).convert('RGB')
+            im.save(path, format=options['format'], quality=90)
+            del im
+        try:
+            self.stdout.write(f'source: {path} ({os.path.getsize(path) // 1024} KB)')
+            ctx = multiprocessing.get_context('spawn')
+            for method in ('legacy', 'streaming'):
+                with ctx.Pool(1) as pool:
+                    elapsed, rss_kb, size = pool.apply(_measure, (method, path))
+                self.stdout.write(
+                    f'{method:<10} {elapsed * 1000:>9.1f} ms  peak RSS +{rss_kb / 1024:>7.1f} MB  output {size // 1024} KB'
+                )
+        finally:
+            if tmp is not None:
+                os.unlink(path)
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+from rest_framework_simplejwt.views import TokenObtainPairView
+
+from fuzhuxian.benchmarks import format_row, measure, scratch_data
+from fuzhuxian.models import CustomUser
+from fuzhuxian.views import CustomTokenObtainView
+
+
+class LegacyTokenObtainView(APIView):
+    """旧实现：按学号查到用户名后，构造内部请求转发给 TokenObtainPairView"""
+    permission_classes = []
+
+    def post(self, request, *args, **kwargs):
+        try:
+            user = CustomUser.objects.get(number=request.data.get('number'))
+        except CustomUser.DoesNotExist:
+            return Response({'error': 'Invalid number or password'}, status=status.HTTP_401_UNAUTHORIZED)
+        token_request = APIRequestFactory().post('/user/token/', {
+            'username': user.username,
+            'password': request.data.get('password'),
+        }, format='json')
+        token_response = TokenObtainPairView.as_view()(token_request)
+        if token_response.status_code == status.HTTP_200_OK:
+            return Response(token_response.data, status=status.HTTP_200_OK)
+        return Response({'error': 'Invalid number or password'}, status=token_response.status_code)
+
+
+class Command(BaseCommand):
+    help = '比较学号登录新旧实现的 p50/p99（数据在事务中生成，结束后回滚）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--hasher', default=None,
+                            help='临时替换密码哈希算法（如 md5），单独观察哈希以外的开销')
+
+    def handle(self, *args, **options):
+        if options['hasher']:
+            hashers = {'md5': 'django.contrib.auth.hashers.MD5PasswordHasher'}
+            with override_settings(PASSWORD_HASHERS=[hashers.get(options['hasher'], options['hasher'])]):
+                self.run(options)
+        else:
+            self.run(options)
+
+    def run(self, options):
+        factory = APIRequestFactory()
+        payload = {'number': 'bench-login', 'password': 'bench-password'}
+        views = {
+            'legacy (RequestFactory)': LegacyTokenObtainView.as_view(),
+            'direct': CustomTokenObtainView.as_view(),
+        }
+        with scratch_data():
+            CustomUser.objects.create_user(username='bench-login', number='bench-login', password='bench-password')
+            for name, view in views.items():
+                def login():
+                    response = view(factory.post('/user/custom-token/', payload, format='json'))
+                    assert response.status_code == 200, response.data
+                login()  # 预热
+                self.stdout.write(format_row(name, measure(login, options['repeat'])))
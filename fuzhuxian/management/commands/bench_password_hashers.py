@@ -0,0 +1,35 @@
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from fuzhuxian.benchmarks import format_row, measure
+from fuzhuxian.hashers import ScryptPasswordHasher, get_config
+
+
+class Command(BaseCommand):
+    help = '测量不同密码哈希算法/参数下每次校验的耗时和每秒可处理的登录数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--scrypt-n', type=int, nargs='*', default=[2 ** 13, 2 ** 14, 2 ** 15, 2 ** 16])
+        parser.add_argument('--scrypt-r', type=int, default=8)
+        parser.add_argument('--scrypt-p', type=int, default=1)
+
+    def handle(self, *args, **options):
+        password = 'bench-password'
+        pbkdf2 = PBKDF2PasswordHasher()
+        encoded = pbkdf2.encode(password, pbkdf2.salt())
+        name = f'pbkdf2 ({pbkdf2.iterations} it)'
+        self.stdout.write(format_row(name, measure(lambda: pbkdf2.verify(password, encoded), options['repeat'])))
+
+        current = get_config()
+        for n in options['scrypt_n']:
+            config = {'SCRYPT_N': n, 'SCRYPT_R': options['scrypt_r'], 'SCRYPT_P': options['scrypt_p']}
+            with override_settings(PASSWORD_HASHING=config):
+                hasher = ScryptPasswordHasher()
+                encoded = hasher.encode(password, hasher.salt())
+                stats = measure(lambda: hasher.verify(password, encoded), options['repeat'])
+            memory = 128 * n * options['scrypt_r'] * options['scrypt_p'] // (1024 * 1024)
+            name = f"scrypt N={n} r={options['scrypt_r']} p={options['scrypt_p']}"
+            marker = '  <- current' if config == {k: current[k] for k in config} else ''
+            self.stdout.write(format_row(name, stats) + f'  ~{memory}MB{marker}')
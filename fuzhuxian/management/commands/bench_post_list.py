@@ -0,0 +1,73 @@
+import random
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from fuzhuxian.benchmarks import format_row, measure, scratch_data
+from fuzhuxian.models import CustomUser, Image, Post, Tag
+from fuzhuxian.views import PostViewSet
+
+VARIANTS = (
+    ('full', ''),
+    ('compact', 'compact=true'),
+    ('compact+fields', 'compact=true&fields=id,title,status,excerpt,thumbnail'),
+    ('fields', 'fields=id,title,status'),
+)
+
+
+class Command(BaseCommand):
+    help = '比较帖子列表不同表示（完整 / 精简 / 稀疏字段）每页的字节数和耗时（数据在事务中生成，结束后回滚）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--body-length', type=int, default=2000)
+        parser.add_argument('--images-per-post', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        rest_framework = dict(settings.REST_FRAMEWORK, PAGE_SIZE=options['page_size'])
+        # 关掉响应缓存，每次都真正查询和序列化
+        with scratch_data(), override_settings(REST_FRAMEWORK=rest_framework, RESPONSE_CACHE={'ENABLED': False}):
+            self.populate(rng, options)
+            view = PostViewSet.as_view({'get': 'list'})
+            factory = APIRequestFactory(SERVER_NAME=(settings.ALLOWED_HOSTS or ['localhost'])[0])
+            pages = max(1, options['posts'] // options['page_size'])
+
+            for name, query in VARIANTS:
+                def fetch():
+                    request = factory.get(f'/posts/?page={rng.randint(1, pages)}&{query}')
+                    return view(request).render()
+
+                size = len(fetch().content)
+                stats = measure(fetch, options['repeat'])
+                self.stdout.write(f'{format_row(name, stats)} {size:>9} bytes/page')
+
+    def populate(self, rng, options):
+        self.stdout.write(f"generating {options['posts']} posts ...")
+        author = CustomUser.objects.create_user(username='bench-list', number='bench-list', password='x')
+        tags = Tag.objects.bulk_create(Tag(name=f'bench-tag-{i}') for i in range(50))
+        if not tags[0].pk:
+            tags = list(Tag.objects.filter(name__startswith='bench-tag-'))
+        body = 'x' * options['body_length']
+        posts = Post.objects.bulk_create(
+            (Post(title=f'post {i}', body=body, author=author) for i in range(options['posts'])),
+            batch_size=1000,
+        )
+        if not posts[0].pk:
+            posts = list(Post.objects.filter(author=author).order_by('id'))
+        Post.tags.through.objects.bulk_create(
+            (Post.tags.through(post=post, tag=tag) for post in posts for tag in rng.sample(tags, 3)),
+            batch_size=2000,
+        )
+        renditions = {name: {fmt: f'renditions/bench.{name}.{fmt}' for fmt in ('jpeg', 'webp')}
+                      for name in ('thumbnail', 'medium')}
+        Image.objects.bulk_create(
+            (Image(post=post, image='bench.png', status=Image.READY, renditions=renditions)
+             for post in posts for _ in range(options['images_per_post'])),
+            batch_size=2000,
+        )
@@ -0,0 +1,66 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from fuzhuxian import search
+from fuzhuxian.benchmarks import format_row, measure, scratch_data
+from fuzhuxian.models import Comment, CustomUser, Post
+
+SYLLABLES = '图书馆食堂宿舍教室实验课程考试报名作业论文老师同学社团活动比赛讲座奖学金选课成绩校园网快递自习'
+
+
+class Command(BaseCommand):
+    help = '在临时数据上测量全文检索的延迟（数据在事务中生成，结束后回滚）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--words-per-post', type=int, default=30)
+        parser.add_argument('--comments-per-post', type=int, default=1)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--legacy', action='store_true', help='同时测量 LIKE 查询')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with scratch_data():
+            vocabulary = self.populate(rng, options)
+            queries = [' '.join(rng.sample(vocabulary, rng.randint(1, 2))) for _ in range(options['repeat'])]
+
+            it = iter(queries * 2)
+            stats = measure(lambda: search.load_posts(search.rank_posts(next(it))[:5]), options['repeat'])
+            self.stdout.write(format_row('search (index)', stats))
+
+            if options['legacy']:
+                it = iter(queries * 2)
+                stats = measure(lambda: list(self.legacy_query(next(it))), options['repeat'])
+                self.stdout.write(format_row('search (LIKE)', stats))
+
+    def populate(self, rng, options):
+        self.stdout.write(f"generating {options['posts']} posts ...")
+        vocabulary = [''.join(rng.sample(SYLLABLES, rng.randint(2, 3))) for _ in range(2000)]
+        author = CustomUser.objects.create_user(username='bench-search', number='bench-search', password='x')
+
+        def text(words):
+            return ' '.join(rng.choice(vocabulary) for _ in range(words))
+
+        posts = Post.objects.bulk_create(
+            (Post(title=text(3), body=text(options['words_per_post']), author=author) for _ in range(options['posts'])),
+            batch_size=2000,
+        )
+        if not posts[0].pk:
+            posts = list(Post.objects.filter(author=author).order_by('id'))
+        Comment.objects.bulk_create(
+            (Comment(post=post, body=text(10), author=author)
+             for post in posts for _ in range(options['comments_per_post'])),
+            batch_size=2000,
+        )
+        search.rebuild_index()
+        return vocabulary
+
+    @staticmethod
+    def legacy_query(q):
+        query = Q()
+        for word in q.split():
+            query &= Q(title__icontains=word) | Q(body__icontains=word) | Q(comments__body__icontains=word)
+        return Post.objects.filter(query).distinct()[:5]
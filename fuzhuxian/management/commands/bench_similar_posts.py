@@ -0,0 +1,65 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from fuzhuxian import similarity
+from fuzhuxian.benchmarks import format_row, measure, scratch_data
+from fuzhuxian.models import CustomUser, Post, Tag
+
+
+class Command(BaseCommand):
+    help = '在临时数据上测量相似帖子查询的延迟（数据在事务中生成，结束后回滚）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--tags', type=int, default=2000)
+        parser.add_argument('--tags-per-post', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--legacy', action='store_true', help='同时测量旧的 icontains 查询')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with scratch_data():
+            self.populate(rng, options)
+            vocabulary = list(Tag.objects.values_list('name', flat=True))
+            queries = [rng.sample(vocabulary, 2) for _ in range(options['repeat'])]
+
+            it = iter(queries * 2)
+            stats = measure(lambda: list(similarity.find_similar_posts(next(it), 5)), options['repeat'])
+            self.stdout.write(format_row('similar_posts (index)', stats))
+
+            if options['legacy']:
+                it = iter(queries * 2)
+                stats = measure(lambda: list(self.legacy_query(next(it))), options['repeat'])
+                self.stdout.write(format_row('similar_posts (icontains)', stats))
+
+    def populate(self, rng, options):
+        self.stdout.write(f"generating {options['posts']} posts ...")
+        author = CustomUser.objects.create_user(username='bench-similar', number='bench-similar', password='x')
+        tags = Tag.objects.bulk_create(Tag(name=f'tag{i} topic{i % 50}') for i in range(options['tags']))
+        if not tags[0].pk:
+            tags = list(Tag.objects.filter(name__startswith='tag'))
+        posts = Post.objects.bulk_create(
+            (Post(title=f'bench {i}', body='bench', author=author) for i in range(options['posts'])),
+            batch_size=2000,
+        )
+        if not posts[0].pk:
+            posts = list(Post.objects.filter(author=author).order_by('id'))
+        through = Post.tags.through
+        links = [
+            through(post_id=post.pk, tag_id=tag.pk)
+            for post in posts
+            for tag in rng.sample(tags, options['tags_per_post'])
+        ]
+        through.objects.bulk_create(links, batch_size=5000)
+        similarity.rebuild_index()
+
+    @staticmethod
+    def legacy_query(user_tags):
+        split_tags = [word for tag in user_tags for word in tag.split(' ')]
+        query = Q()
+        for tag in split_tags:
+            query |= Q(tags__name__icontains=tag)
+        return Post.objects.filter(query).annotate(matching_tags=Count('tags')).order_by('-matching_tags')[:5]
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fuzhuxian import transfer
+
+
+class Command(BaseCommand):
+    help = '把帖子、评论、标签和图片引用按块导出为 JSON Lines（见 fuzhuxian/transfer.py）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=transfer.DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--resume', action='store_true', help='从上次中断的检查点继续')
+
+    def handle(self, *args, **options):
+        progress = transfer.Progress(report=self.report)
+        try:
+            transfer.export_records(options['path'], options['chunk_size'], options['resume'], progress)
+        except transfer.TransferError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS('exported ' + progress.summary()))
+
+    def report(self, progress):
+        self.stdout.write(f'{progress.rows} rows, {progress.rate():.0f} rows/s')
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fuzhuxian import synthetic
+
+
+class Command(BaseCommand):
+    help = '生成可复现的合成论坛数据（用户、带标签的帖子、评论、图片），供 bench_api 压测使用'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments-per-post', type=float, default=4)
+        parser.add_argument('--images-per-post', type=float, default=0.5)
+        parser.add_argument('--tags', type=int, default=300)
+        parser.add_argument('--image-variants', type=int, default=20)
+        parser.add_argument('--days', type=int, default=180)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--password', default=synthetic.DEFAULT_PASSWORD)
+        parser.add_argument('--clear', action='store_true', help='先删除已有的合成数据')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.stdout.write(f'cleared {synthetic.clear()} synthetic users')
+        try:
+            counts = synthetic.generate(
+                users=options['users'], posts=options['posts'], comments_per_post=options['comments_per_post'],
+                images_per_post=options['images_per_post'], tags=options['tags'],
+                image_variants=options['image_variants'], days=options['days'], seed=options['seed'],
+                password=options['password'], log=self.stdout.write,
+            )
+        except synthetic.DatasetExists as exc:
+            raise CommandError(f'{exc} (use --clear)')
+        self.stdout.write(' '.join(f'{name}={value}' for name, value in counts.items()))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fuzhuxian import transfer
+
+
+class Command(BaseCommand):
+    help = '按块导入 export_forum 生成的 JSON Lines，保留原来的主键，已存在的记录跳过'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=transfer.DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--resume', action='store_true', help='从上次中断的检查点继续')
+        parser.add_argument('--skip-index', action='store_true',
+                            help='不逐块维护检索/相似帖子索引，导入后运行 rebuild_search_index 和 rebuild_tag_index')
+
+    def handle(self, *args, **options):
+        progress = transfer.Progress(report=self.report)
+        try:
+            transfer.import_records(options['path'], options['chunk_size'], options['resume'], progress,
+                                    reindex=not options['skip_index'])
+        except transfer.TransferError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS('imported ' + progress.summary()))
+        if options['skip_index']:
+            self.stdout.write('run rebuild_search_index and rebuild_tag_index to update the indexes')
+
+    def report(self, progress):
+        self.stdout.write(f'{progress.rows} rows, {progress.rate():.0f} rows/s')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from fuzhuxian import image_pipeline
+from fuzhuxian.models import Image
+
+
+class Command(BaseCommand):
+    help = '同步处理尚未生成缩略图的图片（例如服务重启时还在队列里的图片）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='同时重试处理失败的图片')
+        parser.add_argument('--limit', type=int, default=None)
+
+    def handle(self, *args, **options):
+        statuses = [Image.PENDING]
+        if options['retry_failed']:
+            statuses.append(Image.FAILED)
+        done, failed = image_pipeline.process_pending(statuses, options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'processed {done} images, {failed} failed'))
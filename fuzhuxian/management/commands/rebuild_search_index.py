@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from fuzhuxian import search
+
+
+class Command(BaseCommand):
+    help = '全量重建帖子全文检索使用的倒排索引 (SearchToken)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = search.rebuild_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'reindexed {count} posts'))
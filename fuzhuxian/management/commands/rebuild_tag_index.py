@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from fuzhuxian import similarity
+
+
+class Command(BaseCommand):
+    help = '全量重建相似帖子使用的标签倒排索引 (TagToken)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = similarity.rebuild_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'reindexed {count} posts'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from fuzhuxian import counters, response_cache
+
+
+class Command(BaseCommand):
+    help = '按实际的评论和图片校正帖子上的 comment_count / image_count / last_activity_at'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fixed = counters.reconcile(chunk_size=options['chunk_size'])
+        response_cache.bump_posts(fixed)
+        self.stdout.write(self.style.SUCCESS(f'fixed {len(fixed)} posts'))
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.24 on 2026-10-19 05:02
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalize_tag_name(name):
+    # 与 fuzhuxian.models.normalize_tag_name 相同，复制一份以免模型代码变化影响迁移
+    return ' '.join(unicodedata.normalize('NFKC', str(name)).split()).lower()
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    """规范化已有的标签名；规范化后重名的标签合并到 id 最小的那个"""
+    Tag = apps.get_model('fuzhuxian', 'Tag')
+    Post = apps.get_model('fuzhuxian', 'Post')
+    through = Post.tags.through
+    keep = {}
+    for tag in Tag.objects.order_by('id'):
+        name = normalize_tag_name(tag.name)
+        target = keep.get(name)
+        if target is None:
+            keep[name] = tag
+            if tag.name != name:
+                tag.name = name
+                tag.save(update_fields=['name'])
+            continue
+        tagged = through.objects.filter(tag_id=target.pk).values_list('post_id', flat=True)
+        through.objects.filter(tag_id=tag.pk).exclude(post_id__in=list(tagged)).update(tag_id=target.pk)
+        tag.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fuzhuxian', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(help_text='标签名称', max_length=200, unique=True, verbose_name='标签名称'),
+        ),
+    ]
@@ -0,0 +1,160 @@
+# Generated by Django 3.2.24 on 2026-10-19 06:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import fuzhuxian.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fuzhuxian', '0002_unique_tag_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('key', models.CharField(help_text='键', max_length=64, primary_key=True, serialize=False, verbose_name='键')),
+                ('version', models.BigIntegerField(default=0, help_text='版本号', verbose_name='版本号')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(help_text='内容哈希', max_length=64, unique=True, verbose_name='内容哈希')),
+                ('name', models.CharField(help_text='存储路径', max_length=255, verbose_name='存储路径')),
+                ('size', models.PositiveIntegerField(default=0, help_text='字节数', verbose_name='字节数')),
+                ('ref_count', models.PositiveIntegerField(default=0, help_text='引用数', verbose_name='引用数')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(help_text='检索词', max_length=32, verbose_name='检索词')),
+                ('weight', models.FloatField(default=1.0, help_text='权重', verbose_name='权重')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TagToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(help_text='标签词', max_length=200, verbose_name='标签词')),
+                ('weight', models.FloatField(default=1.0, help_text='权重', verbose_name='权重')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TokenRevocation',
+            fields=[
+                ('user_id', models.BigIntegerField(help_text='用户id', primary_key=True, serialize=False, verbose_name='用户id')),
+                ('not_before', models.BigIntegerField(help_text='生效时间戳', verbose_name='生效时间戳')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, help_text='各尺寸图片', verbose_name='各尺寸图片'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='status',
+            field=models.CharField(choices=[('pending', '处理中'), ('ready', '已完成'), ('failed', '处理失败')], default='pending', help_text='处理状态', max_length=10, verbose_name='处理状态'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='评论数', verbose_name='评论数'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='图片数', verbose_name='图片数'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, help_text='最后回复时间', verbose_name='最后回复时间'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='update_at',
+            field=models.DateTimeField(auto_now=True, help_text='更新时间', verbose_name='更新时间'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='update_at',
+            field=models.DateTimeField(auto_now=True, help_text='更新时间', verbose_name='更新时间'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(help_text='图片', max_length=255, storage=fuzhuxian.storage.ContentAddressedStorage(), upload_to='', verbose_name='图片'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='update_at',
+            field=models.DateTimeField(auto_now=True, help_text='更新时间', verbose_name='更新时间'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', '-created_at', '-id'], name='comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created_at', '-id'], name='post_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-last_activity_at', '-id'], name='post_activity_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='post_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='post_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['update_at'], name='post_update_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['update_at'], name='tag_update_at_idx'),
+        ),
+        migrations.AddField(
+            model_name='tagtoken',
+            name='post',
+            field=models.ForeignKey(help_text='对应帖子', on_delete=django.db.models.deletion.CASCADE, related_name='tag_tokens', to='fuzhuxian.post', verbose_name='对应帖子'),
+        ),
+        migrations.AddField(
+            model_name='searchtoken',
+            name='post',
+            field=models.ForeignKey(help_text='对应帖子', on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='fuzhuxian.post', verbose_name='对应帖子'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='blob',
+            field=models.ForeignKey(blank=True, editable=False, help_text='存储文件', null=True, on_delete=django.db.models.deletion.PROTECT, to='fuzhuxian.imageblob', verbose_name='存储文件'),
+        ),
+        migrations.AddIndex(
+            model_name='tagtoken',
+            index=models.Index(fields=['token', 'post', 'weight'], name='tagtoken_token_post_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tagtoken',
+            unique_together={('token', 'post')},
+        ),
+        migrations.AddIndex(
+            model_name='searchtoken',
+            index=models.Index(fields=['token', 'post', 'weight'], name='searchtoken_token_post_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchtoken',
+            unique_together={('token', 'post')},
+        ),
+    ]
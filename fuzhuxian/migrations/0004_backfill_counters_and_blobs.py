@@ -0,0 +1,78 @@
+"""
+为 0003 新增的列补上已有数据：
+
+  - 帖子的 comment_count / image_count / last_activity_at，与 counters.reconcile() 的计算相同
+  - 已有图片的 ImageBlob：按内容哈希复制到 blobs/ 下（相同内容只存一份），Image 指向新文件并增加引用。
+    原来的文件不再被引用，确认无误后可以手动删除；文件已经丢失的图片保持 blob 为空
+
+迁移之后还需要运行：
+    python manage.py process_images        生成已有图片的各尺寸缩略图（新列 status 默认为 pending）
+    python manage.py rebuild_tag_index     相似帖子的标签索引
+    python manage.py rebuild_search_index  全文检索索引
+"""
+import logging
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import migrations
+from django.db.models import Count, DateTimeField, F, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from fuzhuxian.storage import ContentAddressedStorage, digest_from_name
+
+logger = logging.getLogger(__name__)
+
+
+def count_of(model):
+    return Coalesce(Subquery(
+        model.objects.filter(post=OuterRef('pk')).order_by()
+        .values('post').annotate(n=Count('pk')).values('n'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('fuzhuxian', 'Post')
+    Comment = apps.get_model('fuzhuxian', 'Comment')
+    Image = apps.get_model('fuzhuxian', 'Image')
+    latest_comment = Subquery(
+        Comment.objects.filter(post=OuterRef('pk')).order_by()
+        .values('post').annotate(latest=Max('created_at')).values('latest'),
+        output_field=DateTimeField(),
+    )
+    # update() 不会触发 auto_now，帖子的 update_at 保持原样
+    Post.objects.update(
+        comment_count=count_of(Comment),
+        image_count=count_of(Image),
+        last_activity_at=Coalesce(latest_comment, F('created_at')),
+    )
+
+
+def backfill_blobs(apps, schema_editor):
+    Image = apps.get_model('fuzhuxian', 'Image')
+    ImageBlob = apps.get_model('fuzhuxian', 'ImageBlob')
+    source = FileSystemStorage()
+    target = ContentAddressedStorage()
+    for image in Image.objects.filter(blob=None).order_by('pk').iterator():
+        try:
+            with source.open(image.image.name, 'rb') as f:
+                name = target.save(image.image.name, File(f))
+        except OSError:
+            logger.warning('image %s: file %s is missing, left without blob', image.pk, image.image.name)
+            continue
+        blob, _ = ImageBlob.objects.get_or_create(
+            sha256=digest_from_name(name), defaults={'name': name, 'size': target.size(name), 'ref_count': 0})
+        ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        Image.objects.filter(pk=image.pk).update(image=name, blob=blob)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fuzhuxian', '0003_series_schema'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+        migrations.RunPython(backfill_blobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.24 on 2026-10-19 06:26
+
+import math
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def convert_weights(apps, schema_editor):
+    """
+    原来的 weight 是 ln(1 + tf) / sqrt(帖子的检索词数)，按帖子换算回 tf，
+    weight 改存 ln(1 + tf)，检索词数写进 Post.search_terms
+    """
+    Post = apps.get_model('fuzhuxian', 'Post')
+    SearchToken = apps.get_model('fuzhuxian', 'SearchToken')
+    terms = SearchToken.objects.order_by().values('post').annotate(n=Count('pk'))
+    for row in terms.iterator():
+        norm = math.sqrt(row['n'])
+        tokens = list(SearchToken.objects.filter(post_id=row['post']))
+        for token in tokens:
+            token.weight *= norm
+            token.tf = math.expm1(token.weight)
+        SearchToken.objects.bulk_update(tokens, ['tf', 'weight'], batch_size=1000)
+        Post.objects.filter(pk=row['post']).update(search_terms=row['n'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fuzhuxian', '0004_backfill_counters_and_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_terms',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='检索词数', verbose_name='检索词数'),
+        ),
+        migrations.AddField(
+            model_name='searchtoken',
+            name='tf',
+            field=models.FloatField(default=0.0, help_text='词频', verbose_name='词频'),
+        ),
+        migrations.RunPython(convert_weights, migrations.RunPython.noop),
+    ]
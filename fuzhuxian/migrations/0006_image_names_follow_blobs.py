@@ -0,0 +1,32 @@
+"""
+blob 文件原来按上传时的扩展名命名，同一内容以 .jpg 和 .jpeg 上传过会存成两个文件、对应一个 ImageBlob。
+现在 Image 一律引用 ImageBlob.name：把指向其他文件名的图片改过去，不再被引用的多余文件删除
+"""
+from django.db import migrations
+from django.db.models import F
+
+from fuzhuxian.storage import ContentAddressedStorage
+
+
+def use_blob_names(apps, schema_editor):
+    Image = apps.get_model('fuzhuxian', 'Image')
+    storage = ContentAddressedStorage()
+    stale = Image.objects.filter(blob__isnull=False).exclude(image=F('blob__name'))
+    names = set()
+    for image_id, name, blob_name in stale.values_list('pk', 'image', 'blob__name').iterator():
+        Image.objects.filter(pk=image_id).update(image=blob_name)
+        names.add(name)
+    names -= set(Image.objects.filter(image__in=names).values_list('image', flat=True))
+    for name in names:
+        storage.delete(name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fuzhuxian', '0005_incremental_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(use_blob_names, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,16 @@
-from django.db import models
+import unicodedata
+from django.core.files import File
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
 from django.conf import settings
 from django.contrib.auth.models import User
-from PIL import Image as PilImage
-import io
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.hashers import check_password
+
+from .instrumentation import timed
+from .storage import ContentAddressedStorage, digest_from_name
 
 
 class CustomUser(AbstractUser):
@@ -12,75 +18,291 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
 
+    def check_password(self, raw_password):
+        # 与 AbstractBaseUser.check_password 相同，只是给登录时的哈希升级打上标记，
+        # 这样 signals 不会把它当成修改密码而吊销已签发的 token
+        def setter(raw_password):
+            self.set_password(raw_password)
+            self._password = None
+            self._password_rehashed = True
+            self.save(update_fields=['password'])
+        return check_password(raw_password, self.password, setter)
+
+def normalize_tag_name(name):
+    """全角转半角、合并空白、转小写；规范化后的名称在库里唯一"""
+    return ' '.join(unicodedata.normalize('NFKC', str(name)).split()).lower()
+
+
 class Tag(models.Model):
-    name = models.CharField(max_length=200,verbose_name='标签名称',help_text='标签名称')
+    name = models.CharField(max_length=200,unique=True,verbose_name='标签名称',help_text='标签名称')
+    update_at = models.DateTimeField(auto_now=True, verbose_name='更新时间', help_text='更新时间')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['update_at'], name='tag_update_at_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.name = normalize_tag_name(self.name)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
+def touch(model, ids):
+    """把 update_at 刷新为当前时间，用于关联数据（图片、标签）变化后让条件请求失效"""
+    ids = [pk for pk in ids if pk is not None]
+    if ids:
+        model.objects.filter(pk__in=ids).update(update_at=timezone.now())
+
+
 class Content(models.Model):
     body = models.TextField(verbose_name='内容',help_text='内容')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间',help_text='创建时间')
-    update_at = models.DateTimeField(auto_now_add=True, verbose_name='更新时间',help_text='更新时间')
+    update_at = models.DateTimeField(auto_now=True, verbose_name='更新时间',help_text='更新时间')
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,verbose_name='作者',help_text='作者')
 
 #定义为抽象类，数据库不用专门生成一个表
     class Meta:
         abstract = True
 
-STATUS_CHOICES = {
+# 用有序的元组：集合的遍历顺序每次启动都不同，会让 makemigrations 反复生成 AlterField
+STATUS_CHOICES = (
     ("n",  "未开始"),
     ("i", "正在进行"),
     ("a",  "已解决"),
-}
+)
+
+class PostQuerySet(models.QuerySet):
+    def with_related(self):
+        # 序列化帖子时会用到作者、标签和图片，一次性取出，避免逐行查询(N+1)
+        return self.select_related('author').prefetch_related('tags', 'image_set')
+
+
+class CommentQuerySet(models.QuerySet):
+    def with_related(self):
+        return self.select_related('author').prefetch_related('image_set')
+
 
 class Post(Content):
     title = models.CharField(max_length=200,verbose_name='标题',help_text='标题')
     tags = models.ManyToManyField(Tag,  blank=True, verbose_name='标签',help_text='标签')
     status = models.CharField(max_length=1, choices=STATUS_CHOICES , default="n", verbose_name='状态', help_text='状态')
+    # 冗余计数，由 fuzhuxian.counters 用 F 表达式维护，可用 reconcile_post_counters 校正
+    comment_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='评论数', help_text='评论数')
+    image_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='图片数', help_text='图片数')
+    last_activity_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name='最后回复时间', help_text='最后回复时间')
+    # 检索索引里这个帖子的检索词个数，由 fuzhuxian.search 维护，用于按帖子长度归一化得分
+    search_terms = models.PositiveIntegerField(default=0, editable=False, verbose_name='检索词数', help_text='检索词数')
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        # 帖子流按 (-created_at, -id) 或 (-last_activity_at, -id) 游标分页，并可按 status / author 过滤
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_created_id_idx'),
+            models.Index(fields=['-last_activity_at', '-id'], name='post_activity_id_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='post_status_created_idx'),
+            models.Index(fields=['author', '-created_at', '-id'], name='post_author_created_idx'),
+            # 列表的 ETag 取 COUNT + MAX(update_at)，有这个索引就不用回表读整行
+            models.Index(fields=['update_at'], name='post_update_at_idx'),
+        ]
+
+    COUNTER_FIELDS = ('comment_count', 'image_count', 'last_activity_at', 'search_terms')
+
+    def save(self, *args, **kwargs):
+        # 计数只由 counters 用 F 表达式更新；整行保存已有帖子时不写回内存里可能过期的计数
+        if not self._state.adding and not args and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 class Comment(Content):
     post = models.ForeignKey(Post, related_name='comments', on_delete=models.CASCADE, verbose_name='帖子外键',help_text='帖子外键')
 
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', '-created_at', '-id'], name='comment_post_created_idx'),
+        ]
+
     def __str__(self):
         return self.body
 
+class ImageBlob(models.Model):
+    """
+    内容寻址存储中的一个文件。多个 Image 可以指向同一个文件，
+    ref_count 记录引用它的 Image 数量，降到 0 后在事务提交时删除文件和这条记录。
+    acquire 和 delete_unreferenced 都先锁住记录：删除文件之前同一内容又被上传时，文件不会被删掉。
+    """
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name='内容哈希', help_text='内容哈希')
+    name = models.CharField(max_length=255, verbose_name='存储路径', help_text='存储路径')
+    size = models.PositiveIntegerField(default=0, verbose_name='字节数', help_text='字节数')
+    ref_count = models.PositiveIntegerField(default=0, verbose_name='引用数', help_text='引用数')
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def acquire(cls, name, size, content=None):
+        """
+        为新的 Image 增加一次引用，返回对应的 ImageBlob。
+        content 为文件内容：保存时文件已存在就不会再写，而它可能在拿到引用之前被删除，这时按 blob.name 重新写入
+        """
+        digest = digest_from_name(name)
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(sha256=digest).first()
+            if blob is None:
+                try:
+                    with transaction.atomic():
+                        blob = cls.objects.create(sha256=digest, name=name, size=size, ref_count=1)
+                except IntegrityError:
+                    blob = cls.objects.select_for_update().get(sha256=digest)
+                    cls.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+            else:
+                cls.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+            if content is not None:
+                ContentAddressedStorage().restore(blob.name, content)
+        return blob
+
+    @classmethod
+    def release(cls, blob_id):
+        """减少一次引用；返回是否已经没有引用（调用方在事务提交后调用 delete_unreferenced）"""
+        cls.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        return cls.objects.filter(pk=blob_id, ref_count=0).exists()
+
+    @classmethod
+    def delete_unreferenced(cls, blob_id, delete_files):
+        """锁住记录再确认一次没有引用，然后调用 delete_files(blob) 删除文件并删除记录；返回是否删除了"""
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(pk=blob_id, ref_count=0).first()
+            if blob is None:
+                return False
+            delete_files(blob)
+            blob.delete()
+        return True
+
+
 class Image(models.Model):
-    image = models.ImageField(verbose_name="图片", help_text="图片")
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, '处理中'),
+        (READY, '已完成'),
+        (FAILED, '处理失败'),
+    )
+
+    # 原图按内容哈希保存（相同内容只存一份），压缩和各尺寸的缩略图由 image_pipeline 在后台生成
+    image = models.ImageField(storage=ContentAddressedStorage(), max_length=255, verbose_name="图片", help_text="图片")
+    blob = models.ForeignKey(ImageBlob, on_delete=models.PROTECT, null=True, blank=True, editable=False, verbose_name="存储文件", help_text="存储文件")
     post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True, verbose_name="对应帖子", help_text="对应帖子")
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True, verbose_name="对应评论", help_text="对应评论")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name="处理状态", help_text="处理状态")
+    # {规格名: {格式: 存储路径}}，例如 {'thumbnail': {'jpeg': ..., 'webp': ...}}
+    renditions = models.JSONField(default=dict, blank=True, verbose_name="各尺寸图片", help_text="各尺寸图片")
 
     def save(self, *args, **kwargs):
-        # Open the uploaded image
-        im = PilImage.open(self.image)
+        if self._state.adding and self.image and not self.image._committed:
+            # 先写文件拿到内容哈希，再在同一次 INSERT 里带上 blob
+            content = self.image.file
+            with timed('image'):
+                self.image.save(self.image.name, content, save=False)
+            # File() 包一层：临时文件已被移走时按内容重新写入，而不是再移动一次
+            self.blob = ImageBlob.acquire(self.image.name, self.image.size, File(content))
+            if self.blob.name != self.image.name:
+                # 同一内容已经以旧的命名存过：统一引用 blob 的文件，刚写的副本删掉
+                self.image.storage.delete(self.image.name)
+                self.image.name = self.blob.name
+        super().save(*args, **kwargs)
 
-        # Convert image to RGB if it's in PNG format (has an alpha channel)
-        if im.mode == 'RGBA' or im.mode == 'P':
-            im = im.convert('RGB')
+    def __str__(self):
+        return self.image.name
 
-        # Define an output BytesIO stream for the new image
-        output = io.BytesIO()
 
-        # Save image to the output stream
-        # We must specify a format; using the original format if possible
-        format = im.format if im.format is not None else 'JPEG'
+class TagToken(models.Model):
+    """
+    标签倒排索引：规范化后的标签词 -> 帖子。
+    由 fuzhuxian.similarity 在帖子标签变化时维护，不要直接写入。
+    """
+    token = models.CharField(max_length=200, verbose_name='标签词', help_text='标签词')
+    post = models.ForeignKey(Post, related_name='tag_tokens', on_delete=models.CASCADE, verbose_name='对应帖子', help_text='对应帖子')
+    # 1/sqrt(该帖子的标签词数)，标签越多单个词的权重越低
+    weight = models.FloatField(default=1.0, verbose_name='权重', help_text='权重')
 
-        if format.lower() in ['jpeg', 'jpg']:
-            im.save(output, format=format, quality=20)  # Lower quality means higher compression
-        else:  # Fallback for PNG since format would be 'PNG'
-            im.save(output, format='PNG', optimize=True)
+    class Meta:
+        unique_together = ('token', 'post')
+        indexes = [
+            models.Index(fields=['token', 'post', 'weight'], name='tagtoken_token_post_idx'),
+        ]
 
-        output_size = output.tell()  # Find out the current cursor position in BytesIO
-        file_name = f"{self.image.name.split('.')[0]}.{format.lower()}"
+    def __str__(self):
+        return self.token
 
-        # Edit the image field with the new compressed image
-        output.seek(0)
-        self.image = InMemoryUploadedFile(output, 'ImageField', file_name, 'image/jpeg', output_size, None)
 
-        # Call the parent save method to save the object
-        super().save(*args, **kwargs)
+class SearchToken(models.Model):
+    """
+    全文检索倒排索引：检索词 -> 帖子，覆盖标题、正文和评论。
+    由 fuzhuxian.search 在帖子/评论变化时维护，不要直接写入。
+    """
+    token = models.CharField(max_length=32, verbose_name='检索词', help_text='检索词')
+    post = models.ForeignKey(Post, related_name='search_tokens', on_delete=models.CASCADE, verbose_name='对应帖子', help_text='对应帖子')
+    # 按字段加权的词频，评论增删时直接加减
+    tf = models.FloatField(default=0.0, verbose_name='词频', help_text='词频')
+    # ln(1 + tf)；按帖子词数的归一化在查询时做（Post.search_terms）
+    weight = models.FloatField(default=1.0, verbose_name='权重', help_text='权重')
+
+    class Meta:
+        unique_together = ('token', 'post')
+        indexes = [
+            models.Index(fields=['token', 'post', 'weight'], name='searchtoken_token_post_idx'),
+        ]
 
     def __str__(self):
-        return self.image.name
+        return self.token
+
+
+class CacheVersion(models.Model):
+    """
+    响应缓存的版本号，例如 'feed'、'post:12'。写操作时加一，缓存键里带上版本号，
+    旧的缓存条目自然失效。放在数据库里，多个 uwsgi 进程看到的是同一个版本。
+    """
+    key = models.CharField(max_length=64, primary_key=True, verbose_name='键', help_text='键')
+    version = models.BigIntegerField(default=0, verbose_name='版本号', help_text='版本号')
+
+    def __str__(self):
+        return f'{self.key}@{self.version}'
+
+    @classmethod
+    def bump(cls, keys):
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return
+        updated = set(cls.objects.filter(key__in=keys).values_list('key', flat=True))
+        cls.objects.filter(key__in=updated).update(version=F('version') + 1)
+        missing = [key for key in keys if key not in updated]
+        if missing:
+            cls.objects.bulk_create([cls(key=key, version=1) for key in missing], ignore_conflicts=True)
+
+    @classmethod
+    def get_many(cls, keys):
+        versions = dict(cls.objects.filter(key__in=keys).values_list('key', 'version'))
+        return [versions.get(key, 0) for key in keys]
+
+
+class TokenRevocation(models.Model):
+    """
+    用户级的 token 吊销记录：签发时间 (iat) 早于 not_before 的 token 一律无效。
+    不设外键，用户被删除后记录仍然保留。
+    """
+    user_id = models.BigIntegerField(primary_key=True, verbose_name='用户id', help_text='用户id')
+    not_before = models.BigIntegerField(verbose_name='生效时间戳', help_text='生效时间戳')
+
+    def __str__(self):
+        return f'{self.user_id}<{self.not_before}'
@@ -0,0 +1,40 @@
+from rest_framework.pagination import CursorPagination
+
+
+class FeedCursorPagination(CursorPagination):
+    """
+    按 (-created_at, -id) 做游标分页，翻页只按索引向后扫描一页，
+    不需要 COUNT(*) 和 OFFSET，深度翻页的开销与页码无关。
+    """
+    ordering = ('-created_at', '-id')
+
+
+class OptionalCursorPaginationMixin:
+    """
+    请求带上 `?pagination=cursor` 时改用游标分页，
+    否则沿用视图原本的 pagination_class（可以为 None，即不分页）。
+    返回的 next/previous 链接会保留原有的查询参数（status、my_posts 等）。
+    """
+    cursor_pagination_class = FeedCursorPagination
+    cursor_query_param = 'pagination'
+
+    def use_cursor_pagination(self):
+        return self.request.query_params.get(self.cursor_query_param) == 'cursor'
+
+    def get_cursor_ordering(self):
+        """游标分页的排序，默认使用 cursor_pagination_class.ordering"""
+        return None
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.use_cursor_pagination():
+                self._paginator = self.cursor_pagination_class()
+                ordering = self.get_cursor_ordering()
+                if ordering is not None:
+                    self._paginator.ordering = ordering
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
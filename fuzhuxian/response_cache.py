@@ -0,0 +1,112 @@
+"""
+帖子列表/详情的响应缓存。
+
+缓存键 = 接口 + 主机 + 完整路径（过滤条件、页码、游标）+ 版本号：
+列表用帖子流版本 'feed'，详情用该帖子的版本 'post:<id>'。
+帖子、评论、标签、图片的写操作和作者改名通过 bump_posts() 给版本加一（见 signals），
+旧条目不需要逐个删除，过期后自然淘汰。
+
+配置 settings.RESPONSE_CACHE：
+    ALIAS    使用的缓存（settings.CACHES 中的名字），默认 'default'
+    TIMEOUT  条目的过期时间（秒），默认 300
+    ENABLED  默认 True
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from .models import CacheVersion
+
+FEED = 'feed'
+STATS_ACTIONS = ('list', 'retrieve')
+
+
+def get_config():
+    config = {'ALIAS': 'default', 'TIMEOUT': 300, 'ENABLED': True}
+    config.update(getattr(settings, 'RESPONSE_CACHE', {}))
+    return config
+
+
+def get_cache():
+    return caches[get_config()['ALIAS']]
+
+
+def post_key(post_id):
+    return f'post:{post_id}'
+
+
+def bump_posts(post_ids):
+    """帖子内容发生变化：帖子流和对应帖子的缓存都失效"""
+    CacheVersion.bump([FEED] + [post_key(post_id) for post_id in post_ids if post_id is not None])
+
+
+def record(action, hit):
+    cache = get_cache()
+    key = f'response_cache:{"hits" if hit else "misses"}:{action}'
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def stats():
+    cache = get_cache()
+    result = {}
+    for action in STATS_ACTIONS:
+        hits = cache.get(f'response_cache:hits:{action}', 0)
+        misses = cache.get(f'response_cache:misses:{action}', 0)
+        total = hits + misses
+        result[action] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / total, 4) if total else None}
+    return result
+
+
+class CachedResponseMixin:
+    """缓存 list / retrieve 的序列化结果，命中时不再查询帖子和序列化"""
+
+    def cache_versions(self):
+        if self.action == 'retrieve':
+            return [post_key(self.kwargs[self.lookup_url_kwarg or self.lookup_field])]
+        return [FEED]
+
+    def current_versions(self):
+        """本次请求的版本号；条件请求的 ETag 和缓存键共用这一次查询"""
+        if not hasattr(self, '_current_versions'):
+            self._current_versions = CacheVersion.get_many(self.cache_versions())
+        return self._current_versions
+
+    def cache_key(self):
+        request = self.request
+        # my_posts 的结果取决于当前用户
+        user = request.user.pk if request.query_params.get('my_posts') == 'true' else None
+        versions = self.current_versions()
+        raw = ':'.join(str(part) for part in (
+            self.basename, self.action, request.get_host(), request.get_full_path(), user, *versions))
+        return 'response_cache:' + hashlib.md5(raw.encode()).hexdigest()
+
+    def cached(self, render, request, *args, **kwargs):
+        config = get_config()
+        if not config['ENABLED']:
+            return render(request, *args, **kwargs)
+        cache = get_cache()
+        key = self.cache_key()
+        data = cache.get(key)
+        if data is not None:
+            record(self.action, True)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        record(self.action, False)
+        response = render(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, config['TIMEOUT'])
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,230 @@
+"""
+帖子全文检索（标题、正文、评论）。
+
+帖子文本被切成检索词写入 SearchToken 倒排索引：连续的中日韩文字切成相邻两字
+（二元组，单独一个字就保留单字），字母数字按单词切分并转小写。
+查询串用同样的方式切词，要求所有检索词都命中（AND），按相关度排序：
+
+    score(post) = Σ idf(t) * weight(t, post) / sqrt(|post 的检索词|)
+    weight(t, post) = ln(1 + tf(t, post))，tf = 标题 3 * 次数 + 正文 1 * 次数 + 评论 0.5 * 次数
+    idf(t)       = ln(1 + N / df(t))
+
+SearchToken 存 tf 和 weight，帖子的检索词个数存在 Post.search_terms，按帖子长度的归一化在查询时做。
+这样评论增删改时只需要把这一条评论的检索词加到/减出帖子的索引行（apply_comment_deltas），
+不用重读整个帖子的所有评论；帖子标题/正文变化时才重建整个帖子（reindex_posts）。都在事务提交后执行。
+两者并发时个别 tf 可能有偏差，rebuild_search_index 可以校正。
+
+索引不依赖数据库的全文检索功能，MySQL 和测试用的 SQLite 走同一条代码路径。
+
+配置 settings.SEARCH：
+    MAX_RESULTS  参与分页的最大结果数，默认 1000
+"""
+import math
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Greatest, Sqrt
+
+from .models import Comment, Post, SearchToken
+
+FIELD_BOOSTS = {'title': 3.0, 'body': 1.0, 'comment': 0.5}
+MAX_TOKEN_LENGTH = 32
+MAX_QUERY_TOKENS = 16
+
+# 假名、中日韩统一表意文字（含扩展 A）、谚文、兼容表意文字
+CJK_RE = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+WORD_RE = re.compile(rf'[{CJK_RE}]+|[^\W_{CJK_RE}]+')
+CJK_RUN_RE = re.compile(rf'[{CJK_RE}]+')
+
+
+def get_config():
+    config = {'MAX_RESULTS': 1000}
+    config.update(getattr(settings, 'SEARCH', {}))
+    return config
+
+
+def tokenize(text):
+    """按出现顺序返回检索词（可能重复）"""
+    tokens = []
+    for run in WORD_RE.findall((text or '').lower()):
+        if CJK_RUN_RE.fullmatch(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run[:MAX_TOKEN_LENGTH])
+    return tokens
+
+
+def query_tokens(q):
+    tokens = []
+    for token in tokenize(q):
+        if token not in tokens:
+            tokens.append(token)
+    return tokens[:MAX_QUERY_TOKENS]
+
+
+def reindex_posts(post_ids):
+    """重建给定帖子的检索索引行（重读标题、正文和全部评论）"""
+    post_ids = sorted({post_id for post_id in post_ids if post_id is not None})
+    if not post_ids:
+        return
+    with transaction.atomic():
+        # 锁住帖子：与 apply_comment_deltas 对同一帖子的修改互斥
+        posts = Post.objects.select_for_update().filter(pk__in=post_ids).order_by('pk')
+        counts = {}
+        for post_id, title, body in posts.values_list('pk', 'title', 'body'):
+            counter = counts[post_id] = Counter()
+            for field, text in (('title', title), ('body', body)):
+                for token in tokenize(text):
+                    counter[token] += FIELD_BOOSTS[field]
+        for post_id, body in Comment.objects.filter(post_id__in=counts).values_list('post_id', 'body').iterator():
+            counter = counts[post_id]
+            for token in tokenize(body):
+                counter[token] += FIELD_BOOSTS['comment']
+
+        rows = [
+            SearchToken(token=token, post_id=post_id, tf=tf, weight=math.log1p(tf))
+            for post_id, counter in counts.items() for token, tf in counter.items()
+        ]
+        SearchToken.objects.filter(post_id__in=post_ids).delete()
+        SearchToken.objects.bulk_create(rows, batch_size=1000)
+        Post.objects.bulk_update([Post(pk=post_id, search_terms=len(counter)) for post_id, counter in counts.items()],
+                                 ['search_terms'], batch_size=1000)
+
+
+def comment_deltas(changes):
+    """[(post_id, 评论正文, +1 或 -1)] -> {post_id: {检索词: tf 的变化}}"""
+    deltas = {}
+    for post_id, body, sign in changes:
+        if post_id is None:
+            continue
+        delta = deltas.setdefault(post_id, Counter())
+        for token in tokenize(body):
+            delta[token] += sign * FIELD_BOOSTS['comment']
+    return deltas
+
+
+def apply_comment_deltas(deltas):
+    """把评论带来的 tf 变化合并进帖子的索引行：只读写这些检索词的行，不重读帖子的其它评论"""
+    for post_id, delta in deltas.items():
+        delta = {token: change for token, change in delta.items() if change}
+        if not delta:
+            continue
+        with transaction.atomic():
+            # 帖子已经删除（级联删除评论）时没有要更新的行
+            if not list(Post.objects.select_for_update().filter(pk=post_id).values_list('pk', flat=True)):
+                continue
+            existing = {row.token: row for row in SearchToken.objects.filter(post_id=post_id, token__in=delta)}
+            changed, created, removed = [], [], []
+            for token, change in delta.items():
+                row = existing.get(token)
+                tf = (row.tf if row is not None else 0.0) + change
+                if tf <= 0:
+                    if row is not None:
+                        removed.append(row.pk)
+                elif row is None:
+                    created.append(SearchToken(token=token, post_id=post_id, tf=tf, weight=math.log1p(tf)))
+                else:
+                    row.tf, row.weight = tf, math.log1p(tf)
+                    changed.append(row)
+            SearchToken.objects.filter(pk__in=removed).delete()
+            SearchToken.objects.bulk_create(created)
+            SearchToken.objects.bulk_update(changed, ['tf', 'weight'])
+            if len(created) != len(removed):
+                Post.objects.filter(pk=post_id).update(search_terms=F('search_terms') + len(created) - len(removed))
+
+
+def schedule_reindex(post_ids):
+    """
+    事务提交后再重建索引：同一事务里的多次写入各自读到的都是最终文本，
+    删除帖子时级联删除评论也不会把索引行写回即将删除的帖子。
+    """
+    post_ids = [post_id for post_id in post_ids if post_id is not None]
+    if post_ids:
+        transaction.on_commit(lambda: reindex_posts(post_ids))
+
+
+def schedule_comment_changes(changes):
+    """评论增删改：changes 为 [(post_id, 正文, +1 新增 / -1 删除)]，事务提交后增量更新索引"""
+    deltas = comment_deltas(changes)
+    if deltas:
+        transaction.on_commit(lambda: apply_comment_deltas(deltas))
+
+
+def rebuild_index(chunk_size=1000):
+    """全量重建检索索引，返回处理的帖子数"""
+    SearchToken.objects.all().delete()
+    count = 0
+    ids = []
+    for post_id in Post.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size):
+        ids.append(post_id)
+        if len(ids) >= chunk_size:
+            reindex_posts(ids)
+            count += len(ids)
+            ids = []
+    reindex_posts(ids)
+    return count + len(ids)
+
+
+def rank_posts(q, status=None, tags=(), limit=None):
+    """返回 [(post_id, score), ...]，只包含命中全部检索词的帖子，按得分从高到低"""
+    tokens = query_tokens(q)
+    if not tokens:
+        return []
+    limit = limit or get_config()['MAX_RESULTS']
+
+    df = dict(
+        SearchToken.objects.filter(token__in=tokens).order_by()
+        .values('token').annotate(df=Count('post')).values_list('token', 'df')
+    )
+    if len(df) < len(tokens):
+        # 有检索词没有出现在任何帖子里，AND 语义下结果为空
+        return []
+    total = Post.objects.count()
+    idf = {token: math.log(1 + total / count) for token, count in df.items()}
+
+    queryset = SearchToken.objects.filter(token__in=tokens)
+    if len(tokens) > 1:
+        # 候选帖子只取最少见的检索词命中的那些，其余检索词按 (token, post) 索引逐个核对
+        rarest = min(df, key=df.get)
+        queryset = queryset.filter(post_id__in=SearchToken.objects.filter(token=rarest).values('post_id'))
+    if status is not None:
+        queryset = queryset.filter(post__status=status)
+    for tag in tags:
+        queryset = queryset.filter(post_id__in=Post.tags.through.objects.filter(tag__name=tag).values('post_id'))
+    score = Sum(Case(
+        *[When(token=token, then=F('weight') * Value(weight)) for token, weight in idf.items()],
+        default=Value(0.0),
+        output_field=FloatField(),
+    )) / Sqrt(Greatest(F('post__search_terms'), Value(1)), output_field=FloatField())
+    return list(
+        queryset.order_by()
+        .values('post_id', 'post__search_terms').annotate(hits=Count('pk'), score=score)
+        .filter(hits=len(tokens))
+        .order_by('-score', '-post_id')
+        .values_list('post_id', 'score')[:limit]
+    )
+
+
+def matching_posts(q):
+    """命中全部检索词的帖子 id 子查询：不排序、不截断，给只需要过滤的地方用（管理后台）"""
+    tokens = query_tokens(q)
+    queryset = SearchToken.objects.filter(token__in=tokens).order_by()
+    return queryset.values('post_id').annotate(hits=Count('pk')).filter(hits=len(tokens)).values('post_id')
+
+
+def load_posts(ranked):
+    """按 ranked 的顺序取出帖子，已预取序列化需要的关联数据"""
+    posts = Post.objects.with_related().in_bulk([post_id for post_id, _ in ranked])
+    result = []
+    for post_id, score in ranked:
+        post = posts.get(post_id)
+        if post is not None:
+            post.search_score = score
+            result.append(post)
+    return result
@@ -1,11 +1,77 @@
 from rest_framework import serializers
-from .models import Tag, Post, Comment, Image, STATUS_CHOICES,CustomUser
+from .models import Tag, Post, Comment, Image, STATUS_CHOICES,CustomUser, normalize_tag_name
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.settings import api_settings
+from django.contrib.auth.models import update_last_login
+from .authentication import add_user_claims
+from django.db import IntegrityError, connection, transaction
+from .tagging import add_post_tags, normalize_names, set_post_tags, tag_cache, tag_names_from_request
+from . import counters, events, response_cache, search
+from .instrumentation import TimedSerializerMixin
+from .fieldsets import SparseFieldsMixin, get_config as get_list_config, is_nested
+from .image_pipeline import append_images, remove_images, replace_images, validate_upload
 
 
 User = get_user_model()
 
+def issue_tokens(user):
+    """签发和 TokenObtainPairView 相同格式的 refresh/access token，带上用户声明"""
+    refresh = add_user_claims(RefreshToken.for_user(user), user)
+    if api_settings.UPDATE_LAST_LOGIN:
+        update_last_login(None, user)
+    return {
+        'refresh': str(refresh),
+        'access': str(refresh.access_token),
+    }
+
+
+def validate_images(files):
+    # 在写入任何数据之前检查所有上传的图片，避免帖子建了一半才报错
+    for image_data in files.values():
+        validate_upload(image_data)
+
+
+def changed_fields(instance, validated_data, fields):
+    """把 validated_data 中与当前值不同的字段写到 instance 上，返回这些字段名"""
+    changed = []
+    for field in fields:
+        if field in validated_data and validated_data[field] != getattr(instance, field):
+            setattr(instance, field, validated_data[field])
+            changed.append(field)
+    return changed
+
+
+def id_list(data, key):
+    """remove_images 可以是重复的表单字段、逗号分隔的字符串或 JSON 数组"""
+    values = data.getlist(key) if hasattr(data, 'getlist') else data.get(key, [])
+    if isinstance(values, (str, int)):
+        values = [values]
+    ids = []
+    for value in values:
+        for part in str(value).split(','):
+            part = part.strip()
+            if part.isdigit():
+                ids.append(int(part))
+    return ids
+
+
+def update_images(queryset, request, partial, **owner):
+    """
+    PUT（form-data）：上传的文件就是完整的图片列表，内容相同的保留，其余增删；
+    PATCH：上传的文件追加到已有图片，remove_images 中的 id 被删除；
+    JSON 请求不带文件，只处理 remove_images。
+    返回图片是否有变化。
+    """
+    changed = remove_images(queryset, id_list(request.data, 'remove_images'))
+    if request.content_type == 'application/json':
+        return changed
+    if partial:
+        return append_images(queryset, request.FILES.values(), **owner) or changed
+    return replace_images(queryset, request.FILES.values(), **owner) or changed
+
+
 class CustomUserSerializer(serializers.ModelSerializer):
     username = serializers.CharField()
     number = serializers.CharField()
@@ -22,26 +88,78 @@ class CustomUserSerializer(serializers.ModelSerializer):
 
     # 添加一个新的方法来获取token
     def get_token(self, user):
-        refresh = RefreshToken.for_user(user)
-        return {
-            'refresh': str(refresh),
-            'access': str(refresh.access_token),
-        }
+        return issue_tokens(user)
+
 
+class TagListSerializer(serializers.ListSerializer):
+    """批量创建标签：一次 bulk_create，再按唯一的名称取回主键（MySQL 不回填主键）"""
 
-class TagSerializer(serializers.ModelSerializer):
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        if not is_nested(self.child):
+            seen = set()
+            errors = []
+            for item in value:
+                errors.append({'name': ['同一批中有重复的标签']} if item['name'] in seen else {})
+                seen.add(item['name'])
+            if any(errors):
+                raise serializers.ValidationError(errors)
+        return value
+
+    def create(self, validated_data):
+        names = [item['name'] for item in validated_data]
+        try:
+            with transaction.atomic():
+                Tag.objects.bulk_create([Tag(name=name) for name in names])
+        except IntegrityError:
+            raise serializers.ValidationError({'name': ['标签已存在']})
+        tags = Tag.objects.in_bulk(names, field_name='name')
+        tag_cache.set_many({name: tag.pk for name, tag in tags.items()})
+        return [tags[name] for name in names]
+
+
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = ['id', 'name']
+        list_serializer_class = TagListSerializer
+        # 嵌套在帖子/评论里时 name 指向已有标签，唯一性在 validate_name 里按规范化后的名称检查
+        extra_kwargs = {'name': {'validators': []}}
+
+    def validate_name(self, value):
+        name = normalize_tag_name(value)
+        if not name:
+            raise serializers.ValidationError('标签名不能为空')
+        if not is_nested(self):
+            duplicates = Tag.objects.filter(name=name)
+            if self.instance is not None:
+                duplicates = duplicates.exclude(pk=self.instance.pk)
+            if duplicates.exists():
+                raise serializers.ValidationError('标签已存在')
+        return name
+
+
+class ImageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    renditions = serializers.SerializerMethodField()
 
-
-class ImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Image
-        fields = ('id', 'image', 'post', 'comment')
-
-
-class PostSerializer(serializers.ModelSerializer):
+        fields = ('id', 'image', 'post', 'comment', 'status', 'renditions')
+        read_only_fields = ('status',)
+
+    def get_renditions(self, obj):
+        # 后台处理完成前返回空字典，客户端先显示原图
+        request = self.context.get('request')
+        urls = {}
+        for name, files in (obj.renditions or {}).items():
+            urls[name] = {}
+            for fmt, path in files.items():
+                url = default_storage.url(path)
+                urls[name][fmt] = request.build_absolute_uri(url) if request is not None else url
+        return urls
+
+
+class PostSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True)
     tags = TagSerializer(many=True, required=False, )
     images = ImageSerializer(many=True, read_only=True, source='image_set', required=False)
@@ -49,27 +167,24 @@ class PostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Post
-        fields = ('id', 'title', 'status', 'tags', 'body', 'created_at', 'update_at', 'author', 'images')
+        fields = ('id', 'title', 'status', 'tags', 'body', 'created_at', 'update_at', 'author', 'images',
+                  'comment_count', 'image_count', 'last_activity_at')
 
     def create(self, validated_data):
 
         request = self.context.get('view').request
         images_data = request.FILES
-        tags_data = validated_data.pop('tags', [])
-        post = Post.objects.create(**validated_data)
-
+        validate_images(images_data)
         # 检测 content_type，根据不同的 content_type 处理 tags
-        if request.content_type == 'application/json':
-            for tag_data in tags_data:
-                tag, _ = Tag.objects.get_or_create(name=tag_data['name'])
-                post.tags.add(tag.id)
-        else:  # 处理 form-data 中的 tags
-            tag_names = request.data.get('tags', '').split(",")
-            for tag_name in tag_names:
-                tag, _ = Tag.objects.get_or_create(name=tag_name.strip())
-                post.tags.add(tag.id)
-            for image_data in images_data.values():
-                Image.objects.create(post=post, image=image_data)
+        tag_names = tag_names_from_request(request, validated_data)
+        # 标签或图片写入失败时不留下半成品帖子
+        with transaction.atomic():
+            post = Post.objects.create(**validated_data)
+            add_post_tags(post, tag_names)
+
+            if request.content_type != 'application/json':  # form-data 中才会带图片
+                for image_data in images_data.values():
+                    Image.objects.create(post=post, image=image_data)
 
         return post
 
@@ -78,33 +193,114 @@ class PostSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         request = self.context.get('view').request
         images_data = request.FILES
-        instance.title = validated_data.get('title', instance.title)
-        instance.body = validated_data.get('body', instance.body)
-        instance.status = validated_data.get('status', instance.status)
-        instance.tags.clear()
+        validate_images(images_data)
+
+        # 只写有变化的字段和关联行；PATCH 时没有提交的 tags 保持不变
+        with transaction.atomic():
+            changed = changed_fields(instance, validated_data, ('title', 'body', 'status'))
+            tags_changed = False
+            if not self.partial or 'tags' in request.data:
+                tags_changed = set_post_tags(instance, tag_names_from_request(request, validated_data))
+            images_changed = update_images(instance.image_set.all(), request, self.partial, post=instance)
+            if changed or tags_changed or images_changed:
+                instance.save(update_fields=changed + ['update_at'])
+        return instance
 
-        instance.image_set.all().delete()
 
-        # 检测 content_type，根据不同的 content_type 处理 tags
-        if request.content_type == 'application/json':
-            tags_data = validated_data.pop('tags', [])
-            for tag_data in tags_data:
-                tag, _ = Tag.objects.get_or_create(name=tag_data['name'])
-                instance.tags.add(tag.id)
-        else:  # 处理 form-data 中的 tags
-            tag_names = request.data.get('tags', '').split(",")
-            for tag_name in tag_names:
-                tag, _ = Tag.objects.get_or_create(name=tag_name.strip())
-                instance.tags.add(tag.id)
-            for image_data in images_data.values():
-                Image.objects.create(post=instance, image=image_data)
-
-        instance.save()
-        return instance
 
+class UserSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomUser
+        fields = ('id', 'username')
+
+
+class PostCompactSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    帖子流卡片用的精简表示（?compact=true）：正文只给摘要，标签只给名称，图片只给第一张的缩略图，
+    作者只给 id 和用户名。?expand=author,tags,images 可以换回完整的嵌套表示。
+    """
+    author = UserSummarySerializer(read_only=True)
+    tags = serializers.SlugRelatedField(many=True, read_only=True, slug_field='name')
+    excerpt = serializers.SerializerMethodField()
+    thumbnail = serializers.SerializerMethodField()
 
+    expandable_fields = {
+        'author': lambda: CustomUserSerializer(read_only=True),
+        'tags': lambda: TagSerializer(many=True, read_only=True),
+        'images': lambda: ImageSerializer(many=True, read_only=True, source='image_set'),
+    }
 
-class CommentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Post
+        fields = ('id', 'title', 'status', 'tags', 'excerpt', 'thumbnail', 'created_at', 'update_at', 'author',
+                  'comment_count', 'image_count', 'last_activity_at')
+        read_only_fields = fields
+
+    def get_excerpt(self, obj):
+        length = get_list_config()['EXCERPT_LENGTH']
+        return obj.body if len(obj.body) <= length else obj.body[:length] + '…'
+
+    def get_thumbnail(self, obj):
+        images = obj.image_set.all()  # 已预取，取第一张不再查询
+        if not images:
+            return None
+        image = images[0]
+        path = (image.renditions or {}).get('thumbnail', {}).get('jpeg')
+        url = default_storage.url(path) if path else image.image.url
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+
+class SearchResultSerializer(PostSerializer):
+    score = serializers.FloatField(source='search_score', read_only=True)
+
+    class Meta(PostSerializer.Meta):
+        fields = PostSerializer.Meta.fields + ('score',)
+
+
+class CommentListSerializer(serializers.ListSerializer):
+    """
+    批量创建评论（JSON，不带图片）：一个事务里批量插入，帖子状态一条 UPDATE 完成。
+    数据库能在批量插入时返回主键（SQLite 3.35+、MariaDB 10.5+）时用 bulk_create，
+    否则（MySQL）在同一个事务里逐条插入。
+    """
+
+    def create(self, validated_data):
+        comments = []
+        retag = []
+        for attrs in validated_data:
+            modify_tags = attrs.pop('modify_tags', False)
+            names = normalize_names(tag['name'] for tag in attrs.pop('tags', []))
+            comment = Comment(**attrs)
+            comments.append(comment)
+            if modify_tags:
+                retag.append((comment.post, names))
+        post_ids = {comment.post_id for comment in comments}
+
+        with transaction.atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                Comment.objects.bulk_create(comments)
+                # bulk_create 不发送信号，这里做 signals 里对单条评论做的事
+                counters.comments_added(comments)
+                response_cache.bump_posts(post_ids)
+                search.schedule_comment_changes([(comment.post_id, comment.body, 1) for comment in comments])
+                events.comments_created(comments)
+            else:
+                for comment in comments:
+                    comment.save()
+            # 和单条评论一样以数据库里的状态为准：校验时读出的帖子可能已经被并发的请求改成了 i，
+            # 先锁住仍为 n 的帖子取出 id，再只更新这些行，状态事件只发给真正变化的帖子
+            started = list(Post.objects.select_for_update().filter(pk__in=post_ids, status='n')
+                           .order_by('pk').values_list('pk', flat=True))
+            Post.objects.filter(pk__in=started, status='n').update(status='i')
+            for post_id in started:
+                events.post_status(post_id, 'i')
+            for post, names in retag:
+                set_post_tags(post, names)
+        return comments
+
+
+class CommentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True)
     post = serializers.PrimaryKeyRelatedField(queryset=Post.objects.all())
     images = ImageSerializer(many=True, read_only=True, source='image_set')
@@ -114,63 +310,44 @@ class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = ('id', 'post', 'body', 'created_at', 'update_at', 'author', 'images', 'tags', 'modify_tags')
+        list_serializer_class = CommentListSerializer
 
     def create(self, validated_data):
         request = self.context.get('view').request
         modify_tags = validated_data.pop('modify_tags', False)
         images_data = request.FILES
-        comment = Comment.objects.create(**validated_data)
-        post = comment.post
-        if(post.status == 'n'):
-            post.status = 'i'
-
-        if modify_tags:
-            post.tags.clear()
-
-            if request.content_type == 'application/json':
-                tags_data = validated_data.pop('tags', [])
-                for tag_data in tags_data:
-                    tag, _ = Tag.objects.get_or_create(name=tag_data['name'])
-                    post.tags.add(tag.id)
-            else:  # 处理 form-data 中的 tags
-                tag_names = request.data.get('tags', '').split(",")
-                for tag_name in tag_names:
-                    tag, _ = Tag.objects.get_or_create(name=tag_name.strip())
-                    post.tags.add(tag.id)
+        validate_images(images_data)
+        tag_names = tag_names_from_request(request, validated_data)
+        with transaction.atomic():
+            comment = Comment.objects.create(**validated_data)
+            post = comment.post
+            # 只改 status 一列，条件写在 WHERE 里：并发评论只有一条真正更新，也不会覆盖同时发生的编辑
+            if Post.objects.filter(pk=post.pk, status='n').update(status='i'):
+                post.status = 'i'
+                events.post_status(post.pk, 'i')
+
+            if modify_tags:
+                set_post_tags(post, tag_names)
+
+                if request.content_type != 'application/json':
+                    for image_data in images_data.values():
+                        Image.objects.create(comment=comment, image=image_data)
 
-                for image_data in images_data.values():
-                    Image.objects.create(comment=comment, image=image_data)
-
-        post.save()
         return comment
 
     def update(self, instance, validated_data):
         request = self.context.get('view').request
         modify_tags = validated_data.pop('modify_tags', False)
         images_data = request.FILES
-        instance.body = validated_data.get('body', instance.body)
-
-        instance.image_set.all().delete()
-
-
-        if modify_tags:
-            post = instance.post
-            post.tags.clear()
-
-            if request.content_type == 'application/json':
-                tags_data = validated_data.pop('tags', [])
-                for tag_data in tags_data:
-                    tag, _ = Tag.objects.get_or_create(name=tag_data['name'])
-                    post.tags.add(tag)
-            else:  # 处理 form-data 中的 tags
-                tag_names = request.data.get('tags', '').split(",")
-                for tag_name in tag_names:
-                    tag, _ = Tag.objects.get_or_create(name=tag_name.strip())
-                    post.tags.add(tag)
-
-                for image_data in images_data.values():
-                    Image.objects.create(comment=instance, image=image_data)
-
-            post.save()
-        instance.save()
-        return instance
\ No newline at end of file
+        validate_images(images_data)
+
+        with transaction.atomic():
+            changed = changed_fields(instance, validated_data, ('body',))
+            images_changed = update_images(instance.image_set.all(), request, self.partial, comment=instance)
+            if modify_tags:
+                post = instance.post
+                if set_post_tags(post, tag_names_from_request(request, validated_data)):
+                    post.save(update_fields=['update_at'])
+            if changed or images_changed:
+                instance.save(update_fields=changed + ['update_at'])
+        return instance
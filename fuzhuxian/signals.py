@@ -0,0 +1,175 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Comment, CustomUser, Image, Post, Tag, touch
+from .authentication import USER_CLAIMS, revoke_user_tokens
+from . import counters, events, image_pipeline, instrumentation, response_cache, search, similarity
+from .tagging import tag_cache
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # tag.post_set.clear()：清空前先记下受影响的帖子
+        instance._similar_post_ids = list(instance.post_set.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # post.tags.add/remove/clear
+        post_ids = [instance.pk]
+    elif action == 'post_clear':
+        post_ids = getattr(instance, '_similar_post_ids', [])
+    else:
+        post_ids = list(pk_set or [])
+    similarity.reindex_posts(post_ids)
+    response_cache.bump_posts(post_ids)
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, **kwargs):
+    if not created:
+        tag_cache.discard_id(instance.pk)
+        # 标签改名后，引用它的帖子的标签词也要更新
+        post_ids = list(instance.post_set.values_list('id', flat=True))
+        similarity.reindex_posts(post_ids)
+        touch(Post, post_ids)
+        response_cache.bump_posts(post_ids)
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_pre_delete(sender, instance, **kwargs):
+    instance._similar_post_ids = list(instance.post_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    tag_cache.discard_id(instance.pk)
+    similarity.reindex_posts(getattr(instance, '_similar_post_ids', []))
+    touch(Post, getattr(instance, '_similar_post_ids', []))
+    response_cache.bump_posts(getattr(instance, '_similar_post_ids', []))
+
+
+@receiver(post_save, sender=Image)
+def image_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.image_added(instance)
+        touch_image_owners(instance)
+        if instance.status == Image.PENDING:
+            image_pipeline.enqueue_image(instance)
+
+
+@receiver(post_delete, sender=Image)
+def image_deleted(sender, instance, **kwargs):
+    counters.image_removed(instance)
+    touch_image_owners(instance)
+    image_pipeline.release_image(instance)
+
+
+def touch_image_owners(image):
+    # 帖子的 update_at 已由 counters.image_added / image_removed 随计数一起刷新
+    touch(Comment, [image.comment_id])
+    response_cache.bump_posts([image.post_id])
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    response_cache.bump_posts([instance.pk])
+
+
+@receiver(pre_save, sender=Post)
+def post_pre_save(sender, instance, update_fields=None, **kwargs):
+    # Post.save 整行保存时 update_fields 包含 status，状态是否真的变化要和库里的值比较
+    instance._saved_status = None
+    if not instance._state.adding and (update_fields is None or 'status' in update_fields):
+        instance._saved_status = Post.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, update_fields=None, **kwargs):
+    # 只改状态等字段时检索文本没有变化
+    if created or update_fields is None or {'title', 'body'}.intersection(update_fields):
+        search.schedule_reindex([instance.pk])
+    if created:
+        events.post_created(instance)
+    else:
+        saved_status = getattr(instance, '_saved_status', None)
+        events.post_updated(instance, update_fields, saved_status is not None and saved_status != instance.status)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    events.post_deleted(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    response_cache.bump_posts([instance.post_id])
+
+
+@receiver(pre_save, sender=Comment)
+def comment_pre_save(sender, instance, update_fields=None, **kwargs):
+    # 检索索引按评论增量更新，编辑时要减掉旧正文的检索词
+    instance._indexed = None
+    if not instance._state.adding and (update_fields is None or {'body', 'post', 'post_id'}.intersection(update_fields)):
+        instance._indexed = Comment.objects.filter(pk=instance.pk).values_list('post_id', 'body').first()
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.comment_added(instance)
+        search.schedule_comment_changes([(instance.post_id, instance.body, 1)])
+        events.comments_created([instance])
+    else:
+        old = getattr(instance, '_indexed', None)
+        if old is not None and old != (instance.post_id, instance.body):
+            search.schedule_comment_changes([(*old, -1), (instance.post_id, instance.body, 1)])
+        events.comment_updated(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.comment_removed(instance)
+    search.schedule_comment_changes([(instance.post_id, instance.body, -1)])
+    events.comment_deleted(instance)
+
+
+@receiver(pre_save, sender=CustomUser)
+def user_pre_save(sender, instance, **kwargs):
+    # token 里带着用户声明，这些字段或密码、启用状态变化后旧 token 要作废
+    if instance.pk is None:
+        return
+    if getattr(instance, '_password_rehashed', False):
+        # 登录时升级哈希算法/参数，密码本身没有变化
+        instance._password_rehashed = False
+        if set(kwargs.get('update_fields') or ()) == {'password'}:
+            return
+    fields = USER_CLAIMS + ('password', 'is_active')
+    old = CustomUser.objects.filter(pk=instance.pk).values(*fields).first()
+    if old is None:
+        return
+    if any(old[field] != getattr(instance, field) for field in fields):
+        revoke_user_tokens(instance.pk)
+    if any(old[field] != getattr(instance, field) for field in USER_CLAIMS):
+        # 帖子和评论的表示里带着作者的用户名、学号：帖子流和相关帖子的缓存、帖子的 ETag（含版本号）都要失效；
+        # 评论的 ETag 只看 update_at，刷新这个用户的评论
+        post_ids = set(Post.objects.filter(author_id=instance.pk).values_list('id', flat=True))
+        comments = Comment.objects.filter(author_id=instance.pk)
+        post_ids.update(comments.values_list('post_id', flat=True))
+        comments.update(update_at=timezone.now())
+        response_cache.bump_posts(post_ids)
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    revoke_user_tokens(instance.pk)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    instrumentation.install_query_recorder(connection)
@@ -0,0 +1,124 @@
+"""
+按标签查找相似帖子。
+
+每个帖子的标签名按 models.normalize_tag_name 规范化（与保存标签时相同）后按空白拆成标签词，写入 TagToken 倒排索引，
+查询时只按标签词做等值匹配，不再对 Post×Tag 做 LIKE '%x%' 扫描。
+
+得分是标签词上的 TF-IDF 余弦近似：
+
+    score(post) = Σ idf(t) / sqrt(|post 的标签词|)   (t 为命中的查询词)
+    idf(t)      = ln(1 + N / df(t))
+
+其中 N 为帖子总数，df(t) 为含有标签词 t 的帖子数。
+"""
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, FloatField, F, Sum, Value, When
+
+from .models import Post, TagToken, normalize_tag_name
+
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 50
+
+
+def tokenize(names):
+    """把标签名列表拆成去重后的规范化标签词，保持出现顺序；查询词和索引用同一套规范化"""
+    if isinstance(names, str):
+        names = [names]
+    tokens = []
+    for name in names:
+        for word in normalize_tag_name(name).split():
+            if word not in tokens:
+                tokens.append(word)
+    return tokens
+
+
+def get_top_k(value=None):
+    default = getattr(settings, 'SIMILAR_POSTS_TOP_K', DEFAULT_TOP_K)
+    try:
+        k = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        k = default
+    return max(1, min(k, MAX_TOP_K))
+
+
+def reindex_posts(post_ids):
+    """重建给定帖子的倒排索引行"""
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    names = {}
+    for post_id, name in Post.tags.through.objects.filter(post_id__in=post_ids) \
+            .values_list('post_id', 'tag__name'):
+        names.setdefault(post_id, []).append(name)
+
+    rows = []
+    for post_id in post_ids:
+        tokens = tokenize(names.get(post_id, []))
+        weight = 1 / math.sqrt(len(tokens)) if tokens else 0
+        rows.extend(TagToken(token=token, post_id=post_id, weight=weight) for token in tokens)
+
+    with transaction.atomic():
+        TagToken.objects.filter(post_id__in=post_ids).delete()
+        TagToken.objects.bulk_create(rows, batch_size=1000)
+
+
+def rebuild_index(chunk_size=1000):
+    """全量重建倒排索引，返回处理的帖子数"""
+    TagToken.objects.all().delete()
+    count = 0
+    ids = []
+    for post_id in Post.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size):
+        ids.append(post_id)
+        if len(ids) >= chunk_size:
+            reindex_posts(ids)
+            count += len(ids)
+            ids = []
+    reindex_posts(ids)
+    return count + len(ids)
+
+
+def rank_posts(user_tags, k=DEFAULT_TOP_K):
+    """返回 [(post_id, score), ...]，按得分从高到低，最多 k 个"""
+    tokens = tokenize(user_tags or [])
+    if not tokens:
+        return []
+
+    # (token, post) 唯一，所以按 token 计数就是 df
+    df = dict(
+        TagToken.objects.filter(token__in=tokens).order_by()
+        .values('token').annotate(df=Count('post')).values_list('token', 'df')
+    )
+    if not df:
+        return []
+    total = Post.objects.count()
+    idf = {token: math.log(1 + total / count) for token, count in df.items()}
+
+    score = Sum(Case(
+        *[When(token=token, then=F('weight') * Value(weight)) for token, weight in idf.items()],
+        default=Value(0.0),
+        output_field=FloatField(),
+    ))
+    return list(
+        TagToken.objects.filter(token__in=list(idf)).order_by()
+        .values('post_id').annotate(score=score)
+        .order_by('-score', '-post_id')
+        .values_list('post_id', 'score')[:k]
+    )
+
+
+def find_similar_posts(user_tags, k=DEFAULT_TOP_K):
+    """返回按相似度排序的 Post 列表，已预取序列化需要的关联数据"""
+    ranked = rank_posts(user_tags, k)
+    if not ranked:
+        return []
+    posts = Post.objects.with_related().in_bulk([post_id for post_id, _ in ranked])
+    result = []
+    for post_id, score in ranked:
+        post = posts.get(post_id)
+        if post is not None:
+            post.matching_score = score
+            result.append(post)
+    return result
@@ -0,0 +1,168 @@
+"""
+帖子和评论的实时推送（Server-Sent Events），事件见 fuzhuxian/events.py：
+
+    GET /events/                 feed 频道：帖子的新建、修改、状态变化、删除和所有新评论
+    GET /posts/<id>/events/      某一个帖子的评论和状态变化
+
+浏览器直接用 EventSource。断线后 EventSource 带上 Last-Event-ID 请求头重连，服务端补发这之后的事件
+（不支持自定义请求头的客户端可以用 ?last_event_id=）。历史里已经找不到时先发一个 reset 事件，
+客户端收到后重新请求一次 /posts/ 或 /posts/<id>/comments/。连接建立时总会带上当前的事件编号，
+没有事件的时候也能从这里续上。
+
+长连接需要 ASGI（forum_backend/asgi.py 使用这里的 EventStreamASGIHandler）：
+Django 3.2 的 ASGIHandler 只会同步遍历流式响应，会把事件循环卡住，异步迭代要到 Django 4.2 才支持。
+WSGI 下同一个地址只返回积压的事件和重连间隔就结束，EventSource 每隔 WSGI_RETRY_MS（默认 15 秒）重连一次，
+相当于轮询：每次重连都是一个完整的请求，要经过全部中间件、占用一个 uwsgi worker，并读一次事件存储。
+为了让这种轮询尽量便宜，WSGI 下 /posts/<id>/events/ 不查帖子是否存在（不存在的帖子只是没有事件）。
+"""
+import asyncio
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler, ASGIRequest
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+
+from . import events
+from .models import Post
+
+_receive = ContextVar('receive')
+
+
+def format_events(items, last_id):
+    """把 last_id 之后的事件编码成 SSE 消息，返回 (字节, 最后一个事件编号)"""
+    parts = []
+    for event in items:
+        if event.id > last_id:
+            parts.append(f'id: {event.id}\nevent: {event.kind}\ndata: {event.data}\n\n')
+            last_id = event.id
+    return ''.join(parts).encode(), last_id
+
+
+class EventStreamResponse(StreamingHttpResponse):
+    """ASGI 下由 EventStreamASGIHandler 异步发送 stream()；WSGI 下遍历时只输出开头部分"""
+
+    def __init__(self, channels, last_event_id, config):
+        self.channels = frozenset(channels)
+        self.last_event_id = last_event_id
+        self.config = config
+        super().__init__(self.replay(), content_type='text/event-stream; charset=utf-8')
+        self['Cache-Control'] = 'no-cache'
+        self['X-Accel-Buffering'] = 'no'  # nginx 不缓冲，事件立即到达客户端
+
+    def head(self, backlog, latest):
+        """连接开始时发送的内容：重连间隔、当前编号或补发的事件；返回 (字节, 已发送到的事件编号)"""
+        retry = f'retry: {self.config["RETRY_MS"]}\n'
+        if backlog is None:
+            return f'{retry}id: {latest}\nevent: reset\ndata: {{}}\n\n'.encode(), latest
+        if self.last_event_id is None:
+            # 只有 id 的消息不会触发客户端的事件，但会更新它的 Last-Event-ID
+            return f'{retry}id: {latest}\n\n'.encode(), latest
+        body, last_id = format_events(backlog, self.last_event_id)
+        return f'{retry}\n'.encode() + body, last_id
+
+    def replay(self):
+        backlog, latest = events.get_hub().replay(self.channels, self.last_event_id)
+        yield self.head(backlog, latest)[0]
+
+    async def stream(self):
+        hub = events.get_hub()
+        subscription, backlog, latest = hub.subscribe(self.channels, self.last_event_id, self.config['BUFFER'])
+        try:
+            chunk, last_id = self.head(backlog, latest)
+            yield chunk
+            while True:
+                pending = await subscription.get(self.config['HEARTBEAT'])
+                if pending is None:
+                    yield b': ping\n\n'
+                    continue
+                chunk, last_id = format_events(pending, last_id)
+                if chunk:
+                    yield chunk
+                if subscription.overflowed:
+                    # 积压超过 BUFFER：发完已有的事件后结束，客户端带着 Last-Event-ID 重连，从历史里补齐
+                    break
+        finally:
+            hub.unsubscribe(subscription)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class EventStreamASGIHandler(ASGIHandler):
+    """在 Django 3.2 的 ASGIHandler 上加入 EventStreamResponse 的异步发送，客户端断开时停止推送"""
+
+    async def __call__(self, scope, receive, send):
+        # 请求体读完后 receive 只会再收到 http.disconnect；send_response 拿不到它，经 contextvar 传过去
+        _receive.set(receive)
+        await super().__call__(scope, receive, send)
+
+    async def send_response(self, response, send):
+        if not isinstance(response, EventStreamResponse):
+            return await super().send_response(response, send)
+        headers = [(header.encode('ascii'), value.encode('latin1')) for header, value in response.items()]
+        headers += [(b'Set-Cookie', c.output(header='').encode('ascii').strip()) for c in response.cookies.values()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        async def pump():
+            stream = response.stream()
+            try:
+                async for chunk in stream:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                await stream.aclose()
+            await send({'type': 'http.response.body'})
+
+        pumping = asyncio.ensure_future(pump())
+        disconnected = asyncio.ensure_future(wait_for_disconnect(_receive.get()))
+        try:
+            await asyncio.wait({pumping, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (pumping, disconnected):
+                task.cancel()
+            await asyncio.gather(pumping, disconnected, return_exceptions=True)
+            await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def last_event_id(request):
+    value = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def open_stream(request, channels):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    config = events.get_config()
+    if not config['ENABLED']:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    if not isinstance(request, ASGIRequest):
+        # WSGI 下没有长连接，客户端靠重连轮询：间隔放长，减少 worker 的占用
+        config = dict(config, RETRY_MS=config['WSGI_RETRY_MS'])
+    if events.get_hub().connections() >= config['MAX_CONNECTIONS']:
+        response = HttpResponse(status=503)
+        response['Retry-After'] = max(1, config['RETRY_MS'] // 1000)
+        return response
+    return EventStreamResponse(channels, last_event_id(request), config)
+
+
+def post_exists(pk):
+    close_old_connections()
+    try:
+        return Post.objects.filter(pk=pk).exists()
+    finally:
+        close_old_connections()
+
+
+async def feed_events(request):
+    return open_stream(request, [events.FEED])
+
+
+async def post_events(request, post_pk):
+    if isinstance(request, ASGIRequest) and not await sync_to_async(post_exists, thread_sensitive=False)(post_pk):
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    return open_stream(request, [events.post_channel(post_pk)])
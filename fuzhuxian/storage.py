@@ -0,0 +1,72 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from PIL import Image as PilImage
+
+BLOB_DIR = 'blobs'
+CHUNK_SIZE = 64 * 1024
+# Pillow 识别出的格式 -> 统一的扩展名：同样的内容上传时叫 .jpg 还是 .jpeg 都存成同一个文件
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp', 'BMP': '.bmp', 'TIFF': '.tif'}
+
+
+def content_digest(content):
+    """按块计算上传文件的 sha256，计算完把读指针放回开头"""
+    sha = hashlib.sha256()
+    content.seek(0)
+    for chunk in iter(lambda: content.read(CHUNK_SIZE), b''):
+        sha.update(chunk)
+    content.seek(0)
+    return sha.hexdigest()
+
+
+def detect_extension(content):
+    """按文件头识别格式，返回统一的扩展名；识别不出时返回空串（文件名只有哈希）"""
+    content.seek(0)
+    try:
+        with PilImage.open(content) as im:
+            return EXTENSIONS.get(im.format, '')
+    except Exception:
+        return ''
+    finally:
+        content.seek(0)
+
+
+def digest_from_name(name):
+    """blobs/ab/abcdef....jpg -> abcdef...；不是内容寻址的文件名返回 None"""
+    if not name or not name.startswith(BLOB_DIR + '/'):
+        return None
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    按内容命名文件：blobs/<前两位>/<sha256><按文件头识别的扩展名>，与上传时的文件名无关。
+    相同内容只写一次，再次保存直接返回已有的文件名。
+    引用计数由 models.ImageBlob 维护，文件只在没有引用时删除；Image 总是引用 ImageBlob.name。
+    """
+
+    def save(self, name, content, max_length=None):
+        digest = content_digest(content)
+        name = f'{BLOB_DIR}/{digest[:2]}/{digest}{detect_extension(content)}'
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+    def restore(self, name, content):
+        """文件不在时按给定的名字写回（已有的 ImageBlob 可能是旧的命名方式）"""
+        if not self.exists(name):
+            super().save(name, content)
+
+    def get_available_name(self, name, max_length=None):
+        # 同名即同内容，不需要像默认实现那样追加随机后缀
+        return name
+
+    def _save(self, name, content):
+        try:
+            return super()._save(name, content)
+        except FileExistsError:
+            # 另一个进程刚好写入了同样的内容
+            return name
@@ -0,0 +1,199 @@
+"""
+合成论坛数据，给压测和基准用（见 generate_forum / bench_api 命令）。
+
+同样的参数和 seed 生成同样的数据：
+  - 用户：用户名 syn-<序号>，学号 9<7 位序号>，密码统一为 password（默认 DEFAULT_PASSWORD）
+  - 标签：按 Zipf 分布使用，少数热门标签覆盖大部分帖子
+  - 帖子：标题/正文来自中文词表，创建时间分布在最近 days 天；
+    没有评论的帖子状态为 n，有评论的为 i 或 a
+  - 评论：每个帖子的评论数服从均值为 comments_per_post 的几何分布
+  - 图片：image_variants 张不同内容的小图，帖子随机引用（内容寻址存储里每种只存一份，各尺寸图片只生成一次）
+
+数据用 bulk_create 批量写入，不经过 signals；写完后统一校正计数、重建检索和标签索引。
+"""
+import io
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image as PilImage
+
+from . import counters, image_pipeline, response_cache, search, similarity
+from .models import Comment, CustomUser, Image, ImageBlob, Post, Tag
+from .storage import digest_from_name
+from .transfer import preserve_timestamps
+
+USERNAME_PREFIX = 'syn-'
+DEFAULT_PASSWORD = 'synthetic-password'
+SYLLABLES = '图书馆食堂宿舍教室实验课程考试报名作业论文老师同学社团活动比赛讲座奖学金选课成绩校园网快递自习'
+BATCH_SIZE = 2000
+
+
+class DatasetExists(Exception):
+    pass
+
+
+def synthetic_users():
+    return CustomUser.objects.filter(username__startswith=USERNAME_PREFIX)
+
+
+def user_number(index):
+    return f'9{index:07d}'
+
+
+def variant_image(index):
+    """第 index 种图片的 PNG 字节（纯色块加上编号决定的条纹，内容互不相同）"""
+    rng = random.Random(index)
+    im = PilImage.new('RGB', (64, 64), tuple(rng.randrange(256) for _ in range(3)))
+    for x in range(0, 64, 4 + index % 8):
+        for y in range(64):
+            im.putpixel((x, y), (255, 255, 255))
+    buf = io.BytesIO()
+    im.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def vocabulary(rng, size):
+    return [''.join(rng.sample(SYLLABLES, rng.randint(2, 3))) for _ in range(size)]
+
+
+def zipf_weights(n, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def geometric(rng, mean):
+    """均值为 mean 的几何分布（可以为 0）"""
+    if mean <= 0:
+        return 0
+    p = 1 / (mean + 1)
+    count = 0
+    while rng.random() > p:
+        count += 1
+    return count
+
+
+def clear():
+    """删除合成用户和他们的帖子、评论、图片，返回删除的用户数"""
+    count = synthetic_users().count()
+    synthetic_users().delete()
+    return count
+
+
+def generate(users=200, posts=5000, comments_per_post=4, images_per_post=0.5, tags=300, image_variants=20,
+             days=180, seed=0, password=DEFAULT_PASSWORD, log=None):
+    """生成数据，返回各类记录的数量；已经有合成数据时抛出 DatasetExists"""
+    if synthetic_users().exists():
+        raise DatasetExists('synthetic data already exists, clear it first')
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    words = vocabulary(rng, 2000)
+    now = timezone.now().replace(microsecond=0)
+    start = now - timedelta(days=days)
+
+    def text(count):
+        return ' '.join(rng.choice(words) for _ in range(count))
+
+    def at(fraction):
+        return start + timedelta(seconds=int((now - start).total_seconds() * fraction))
+
+    began = time.perf_counter()
+    with transaction.atomic(), preserve_timestamps(Post, Comment):
+        log(f'users: {users}')
+        encoded = make_password(password)  # 所有用户共用一个哈希，省去逐个计算 scrypt
+        CustomUser.objects.bulk_create(
+            (CustomUser(username=f'{USERNAME_PREFIX}{i}', number=user_number(i), password=encoded)
+             for i in range(users)),
+            batch_size=BATCH_SIZE,
+        )
+        author_ids = list(synthetic_users().order_by('id').values_list('id', flat=True))
+
+        log(f'tags: {tags}')
+        tag_names = list(dict.fromkeys(rng.choice(words) for _ in range(tags * 2)))[:tags]
+        Tag.objects.bulk_create((Tag(name=name) for name in tag_names), ignore_conflicts=True)
+        tag_ids = list(Tag.objects.filter(name__in=tag_names).order_by('id').values_list('id', flat=True))
+        tag_weights = zipf_weights(len(tag_ids))
+
+        log(f'posts: {posts}')
+        plan = []  # 每个帖子的 (评论数, 图片数)
+        rows = []
+        for i in range(posts):
+            created = at(i / max(posts, 1))
+            comments = geometric(rng, comments_per_post)
+            images = geometric(rng, images_per_post) if image_variants else 0
+            status = 'n' if not comments else rng.choice('ia')
+            plan.append((comments, images))
+            rows.append(Post(title=text(rng.randint(2, 5)), body=text(rng.randint(20, 120)), status=status,
+                             author_id=rng.choice(author_ids), created_at=created, update_at=created))
+        Post.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        posts_created = list(Post.objects.filter(author_id__in=author_ids).order_by('id').values_list('id', 'created_at'))
+
+        through = Post.tags.through
+        links = []
+        for post_id, _ in posts_created:
+            for tag_id in set(rng.choices(tag_ids, tag_weights, k=rng.randint(1, 4))):
+                links.append(through(post_id=post_id, tag_id=tag_id))
+        through.objects.bulk_create(links, batch_size=BATCH_SIZE)
+
+        log('comments')
+        rows = []
+        for (post_id, created), (comments, _) in zip(posts_created, plan):
+            for _ in range(comments):
+                when = min(now, created + timedelta(seconds=rng.randint(60, 7 * 86400)))
+                rows.append(Comment(post_id=post_id, body=text(rng.randint(3, 30)), author_id=rng.choice(author_ids),
+                                    created_at=when, update_at=when))
+            if len(rows) >= BATCH_SIZE:
+                Comment.objects.bulk_create(rows)
+                rows = []
+        Comment.objects.bulk_create(rows)
+
+        log('images')
+        image_count = create_images(rng, posts_created, plan, image_variants)
+
+        log('counters and indexes')
+        counters.reconcile(touch=False)
+        search.rebuild_index()
+        similarity.rebuild_index()
+        response_cache.bump_posts([])
+
+    return {
+        'users': users,
+        'tags': len(tag_ids),
+        'posts': len(posts_created),
+        'comments': Comment.objects.filter(author_id__in=author_ids).count(),
+        'images': image_count,
+        'seconds': round(time.perf_counter() - began, 1),
+    }
+
+
+def create_images(rng, posts_created, plan, image_variants):
+    """每种图片写一次文件，帖子引用已有的 blob；每种图片只处理一次，结果复制给同内容的 Image"""
+    if not image_variants:
+        return 0
+    storage = Image._meta.get_field('image').storage
+    blobs = []
+    for index in range(image_variants):
+        data = variant_image(index)
+        name = storage.save(f'synthetic-{index}.png', ContentFile(data))
+        blob, _ = ImageBlob.objects.get_or_create(
+            sha256=digest_from_name(name), defaults={'name': name, 'size': len(data)})
+        blobs.append(blob)
+
+    rows = []
+    refs = Counter()
+    for (post_id, _), (_, images) in zip(posts_created, plan):
+        for _ in range(images):
+            blob = rng.choice(blobs)
+            refs[blob.pk] += 1
+            rows.append(Image(post_id=post_id, image=blob.name, blob=blob))
+    Image.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+    for blob_id, count in refs.items():
+        ImageBlob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') + count)
+        image_pipeline.process_image(Image.objects.filter(blob_id=blob_id).values_list('id', flat=True).first())
+    return len(rows)
@@ -0,0 +1,128 @@
+"""
+标签解析：把一组标签名换成 Tag id。
+
+标签名先规范化（与数据库里的唯一名称一致），
+整组标签只查一次库、缺失的用一次 bulk_create 补齐，
+并在进程内用 LRU 缓存 name -> id，标签改名/删除时由 signals 失效对应条目。
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import Tag, normalize_tag_name
+
+DEFAULT_CACHE_SIZE = 2048
+
+
+class TagCache:
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, names):
+        found = {}
+        with self._lock:
+            for name in names:
+                if name in self._data:
+                    self._data.move_to_end(name)
+                    found[name] = self._data[name]
+        return found
+
+    def set_many(self, mapping):
+        with self._lock:
+            for name, tag_id in mapping.items():
+                self._data[name] = tag_id
+                self._data.move_to_end(name)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, name):
+        with self._lock:
+            self._data.pop(name, None)
+
+    def discard_id(self, tag_id):
+        with self._lock:
+            for name in [name for name, cached in self._data.items() if cached == tag_id]:
+                del self._data[name]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+tag_cache = TagCache(getattr(settings, 'TAG_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+
+
+def normalize_names(names):
+    """规范化标签名（见 models.normalize_tag_name），去掉空标签，去重并保持顺序"""
+    result = []
+    for name in names or []:
+        name = normalize_tag_name(name)
+        if name and name not in result:
+            result.append(name)
+    return result
+
+
+def tag_names_from_request(request, validated_data):
+    """JSON 请求里 tags 是 [{'name': ...}]，form-data 里是逗号分隔的字符串"""
+    tags_data = validated_data.pop('tags', [])
+    if request.content_type == 'application/json':
+        return normalize_names(tag['name'] for tag in tags_data)
+    return normalize_names(request.data.get('tags', '').split(','))
+
+
+def resolve_tag_ids(names):
+    """返回与 names 顺序一致的 Tag id 列表，不存在的标签会被创建"""
+    names = normalize_names(names)
+    ids = tag_cache.get_many(names)
+    missing = [name for name in names if name not in ids]
+    if missing:
+        found = {}
+        for tag_id, name in Tag.objects.filter(name__in=missing).values_list('id', 'name'):
+            found[name] = tag_id
+        new_names = [name for name in missing if name not in found]
+        if new_names:
+            # 名称唯一：并发创建同名标签时忽略冲突，下面统一再查一次
+            # （MySQL 的 bulk_create 也不回填主键）
+            Tag.objects.bulk_create([Tag(name=name) for name in new_names], ignore_conflicts=True)
+            for tag_id, name in Tag.objects.filter(name__in=new_names).values_list('id', 'name'):
+                found[name] = tag_id
+        tag_cache.set_many(found)
+        ids.update(found)
+    return [ids[name] for name in names]
+
+
+def add_post_tags(post, names):
+    """给帖子追加标签：一次解析 + 一次中间表插入"""
+    if not names:
+        return
+    tag_ids = resolve_tag_ids(names)
+    try:
+        with transaction.atomic():
+            post.tags.add(*tag_ids)
+    except IntegrityError:
+        # 缓存里的 id 可能已被其他进程删除，清空缓存后重试一次
+        tag_cache.clear()
+        post.tags.add(*resolve_tag_ids(names))
+
+
+def set_post_tags(post, names):
+    """
+    把帖子的标签改成 names：只删除多余的、插入缺少的关联行。
+    返回标签是否有变化。
+    """
+    wanted = resolve_tag_ids(names)
+    current = set(post.tags.values_list('id', flat=True))
+    to_remove = current.difference(wanted)
+    to_add = [tag_id for tag_id in wanted if tag_id not in current]
+    if to_remove:
+        post.tags.remove(*to_remove)
+    if to_add:
+        post.tags.add(*to_add)
+    return bool(to_remove or to_add)
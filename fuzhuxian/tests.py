@@ -1,3 +1,1517 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Sum
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+from PIL import Image as PilImage
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Tag, Post, Comment, Image, ImageBlob, CustomUser, SearchToken, TagToken, normalize_tag_name
+from .serializers import CommentSerializer
+from .tagging import resolve_tag_ids, tag_cache
+from . import counters, events, image_pipeline, imaging, instrumentation, search, similarity, synthetic, throttling, transfer
+from .sse import EventStreamASGIHandler, EventStreamResponse
+from .storage import ContentAddressedStorage, content_digest
+from .authentication import revocations, user_cache
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_upload(name='test.png'):
+    buf = io.BytesIO()
+    PilImage.new('RGB', (8, 8), (255, 0, 0)).save(buf, format='PNG')
+    return SimpleUploadedFile(name, buf.getvalue(), content_type='image/png')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, THROTTLE=dict(settings.THROTTLE, STORE_PATH=None),
+                   EVENTS=dict(settings.EVENTS, STORE_PATH=None),
+                   METRICS=dict(settings.METRICS, STORE_PATH=None, LOG=False))
+class ForumTestCase(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        caches['default'].clear()
+        revocations.clear()
+        user_cache.clear()
+        throttling.get_store().clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='alice', number='2021001', password='pass12345')
+
+    def make_post(self, title='post', tags=('a', 'b'), images=1, body='body', **kwargs):
+        post = Post.objects.create(title=title, body=body, author=self.user, **kwargs)
+        for name in tags:
+            tag, _ = Tag.objects.get_or_create(name=normalize_tag_name(name))
+            post.tags.add(tag)
+        for _ in range(images):
+            Image.objects.create(post=post, image=make_upload())
+        return post
+
+
+class QueryCountTests(ForumTestCase):
+    """帖子列表/详情及嵌套评论的查询次数不随数据量增长"""
+
+    def test_post_list_query_count_is_constant(self):
+        for i in range(5):
+            self.make_post(title=f'post {i}')
+        # ETag 校验值 + 缓存版本号 + COUNT + 帖子(含作者) + 标签 + 图片
+        with self.assertNumQueries(6):
+            response = self.client.get('/posts/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_post_detail_query_count(self):
+        post = self.make_post(images=3)
+        with self.assertNumQueries(5):  # ETag 校验值 + 缓存版本号 + 帖子 + 标签 + 图片
+            response = self.client.get(f'/posts/{post.id}/')
+        self.assertEqual(len(response.data['images']), 3)
+        self.assertEqual(response.data['author']['username'], 'alice')
+
+    def test_nested_comments_query_count_is_constant(self):
+        post = self.make_post()
+        for i in range(10):
+            comment = Comment.objects.create(post=post, body=f'c{i}', author=self.user)
+            Image.objects.create(comment=comment, image=make_upload())
+        # ETag 校验值 + 评论(含作者) + 图片
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/posts/{post.id}/comments/')
+        self.assertEqual(len(response.data), 10)
+
+
+class SparseFieldsTests(ForumTestCase):
+
+    def test_fields_limits_output_and_prefetches(self):
+        for i in range(3):
+            self.make_post(title=f'post {i}')
+        # ETag 校验值 + 缓存版本号 + COUNT + 帖子，不再预取标签和图片
+        with self.assertNumQueries(4):
+            response = self.client.get('/posts/?fields=id,title,status')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title', 'status'})
+
+        response = self.client.get('/posts/?fields=id,tags')
+        self.assertEqual(response.data['results'][0]['tags'][0]['name'], 'a')
+
+    @override_settings(POST_LIST={'EXCERPT_LENGTH': 10})
+    def test_compact_list(self):
+        post = self.make_post(title='long', body='正文' * 20, images=2)
+        self.make_post(title='short', body='短', images=0)
+        with self.assertNumQueries(6):
+            response = self.client.get('/posts/?compact=true')
+        short, long = response.data['results']
+        self.assertEqual(long['excerpt'], '正文' * 5 + '…')
+        self.assertEqual(short['excerpt'], '短')
+        self.assertEqual(long['tags'], ['a', 'b'])
+        self.assertEqual(long['author'], {'id': self.user.id, 'username': 'alice'})
+        self.assertTrue(long['thumbnail'].endswith(post.image_set.order_by('id').first().image.url))
+        self.assertIsNone(short['thumbnail'])
+        self.assertNotIn('body', long)
+        self.assertNotIn('images', long)
+
+        response = self.client.get('/posts/?compact=true&expand=author,tags,images&fields=id,author,tags,images')
+        long = response.data['results'][1]
+        self.assertEqual(set(long), {'id', 'author', 'tags', 'images'})
+        self.assertIn('is_staff', long['author'])
+        self.assertEqual(long['tags'][0]['name'], 'a')
+        self.assertEqual(len(long['images']), 2)
+
+    def test_fields_do_not_affect_writes(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/posts/?fields=id', {'title': 't', 'body': 'b'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['body'], 'b')
+
+
+class CursorPaginationTests(ForumTestCase):
+
+    def test_post_feed_cursor_walks_all_pages_without_count(self):
+        created = [self.make_post(title=f'post {i}', status='i', images=0) for i in range(12)]
+        self.make_post(title='other status', status='a', images=0)
+        seen = []
+        url = '/posts/?status=i&pagination=cursor'
+        while url:
+            with self.assertNumQueries(4):  # 缓存版本号 + 帖子 + 标签 + 图片，没有 COUNT
+                response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [post.id for post in reversed(created)])
+
+    def test_default_post_pagination_unchanged(self):
+        self.make_post(images=0)
+        response = self.client.get('/posts/')
+        self.assertEqual(response.data['count'], 1)
+
+    def test_nested_comments_cursor(self):
+        post = self.make_post(images=0)
+        for i in range(7):
+            Comment.objects.create(post=post, body=f'c{i}', author=self.user)
+        response = self.client.get(f'/posts/{post.id}/comments/?pagination=cursor')
+        self.assertEqual(len(response.data['results']), 5)
+        response = self.client.get(response.data['next'])
+        self.assertEqual([c['body'] for c in response.data['results']], ['c1', 'c0'])
+        self.assertIsNone(response.data['next'])
+        # 不带参数时仍然返回完整列表
+        self.assertEqual(len(self.client.get(f'/posts/{post.id}/comments/').data), 7)
+
+
+class SimilarPostsTests(ForumTestCase):
+
+    def test_index_follows_tag_writes(self):
+        post = self.make_post(tags=('Linear Algebra',), images=0)
+        self.assertEqual(set(TagToken.objects.filter(post=post).values_list('token', flat=True)), {'linear', 'algebra'})
+        tag = Tag.objects.get(name='linear algebra')
+        tag.name = 'calculus'
+        tag.save()
+        self.assertEqual(list(TagToken.objects.filter(post=post).values_list('token', flat=True)), ['calculus'])
+        post.tags.clear()
+        self.assertFalse(TagToken.objects.filter(post=post).exists())
+
+    def test_ranking_prefers_higher_overlap(self):
+        exact = self.make_post(title='exact', tags=('matrix', 'eigen'), images=0)
+        partial = self.make_post(title='partial', tags=('matrix', 'proof', 'limit'), images=0)
+        self.make_post(title='unrelated', tags=('poetry',), images=0)
+        response = self.client.post('/similar_posts/', {'tags': ['matrix eigen']}, format='json')
+        self.assertEqual([p['id'] for p in response.data], [exact.id, partial.id])
+
+    def test_query_uses_the_same_normalization_as_tags(self):
+        post = self.make_post(tags=('Ｃａｆé　Ｍａｔｈ',), images=0)
+        self.assertEqual(similarity.tokenize(['Ｃａｆé\u3000ＭＡＴＨ', 'cafe\u0301']), ['café', 'math'])
+        response = self.client.post('/similar_posts/', {'tags': ['ＣＡＦＥ\u0301']}, format='json')
+        self.assertEqual([p['id'] for p in response.data], [post.id])
+
+    def test_top_k_and_empty_query(self):
+        for i in range(4):
+            self.make_post(title=f'p{i}', tags=('shared',), images=0)
+        response = self.client.post('/similar_posts/', {'tags': ['shared'], 'k': 2}, format='json')
+        self.assertEqual(len(response.data), 2)
+        response = self.client.post('/similar_posts/', {'tags': ['nothing']}, format='json')
+        self.assertEqual(response.data, [])
+
+
+class SearchTests(ForumTestCase):
+
+    def write(self, func):
+        # 索引在事务提交后更新
+        with self.captureOnCommitCallbacks(execute=True):
+            return func()
+
+    def search(self, **params):
+        response = self.client.get('/posts/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [post['id'] for post in response.data['results']]
+
+    def test_tokenize_splits_cjk_into_bigrams(self):
+        self.assertEqual(search.tokenize('图书馆 Django3 开放!'), ['图书', '书馆', 'django3', '开放'])
+        self.assertEqual(search.tokenize('书'), ['书'])
+
+    def test_ranking_covers_title_body_and_comments(self):
+        in_title = self.write(lambda: self.make_post(title='图书馆开放时间', images=0))
+        in_body = self.write(lambda: self.make_post(title='问题', body='周末图书馆几点关门', images=0))
+        in_comment = self.write(lambda: self.make_post(title='求助', images=0))
+        self.write(lambda: Comment.objects.create(post=in_comment, body='去图书馆问问', author=self.user))
+        self.write(lambda: self.make_post(title='食堂', images=0))
+        self.assertEqual(self.search(q='图书馆'), [in_title.id, in_body.id, in_comment.id])
+        response = self.client.get('/posts/search/', {'q': '图书馆'})
+        self.assertEqual(response.data['count'], 3)
+        self.assertGreater(response.data['results'][0]['score'], response.data['results'][1]['score'])
+        # 所有检索词都要命中
+        self.assertEqual(self.search(q='图书馆 食堂'), [])
+        self.assertEqual(self.search(q=''), [])
+
+    def test_status_and_tag_filters(self):
+        open_post = self.write(lambda: self.make_post(title='exam schedule', tags=('math',), images=0))
+        solved = self.write(lambda: self.make_post(title='exam room', tags=('math', 'physics'), status='a', images=0))
+        self.assertEqual(set(self.search(q='exam')), {open_post.id, solved.id})
+        self.assertEqual(self.search(q='exam', status='a'), [solved.id])
+        self.assertEqual(self.search(q='exam', tags='math,physics'), [solved.id])
+
+    def test_index_follows_edits_and_deletes(self):
+        post = self.write(lambda: self.make_post(title='old title', images=0))
+        comment = self.write(lambda: Comment.objects.create(post=post, body='reply', author=self.user))
+        self.client.force_authenticate(self.user)
+        self.write(lambda: self.client.patch(f'/posts/{post.id}/', {'title': 'new title'}, format='json'))
+        self.assertEqual(self.search(q='old'), [])
+        self.assertEqual(self.search(q='new'), [post.id])
+        self.write(comment.delete)
+        self.assertEqual(self.search(q='reply'), [])
+        self.write(post.delete)
+        self.assertFalse(SearchToken.objects.exists())
+
+
+    def test_comment_writes_update_only_their_tokens(self):
+        post = self.write(lambda: self.make_post(title='library hours', images=0))
+        for i in range(5):
+            self.write(lambda: Comment.objects.create(post=post, body=f'reply {i} library', author=self.user))
+        comment = self.write(lambda: Comment.objects.create(post=post, body='open late', author=self.user))
+        with CaptureQueriesContext(connection) as queries:
+            self.write(lambda: Comment.objects.create(post=post, body='library open', author=self.user))
+            comment.body = 'closed early'
+            self.write(comment.save)
+            self.write(comment.delete)
+        # 增量更新不重读帖子的其它评论
+        self.assertFalse([q['sql'] for q in queries if q['sql'].startswith('SELECT')
+                          and '"fuzhuxian_comment"."body"' in q['sql'] and '"fuzhuxian_comment"."id" =' not in q['sql']])
+
+        def index():
+            post.refresh_from_db()
+            return post.search_terms, sorted(SearchToken.objects.filter(post=post).values_list('token', 'tf', 'weight'))
+        incremental = index()
+        search.reindex_posts([post.id])
+        self.assertEqual(incremental, index())
+        self.assertEqual(self.search(q='late'), [])
+        self.assertEqual(self.search(q='library open'), [post.id])
+
+    def test_admin_search_is_not_truncated(self):
+        from .admin import PostAdmin
+        posts = [self.write(lambda: self.make_post(title=f'exam {i}', images=0)) for i in range(3)]
+        with override_settings(SEARCH={'MAX_RESULTS': 1}):
+            queryset, _ = PostAdmin(Post, None).get_search_results(None, Post.objects.all(), 'exam')
+        self.assertEqual(set(queryset.values_list('id', flat=True)), {post.id for post in posts})
+
+
+class PostCounterTests(ForumTestCase):
+
+    def test_comments_and_images_update_counters(self):
+        post = self.make_post(images=2)
+        post.refresh_from_db()
+        self.assertEqual((post.comment_count, post.image_count), (0, 2))
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/comments/', {'post': post.id, 'body': 'reply'}, format='json')
+        comment = Comment.objects.get(pk=response.data['id'])
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(post.last_activity_at, comment.created_at)
+        data = self.client.get(f'/posts/{post.id}/').data
+        self.assertEqual((data['comment_count'], data['image_count']), (1, 2))
+
+        comment.delete()
+        post.image_set.first().delete()
+        post.refresh_from_db()
+        self.assertEqual((post.comment_count, post.image_count), (0, 1))
+        self.assertEqual(post.last_activity_at, post.created_at)
+
+    def test_order_by_activity(self):
+        old = self.make_post(title='old', images=0)
+        new = self.make_post(title='new', images=0)
+        Comment.objects.create(post=old, body='bump', author=self.user)
+        response = self.client.get('/posts/?order=activity')
+        self.assertEqual([p['id'] for p in response.data['results']], [old.id, new.id])
+        response = self.client.get('/posts/?order=activity&pagination=cursor')
+        self.assertEqual([p['id'] for p in response.data['results']], [old.id, new.id])
+        self.assertEqual([p['id'] for p in self.client.get('/posts/').data['results']], [new.id, old.id])
+
+    def test_reconcile_fixes_drift_only(self):
+        post = self.make_post(images=1)
+        untouched = self.make_post(images=0)
+        Comment.objects.bulk_create([Comment(post=post, body=str(i), author=self.user) for i in range(3)])
+        self.assertEqual(counters.reconcile(), [post.id])
+        post.refresh_from_db()
+        self.assertEqual((post.comment_count, post.image_count), (3, 1))
+        self.assertEqual(post.last_activity_at, post.comments.latest('created_at').created_at)
+        self.assertEqual(counters.reconcile([post.id, untouched.id]), [])
+
+
+class CommentStatusTests(ForumTestCase):
+
+    def test_first_comment_flips_status_with_single_column_update(self):
+        post = self.make_post(images=0)
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/comments/', {'post': post.id, 'body': 'reply'}, format='json')
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "fuzhuxian_post"')]
+        self.assertTrue(updates)
+        # 不再整行写回标题和正文
+        self.assertFalse(any('"title"' in sql or '"body"' in sql for sql in updates))
+        post.refresh_from_db()
+        self.assertEqual(post.status, 'i')
+
+        Post.objects.filter(pk=post.pk).update(status='a')
+        self.client.post('/comments/', {'post': post.id, 'body': 'later'}, format='json')
+        post.refresh_from_db()
+        self.assertEqual(post.status, 'a')
+
+
+class BatchCreateTests(ForumTestCase):
+
+    def test_tag_batch_is_created_in_order(self):
+        response = self.client.post('/tags/', [{'name': 'Python'}, {'name': 'django'}], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['name'] for item in response.data], ['python', 'django'])
+        self.assertEqual([item['id'] for item in response.data],
+                         list(Tag.objects.filter(name__in=['python', 'django']).order_by('id').values_list('id', flat=True)))
+
+    def test_invalid_item_rejects_whole_batch(self):
+        Tag.objects.create(name='python')
+        response = self.client.post('/tags/', [{'name': 'go'}, {'name': 'Python'}, {'name': 'rust'}, {'name': 'GO'}],
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data), 4)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('name', response.data[1])
+        self.assertFalse(Tag.objects.filter(name__in=['go', 'rust']).exists())
+
+        response = self.client.post('/tags/', [{'name': 'go'}, {'name': 'Go'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('name', response.data[1])
+
+    def test_comment_batch_updates_posts_once(self):
+        first = self.make_post(title='first', images=0)
+        second = self.make_post(title='second', images=0)
+        self.client.force_authenticate(self.user)
+        payload = [{'post': first.id, 'body': 'one'}, {'post': second.id, 'body': 'two'},
+                   {'post': first.id, 'body': 'three'}]
+        response = self.client.post('/comments/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['body'] for item in response.data], ['one', 'two', 'three'])
+        ids = [item['id'] for item in response.data]
+        self.assertEqual(list(Comment.objects.filter(pk__in=ids).order_by('id').values_list('body', flat=True)),
+                         ['one', 'two', 'three'])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.comment_count, first.status), (2, 'i'))
+        self.assertEqual((second.comment_count, second.status), (1, 'i'))
+        self.assertEqual(counters.reconcile(), [])
+
+        response = self.client.post('/comments/', [{'post': first.id, 'body': 'ok'}, {'post': first.id}],
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual(Comment.objects.count(), 3)
+
+    @override_settings(BATCH_CREATE={'MAX_ITEMS': 2})
+    def test_batch_size_is_limited(self):
+        response = self.client.post('/tags/', [{'name': f't{i}'} for i in range(3)], format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/tags/', [], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Tag.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, METRICS=dict(settings.METRICS, STORE_PATH=None, LOG=False))
+class ConcurrentCommentTests(TransactionTestCase):
+    """多个线程同时评论同一个帖子，同时还有人在改标题"""
+    threads = 8
+    comments_per_thread = 5
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = CustomUser.objects.create_user(username='alice', number='2021001', password='pass12345')
+        self.post = Post.objects.create(title='original', body='body', author=self.user)
+
+    def run_with_retry(self, func, done=None):
+        # SQLite 同一时间只允许一个写事务，被锁住时重试；MySQL 上是真正并发执行。
+        # 评论提交后的回调（如检索索引）也可能被锁住，这时评论已经写入，不能重复提交
+        while True:
+            try:
+                return func()
+            except OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+            if done is not None and self.run_with_retry(done):
+                return None
+            time.sleep(0.001)
+
+    def comment(self, worker):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        try:
+            for i in range(self.comments_per_thread):
+                body = f'{worker}-{i}'
+                response = self.run_with_retry(
+                    lambda: client.post('/comments/', {'post': self.post.id, 'body': body}, format='json'),
+                    lambda: Comment.objects.filter(body=body).exists(),
+                )
+                if response is not None:
+                    self.assertEqual(response.status_code, 201)
+                if worker == 0 and i == 2:
+                    self.run_with_retry(lambda: Post.objects.filter(pk=self.post.pk).update(title='edited'))
+        finally:
+            connection.close()
+
+    def test_no_lost_updates(self):
+        with ThreadPoolExecutor(self.threads) as pool:
+            list(pool.map(self.comment, range(self.threads)))
+        self.post.refresh_from_db()
+        total = self.threads * self.comments_per_thread
+        self.assertEqual(Comment.objects.filter(post=self.post).count(), total)
+        self.assertEqual(self.post.comment_count, total)
+        self.assertEqual(self.post.status, 'i')
+        self.assertEqual(self.post.title, 'edited')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'MySQL 的优化器在小表上会直接全表扫描，计划不稳定')
+class IndexUsageTests(ForumTestCase):
+    """接口实际发出的查询都应当走索引，而不是全表扫描"""
+
+    def setUp(self):
+        super().setUp()
+        for i in range(3):
+            post = self.make_post(title=f'post {i}', status='i', images=1)
+            Comment.objects.create(post=post, body='reply', author=self.user)
+        self.post = post
+
+    def assert_no_table_scans(self, method, url, data=None):
+        caches['default'].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertEqual(response.status_code, 200)
+        with connection.cursor() as cursor:
+            for query in queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                # 没有 WHERE、按主键顺序读一页（LIMIT）时，"SCAN t" 读完一页就停
+                paged = ' LIMIT ' in query['sql'] and ' WHERE ' not in query['sql']
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    # "SCAN t" 是全表扫描；"SCAN t USING INDEX x" 是按索引顺序读取
+                    if detail.startswith('SCAN fuzhuxian_') and 'USING' not in detail and not paged:
+                        self.fail(f'{url}: {detail}\n{query["sql"]}')
+
+    def test_hot_queries_use_indexes(self):
+        self.client.force_authenticate(self.user)
+        for url in ('/posts/', '/posts/?status=i', '/posts/?my_posts=true', '/posts/?pagination=cursor',
+                    '/posts/?order=activity&pagination=cursor', f'/posts/{self.post.id}/',
+                    f'/posts/{self.post.id}/comments/', f'/posts/{self.post.id}/comments/?pagination=cursor',
+                    '/posts/search/?q=post', '/tags/?page=1'):
+            self.assert_no_table_scans('get', url)
+        self.assert_no_table_scans('post', '/similar_posts/', {'tags': ['a']})
+
+    def test_named_indexes_back_feed_queries(self):
+        for queryset, index in (
+            (Post.objects.order_by('-created_at', '-id'), 'post_created_id_idx'),
+            (Post.objects.filter(status='i').order_by('-created_at', '-id'), 'post_status_created_idx'),
+            (Post.objects.filter(author=self.user).order_by('-created_at', '-id'), 'post_author_created_idx'),
+            (Post.objects.order_by('-last_activity_at', '-id'), 'post_activity_id_idx'),
+            (Comment.objects.filter(post=self.post).order_by('-created_at', '-id'), 'comment_post_created_idx'),
+        ):
+            self.assertIn(f'USING INDEX {index}', queryset[:5].explain())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class MigrationTests(TransactionTestCase):
+    """按基线模型建的库：0001 --fake 之后 migrate，补齐计数和图片的 blob"""
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('fuzhuxian', target)])
+        return executor.loader.project_state([('fuzhuxian', target)]).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes('fuzhuxian')[0][1])
+
+    def test_upgrade_backfills_counters_and_blobs(self):
+        apps = self.migrate('0001_initial')
+        User, Post, Comment, Image = (apps.get_model('fuzhuxian', name)
+                                      for name in ('CustomUser', 'Post', 'Comment', 'Image'))
+        user = User.objects.create(username='alice', number='2021001')
+        post = Post.objects.create(title='old', body='body', author=user)
+        quiet = Post.objects.create(title='quiet', body='body', author=user)
+        Comment.objects.create(post=post, body='c1', author=user)
+        latest = Comment.objects.create(post=post, body='c2', author=user)
+        content = make_upload().read()
+        for name in ('legacy/a.png', 'legacy/b.png'):
+            default_storage.save(name, io.BytesIO(content))
+            Image.objects.create(post=post, image=name)
+        missing = Image.objects.create(post=quiet, image='legacy/missing.png')
+
+        with self.assertLogs('fuzhuxian', 'WARNING') as logs:
+            apps = self.migrate('0004_backfill_counters_and_blobs')
+        self.assertIn('legacy/missing.png is missing', logs.output[0])
+        Post, Image, ImageBlob = (apps.get_model('fuzhuxian', name) for name in ('Post', 'Image', 'ImageBlob'))
+        post, quiet = Post.objects.get(pk=post.pk), Post.objects.get(pk=quiet.pk)
+        self.assertEqual((post.comment_count, post.image_count, post.last_activity_at),
+                         (2, 2, latest.created_at))
+        self.assertEqual((quiet.comment_count, quiet.image_count, quiet.last_activity_at),
+                         (0, 1, quiet.created_at))
+        # 内容相同的两张图共用一个 blob
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(set(Image.objects.filter(post=post).values_list('blob', 'image')), {(blob.pk, blob.name)})
+        self.assertTrue(default_storage.exists(blob.name))
+        self.assertIsNone(Image.objects.get(pk=missing.pk).blob_id)
+
+
+class TransferTests(ForumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(tempfile.mkdtemp(), 'forum.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path), True)
+
+    def make_forum(self):
+        posts = [self.make_post(title=f'post {i}', tags=('a', f't{i}'), images=1) for i in range(3)]
+        bob = CustomUser.objects.create_user(username='bob', number='2021002', password='x')
+        for post in posts[:2]:
+            comment = Comment.objects.create(post=post, body='reply', author=bob)
+            Image.objects.create(comment=comment, image=make_upload('c.png'))
+        return posts
+
+    def snapshot(self):
+        return [
+            (p.id, p.title, p.author.number, p.created_at, p.update_at, p.comment_count, p.image_count,
+             sorted(t.name for t in p.tags.all()), sorted(c.body for c in p.comments.all()))
+            for p in Post.objects.order_by('id').select_related('author')
+        ]
+
+    def test_round_trip_and_reimport_is_idempotent(self):
+        self.make_forum()
+        before = self.snapshot()
+        progress = transfer.export_records(self.path, chunk_size=2)
+        self.assertEqual(progress.counts, {'posts': 3, 'comments': 2})
+        self.assertFalse(os.path.exists(transfer.checkpoint_path(self.path)))
+
+        Post.objects.all().delete()
+        CustomUser.objects.filter(username='bob').delete()
+        progress = transfer.import_records(self.path, chunk_size=2)
+        self.assertEqual((progress.counts['posts'], progress.counts['comments'], progress.counts['images']), (3, 2, 5))
+        self.assertEqual(self.snapshot(), before)
+        self.assertFalse(CustomUser.objects.get(number='2021002').has_usable_password())
+        # 两张图片内容相同，共用一个 blob
+        self.assertEqual(ImageBlob.objects.get().ref_count, 5)
+        self.assertEqual(search.rank_posts('post')[0][0], before[-1][0])
+
+        progress = transfer.import_records(self.path, chunk_size=2)
+        self.assertEqual(progress.rows, 0)
+        self.assertEqual(progress.counts['skipped_posts'], 3)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 5)
+
+    def test_import_resumes_from_checkpoint(self):
+        self.make_forum()
+        transfer.export_records(self.path, chunk_size=10)
+        Post.objects.all().delete()
+
+        real_import_chunk = transfer.import_chunk
+        calls = []
+
+        def fail_on_second_chunk(records, *args):
+            calls.append(len(records))
+            if len(calls) == 2:
+                raise RuntimeError('interrupted')
+            real_import_chunk(records, *args)
+
+        with mock.patch.object(transfer, 'import_chunk', fail_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                transfer.import_records(self.path, chunk_size=2)
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertTrue(os.path.exists(transfer.checkpoint_path(self.path)))
+
+        progress = transfer.import_records(self.path, chunk_size=2, resume=True)
+        self.assertEqual((progress.counts['posts'], progress.counts['comments']), (1, 2))
+        self.assertEqual(progress.counts['skipped_posts'], 0)
+        self.assertEqual(Post.objects.count(), 3)
+
+
+    def test_import_normalizes_tag_names(self):
+        records = [
+            {'type': 'post', 'id': 100 + i, 'author': {'number': '2021001', 'username': 'alice'}, 'title': f'p{i}',
+             'body': 'b', 'created_at': '2024-01-01T00:00:00', 'update_at': '2024-01-01T00:00:00', 'tags': tags}
+            for i, tags in enumerate([['Foo', 'foo', 'Bar'], ['zeta'], ['bar', ' ']])
+        ]
+        with open(self.path, 'w') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+        transfer.import_records(self.path, reindex=False)
+        self.assertEqual({post.id: sorted(tag.name for tag in post.tags.all()) for post in Post.objects.all()},
+                         {100: ['bar', 'foo'], 101: ['zeta'], 102: ['bar']})
+        self.assertEqual(sorted(Tag.objects.values_list('name', flat=True)), ['bar', 'foo', 'zeta'])
+
+
+class TagResolutionTests(ForumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        tag_cache.clear()
+
+    def test_resolve_creates_missing_and_caches(self):
+        Tag.objects.create(name='existing')
+        with self.assertNumQueries(3):  # 查已有 + bulk_create + 回查新建
+            ids = resolve_tag_ids(['existing', ' new ', 'other', 'new', ''])
+        self.assertEqual(list(Tag.objects.filter(id__in=ids).values_list('name', flat=True).order_by('id')),
+                         ['existing', 'new', 'other'])
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_tag_ids(['other', 'existing']), [ids[2], ids[0]])
+
+    def test_renamed_tag_is_evicted(self):
+        old_id = resolve_tag_ids(['old'])[0]
+        tag = Tag.objects.get(id=old_id)
+        tag.name = 'renamed'
+        tag.save()
+        self.assertNotEqual(resolve_tag_ids(['old'])[0], old_id)
+
+    def test_post_create_uses_bulk_tag_path(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/posts/', {
+            'title': 't', 'body': 'b', 'tags': [{'name': 'x'}, {'name': 'y'}, {'name': 'x'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(t['name'] for t in response.data['tags']), ['x', 'y'])
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_failed_image_write_leaves_no_post(self):
+        self.client.force_authenticate(self.user)
+        with mock.patch.object(Image, 'save', side_effect=OSError('disk full')), self.assertRaises(OSError):
+            self.client.post('/posts/', {'title': 't', 'body': 'b', 'image': make_upload()})
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(Post.tags.through.objects.exists())
+
+    def test_names_are_normalized_and_unique(self):
+        self.assertEqual(normalize_tag_name(' Ｌinear\u3000 Algebra '), 'linear algebra')
+        response = self.client.post('/tags/', {'name': '  Math '}, format='json')
+        self.assertEqual(response.data['name'], 'math')
+        response = self.client.post('/tags/', {'name': 'MATH'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        # 嵌套在帖子里时引用已有标签，不算重复
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/posts/', {'title': 't', 'body': 'b', 'tags': [{'name': 'Math'}]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Tag.objects.count(), 1)
+        self.assertEqual(resolve_tag_ids(['ＭＡＴＨ']), [Tag.objects.get().id])
+
+
+@override_settings(IMAGE_PIPELINE={'MODE': 'sync'})
+class ImagePipelineTests(ForumTestCase):
+
+    def test_upload_is_acknowledged_then_rendered(self):
+        self.client.force_authenticate(self.user)
+        post = self.make_post(images=0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/images/', {'post': post.id, 'image': make_upload()}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], Image.PENDING)
+        self.assertEqual(response.data['renditions'], {})
+
+        for callback in callbacks:
+            callback()
+        response = self.client.get(f"/images/{response.data['id']}/")
+        self.assertEqual(response.data['status'], Image.READY)
+        self.assertEqual(set(response.data['renditions']), {'thumbnail', 'medium', 'full'})
+        self.assertTrue(response.data['renditions']['thumbnail']['webp'].endswith('.webp'))
+
+    def test_process_pool_renders_in_child_process(self):
+        image = self.make_post(images=1).image_set.get()
+        pool = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            self.assertTrue(image_pipeline.process_image(image.id, pool=pool))
+        finally:
+            pool.shutdown()
+        image.refresh_from_db()
+        self.assertEqual(image.status, Image.READY)
+        with default_storage.open(image.renditions['medium']['jpeg']) as f:
+            self.assertEqual(PilImage.open(f).format, 'JPEG')
+
+    def test_child_interpreter_under_uwsgi(self):
+        config, python = image_pipeline.get_config(), sys.executable
+        prefix = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, prefix, True)
+        with mock.patch.object(image_pipeline.sys, 'executable', '/usr/local/bin/uwsgi'), \
+                mock.patch.object(image_pipeline.sys, 'prefix', prefix):
+            self.assertIsNone(image_pipeline.python_executable(config))
+            self.assertEqual(image_pipeline.python_executable(dict(config, PYTHON='/srv/env/bin/python')),
+                             '/srv/env/bin/python')
+            os.makedirs(os.path.join(prefix, 'bin'))
+            os.symlink(python, os.path.join(prefix, 'bin', 'python3'))
+            self.assertEqual(image_pipeline.python_executable(config), os.path.join(prefix, 'bin', 'python3'))
+        self.assertEqual(image_pipeline.python_executable(config), python)
+
+    def test_broken_upload_is_marked_failed(self):
+        post = self.make_post(images=0)
+        with self.assertLogs('fuzhuxian.image_pipeline', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(post=post, image=SimpleUploadedFile('x.png', b'not an image'))
+        image.refresh_from_db()
+        self.assertEqual(image.status, Image.FAILED)
+
+    def test_oversized_upload_rejected_before_decoding(self):
+        self.client.force_authenticate(self.user)
+        post = self.make_post(images=0)
+        with override_settings(IMAGE_PIPELINE={'MODE': 'sync', 'MAX_PIXELS': 32}):
+            response = self.client.post('/images/', {'post': post.id, 'image': make_upload()}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertFalse(Image.objects.exists())
+
+    def test_large_jpeg_is_downscaled_early(self):
+        buf = io.BytesIO()
+        PilImage.new('RGB', (4000, 3000), (10, 20, 30)).save(buf, format='JPEG')
+        im = imaging.open_rgb(io.BytesIO(buf.getvalue()), max_size=500)
+        # draft 按 1/4 解码（不小于目标尺寸的最小比例），而不是完整的 4000x3000
+        self.assertEqual(im.size, (1000, 750))
+        outputs = imaging.render(buf.getvalue(), {'small': (200, 70)}, ('jpeg',))
+        self.assertEqual(PilImage.open(io.BytesIO(outputs[('small', 'jpeg')])).size, (200, 150))
+
+
+@override_settings(IMAGE_PIPELINE={'MODE': 'sync'})
+class ImageDeduplicationTests(ForumTestCase):
+
+    def test_same_content_is_stored_once_and_rendered_once(self):
+        post = self.make_post(images=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Image.objects.create(post=post, image=make_upload('a.png'))
+        comment = Comment.objects.create(post=post, body='c', author=self.user)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            second = Image.objects.create(comment=comment, image=make_upload('b.png'))
+        self.assertEqual(callbacks, [])  # 复用已有的处理结果，没有再次入队
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(second.status, Image.READY)
+        self.assertEqual(first.renditions, second.renditions)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(second.image.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(default_storage.exists(second.image.name))
+        self.assertFalse(default_storage.exists(second.renditions['thumbnail']['jpeg']))
+
+    def test_same_bytes_with_different_extensions_share_one_file(self):
+        buf = io.BytesIO()
+        PilImage.new('RGB', (40, 30), (10, 20, 30)).save(buf, format='JPEG')
+        post = self.make_post(images=0)
+        images = [Image.objects.create(post=post, image=SimpleUploadedFile(name, buf.getvalue(), 'image/jpeg'))
+                  for name in ('a.jpg', 'b.jpeg', 'c.JPG')]
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 3)
+        self.assertTrue(blob.name.endswith(f'/{blob.sha256}.jpg'))
+        self.assertEqual({image.image.name for image in images}, {blob.name})
+        blob_dir = os.path.join(default_storage.location, os.path.dirname(blob.name))
+        self.assertEqual(os.listdir(blob_dir), [os.path.basename(blob.name)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for image in images:
+                image.delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.name))
+
+    def test_upload_reuses_blob_stored_under_old_name(self):
+        storage, content = ContentAddressedStorage(), make_upload()
+        digest = content_digest(content)
+        old_name = f'blobs/{digest[:2]}/{digest}.PNG'  # 按上传扩展名命名时存下的文件
+        storage.restore(old_name, content)
+        ImageBlob.objects.create(sha256=digest, name=old_name, size=content.size, ref_count=1)
+        image = Image.objects.create(post=self.make_post(images=0), image=make_upload())
+        self.assertEqual(image.image.name, old_name)
+        self.assertFalse(default_storage.exists(f'blobs/{digest[:2]}/{digest}.png'))
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+
+    def test_upload_between_release_and_file_delete_keeps_file(self):
+        post = self.make_post(images=0)
+        first = Image.objects.create(post=post, image=make_upload())
+        with self.captureOnCommitCallbacks() as callbacks:
+            first.delete()
+        # 删除文件的回调还没执行，同样的内容又被上传
+        second = Image.objects.create(post=post, image=make_upload())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+        self.assertTrue(default_storage.exists(second.image.name))
+
+    def test_acquire_rewrites_file_deleted_after_save(self):
+        storage, content = ContentAddressedStorage(), make_upload()
+        name = storage.save('x.png', content)
+        storage.delete(name)    # 保存时文件还在，拿到引用之前被并发的释放删掉了
+        blob = ImageBlob.acquire(name, content.size, content)
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(storage.exists(name))
+
+    def test_update_keeps_unchanged_images(self):
+        self.client.force_authenticate(self.user)
+        post = self.make_post(images=0)
+        kept = Image.objects.create(post=post, image=make_upload())
+        dropped = Image.objects.create(post=post, image=SimpleUploadedFile('d.png', make_upload().read()[:-1] + b'\0'))
+        buf = io.BytesIO()
+        PilImage.new('RGB', (8, 8), (0, 0, 255)).save(buf, format='PNG')
+        response = self.client.put(f'/posts/{post.id}/', {
+            'title': 't', 'body': 'b', 'tags': 'x',
+            'image0': make_upload('same.png'),
+            'image1': SimpleUploadedFile('new.png', buf.getvalue(), content_type='image/png'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        ids = set(post.image_set.values_list('id', flat=True))
+        self.assertIn(kept.id, ids)
+        self.assertNotIn(dropped.id, ids)
+        self.assertEqual(len(ids), 2)
+
+
+@override_settings(IMAGE_PIPELINE={'MODE': 'sync'})
+class IncrementalUpdateTests(ForumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def test_patch_title_keeps_tags_and_images_and_touches_update_at(self):
+        post = self.make_post(tags=('a', 'b'), images=1)
+        before = post.update_at
+        image_ids = list(post.image_set.values_list('id', flat=True))
+        response = self.client.patch(f'/posts/{post.id}/', {'title': 'new'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        post.refresh_from_db()
+        self.assertEqual(post.title, 'new')
+        self.assertGreater(post.update_at, before)
+        self.assertEqual(sorted(post.tags.values_list('name', flat=True)), ['a', 'b'])
+        self.assertEqual(list(post.image_set.values_list('id', flat=True)), image_ids)
+
+    def test_patch_tags_only_writes_the_difference(self):
+        post = self.make_post(tags=('a', 'b'), images=0)
+        kept = post.tags.through.objects.get(post=post, tag__name='a').id
+        response = self.client.patch(f'/posts/{post.id}/', {'tags': [{'name': 'a'}, {'name': 'c'}]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(t['name'] for t in response.data['tags']), ['a', 'c'])
+        # 没有变化的关联行保持原样，不是清空后重建
+        self.assertTrue(post.tags.through.objects.filter(id=kept).exists())
+
+    def test_unchanged_put_does_not_touch_update_at(self):
+        post = self.make_post(tags=('a',), images=0)
+        before = Post.objects.get(id=post.id).update_at
+        self.client.put(f'/posts/{post.id}/', {'title': post.title, 'body': post.body, 'status': post.status,
+                                              'tags': [{'name': 'a'}]}, format='json')
+        self.assertEqual(Post.objects.get(id=post.id).update_at, before)
+
+    def test_comment_edit_keeps_images_and_patch_can_remove_one(self):
+        post = self.make_post(images=0)
+        comment = Comment.objects.create(post=post, body='c', author=self.user)
+        image = Image.objects.create(comment=comment, image=make_upload())
+        response = self.client.patch(f'/comments/{comment.id}/', {'body': 'edited'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Image.objects.filter(id=image.id).exists())
+        self.client.patch(f'/comments/{comment.id}/', {'remove_images': [image.id]}, format='json')
+        self.assertFalse(Image.objects.filter(id=image.id).exists())
+
+
+@override_settings(IMAGE_PIPELINE={'MODE': 'sync'})
+class ConditionalGetTests(ForumTestCase):
+
+    def get_with_etag(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('ETag', first)
+        return first['ETag']
+
+    def test_unchanged_post_list_returns_304_with_two_queries(self):
+        self.make_post(images=0)
+        etag = self.get_with_etag('/posts/?status=n')
+        # COUNT/MAX + 版本号
+        with self.assertNumQueries(2):
+            response = self.client.get('/posts/?status=n', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_post_list_etag_changes_on_writes(self):
+        post = self.make_post(images=0)
+        etag = self.get_with_etag('/posts/')
+        # 新增图片会刷新帖子的 update_at
+        with self.captureOnCommitCallbacks(execute=True):
+            Image.objects.create(post=post, image=make_upload())
+        self.assertEqual(self.client.get('/posts/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.get_with_etag('/posts/')
+        Post.objects.filter(id=post.id).delete()
+        self.assertEqual(self.client.get('/posts/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_lists_survive_deleting_the_newest_row(self):
+        old = self.make_post(title='old', tags=('a',), images=0)
+        Post.objects.filter(pk=old.pk).update(update_at=old.update_at - timedelta(days=1))
+        newest = self.make_post(title='new', tags=('b',), images=0)
+        self.assertIn('Last-Modified', self.client.get(f'/posts/{old.id}/'))
+        for url, deleted in (('/posts/', newest), ('/tags/', Tag.objects.get(name='b'))):
+            response = self.client.get(url)
+            # 列表不发 Last-Modified：删掉最新的一行后 max(update_at) 会倒退
+            self.assertNotIn('Last-Modified', response)
+            since = http_date(time.time() + 60)
+            deleted.delete()
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=since).status_code, 200, url)
+
+    def test_detail_and_comments_and_tags(self):
+        post = self.make_post(images=0)
+        comment = Comment.objects.create(post=post, body='c', author=self.user)
+        for url in (f'/posts/{post.id}/', f'/posts/{post.id}/comments/', '/tags/'):
+            etag = self.get_with_etag(url)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304, url)
+        etag = self.get_with_etag(f'/posts/{post.id}/comments/')
+        comment.body = 'edited'
+        comment.save()
+        self.assertEqual(self.client.get(f'/posts/{post.id}/comments/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.get_with_etag('/tags/')
+        Tag.objects.filter(name='a').get().save()
+        self.assertEqual(self.client.get('/tags/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(IMAGE_PIPELINE={'MODE': 'sync'})
+class ResponseCacheTests(ForumTestCase):
+
+    def test_list_hit_skips_queries_and_serialization(self):
+        for i in range(3):
+            self.make_post(title=f'p{i}', images=0)
+        self.assertEqual(self.client.get('/posts/?status=n')['X-Cache'], 'MISS')
+        with self.assertNumQueries(2):  # ETag 校验值 + 缓存版本号
+            response = self.client.get('/posts/?status=n')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['count'], 3)
+        # 不同的过滤条件是不同的条目
+        self.assertEqual(self.client.get('/posts/?status=a')['X-Cache'], 'MISS')
+
+    def test_writes_invalidate_feed_and_detail(self):
+        post = self.make_post(tags=('a',), images=0)
+        for url in ('/posts/', f'/posts/{post.id}/'):
+            self.client.get(url)
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        Comment.objects.create(post=post, body='c', author=self.user)
+        self.assertEqual(self.client.get(f'/posts/{post.id}/')['X-Cache'], 'MISS')
+
+        tag = Tag.objects.get(name='a')
+        tag.name = 'renamed'
+        tag.save()
+        response = self.client.get(f'/posts/{post.id}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['tags'][0]['name'], 'renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Image.objects.create(post=post, image=make_upload())
+        response = self.client.get('/posts/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['images'][0]['status'], Image.READY)
+
+    def test_author_rename_invalidates_cache_and_etags(self):
+        post = self.make_post(images=0)
+        bob = CustomUser.objects.create_user(username='bob', number='2021002', password='x')
+        Comment.objects.create(post=post, body='c', author=bob)
+        urls = ('/posts/', f'/posts/{post.id}/', f'/posts/{post.id}/comments/')
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        for user, name in ((self.user, 'alice2'), (bob, 'bob2')):
+            user.username = name
+            user.save()
+        response = self.client.get('/posts/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['author']['username'], 'alice2')
+        for url in urls:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code, 200, url)
+        self.assertEqual(self.client.get(f'/posts/{post.id}/comments/').data[0]['author']['username'], 'bob2')
+
+    def test_stats_endpoint_is_admin_only(self):
+        self.client.get('/posts/')
+        self.client.get('/posts/')
+        self.assertEqual(self.client.get('/cache/stats/').status_code, 401)
+        admin = CustomUser.objects.create_user(username='admin', number='0', password='x', is_staff=True)
+        self.client.force_authenticate(admin)
+        stats = self.client.get('/cache/stats/').data
+        self.assertEqual(stats['list']['hits'], 1)
+        self.assertEqual(stats['list']['misses'], 1)
+
+
+@override_settings(METRICS=dict(settings.METRICS, STORE_PATH=None))
+class RequestMetricsTests(ForumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        instrumentation.reset()
+
+    def test_server_timing_and_log_line(self):
+        self.make_post(images=0)
+        with self.assertLogs('fuzhuxian.metrics', 'INFO') as logs:
+            response = self.client.get('/posts/')
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('render;dur=', timing)
+        self.assertIn('total;dur=', timing)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['endpoint'], 'GET:post-list')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['bytes'], len(response.content))
+        self.assertGreater(record['queries'], 0)
+        self.assertGreaterEqual(record['total_ms'], record['db_ms'])
+
+    def test_image_time_is_recorded(self):
+        self.client.force_authenticate(self.user)
+        with self.assertLogs('fuzhuxian.metrics', 'INFO') as logs:
+            self.client.post('/posts/', {'title': 't', 'body': 'b', 'image': make_upload()})
+        self.assertGreater(json.loads(logs.records[-1].getMessage())['image_ms'], 0)
+
+    @override_settings(METRICS=dict(settings.METRICS, STORE_PATH=None, LOG=False, FLUSH_EVERY=1000))
+    def test_metrics_endpoint_aggregates_per_endpoint(self):
+        post = self.make_post(images=0)
+        for _ in range(3):
+            self.client.get('/posts/')
+        self.client.get(f'/posts/{post.id}/')
+
+        self.assertEqual(self.client.get('/metrics/').status_code, 401)
+        admin = CustomUser.objects.create_user(username='admin', number='0001', password='x', is_staff=True)
+        self.client.force_authenticate(admin)
+        data = self.client.get('/metrics/').data
+        self.assertEqual(data['GET:post-list']['count'], 3)
+        self.assertEqual(data['GET:post-detail']['count'], 1)
+        total = data['GET:post-list']['timings']['total']
+        self.assertEqual(sum(total['buckets'].values()), 3)
+        self.assertIsNotNone(total['p50_ms'])
+
+        self.assertEqual(self.client.delete('/metrics/').status_code, 204)
+        self.assertNotIn('GET:post-list', self.client.get('/metrics/').data)
+
+    def test_sqlite_store_adds_up_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'metrics.sqlite3')
+        # 两个 store 各自连接同一个文件，相当于 uwsgi 的两个进程
+        for count in (2, 3):
+            store = instrumentation.SqliteMetricsStore(path)
+            store.add({('GET:post-list', 'count'): count, ('GET:post-list', 'total:le5'): count})
+        with override_settings(METRICS=dict(settings.METRICS, STORE_PATH=path)):
+            data = instrumentation.snapshot()
+        self.assertEqual(data['GET:post-list']['count'], 5)
+        self.assertEqual(data['GET:post-list']['timings']['total']['buckets']['le5'], 5)
+
+
+class SyntheticDataTests(ForumTestCase):
+
+    def generate(self, **kwargs):
+        options = dict(users=5, posts=40, comments_per_post=2, images_per_post=1, tags=10, image_variants=3)
+        options.update(kwargs)
+        return synthetic.generate(**options)
+
+    def test_generated_data_is_consistent_and_reproducible(self):
+        counts = self.generate()
+        posts = Post.objects.filter(author__username__startswith=synthetic.USERNAME_PREFIX)
+        self.assertEqual(posts.count(), 40)
+        self.assertEqual(set(posts.values_list('status', flat=True)), {'n', 'i', 'a'})
+        self.assertFalse(posts.filter(status='n', comment_count__gt=0).exists())
+        self.assertEqual(counters.reconcile(), [])
+        self.assertFalse(Image.objects.exclude(status=Image.READY).exists())
+        self.assertEqual(ImageBlob.objects.filter(ref_count__gt=0).aggregate(n=Sum('ref_count'))['n'], counts['images'])
+        self.assertTrue(SearchToken.objects.exists())
+        self.assertTrue(self.client.login(username='syn-0', password=synthetic.DEFAULT_PASSWORD))
+
+        titles = list(posts.order_by('id').values_list('title', flat=True))
+        with self.assertRaises(synthetic.DatasetExists):
+            self.generate()
+        synthetic.clear()
+        self.generate()
+        self.assertEqual(list(posts.order_by('id').values_list('title', flat=True)), titles)
+
+    def test_bench_api_writes_json_results(self):
+        self.generate(image_variants=1)
+        output = os.path.join(MEDIA_ROOT, 'bench.json')
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            call_command('bench_api', repeat=3, warmup=1, scenarios='post_list,comment_create,login',
+                         output=output, stdout=io.StringIO())
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual(set(report['results']), {'post_list', 'comment_create', 'login'})
+        self.assertEqual(report['results']['login']['errors'], 0)
+        self.assertEqual(report['results']['comment_create']['n'], 3)
+        self.assertGreater(report['results']['post_list']['queries_per_request'], 0)
+        # 写请求已经回滚
+        self.assertFalse(Comment.objects.filter(body='benchmark').exists())
+
+
+class RequestGuardTests(ForumTestCase):
+
+    def test_bad_host_and_unknown_path_get_tiny_responses(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/', HTTP_HOST='scanner.example')
+        self.assertEqual((response.status_code, response.content), (400, b''))
+        self.assertNotIn('csrftoken', response.cookies)
+
+        for path in ('/admin/jsiNn/', '/wp-login.php', '/phpmyadmin/index.php'):
+            response = self.client.get(path)
+            self.assertEqual((response.status_code, response.content), (404, b''), path)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_known_paths_pass(self):
+        self.assertEqual(self.client.get('/posts/').status_code, 200)
+        self.assertEqual(self.client.get('/posts').status_code, 301)  # APPEND_SLASH 重定向
+        self.assertEqual(self.client.get('/admin/').status_code, 302)
+
+
+class ThrottleTests(ForumTestCase):
+    rates = {
+        'posts': {'ip': (3, 60), 'user': (2, 60)},
+        'login': {'ip': (10, 60), 'number': (2, 60)},
+    }
+
+    def test_post_list_is_throttled_per_ip_and_per_user(self):
+        with override_settings(THROTTLE=dict(settings.THROTTLE, STORE_PATH=None, RATES=self.rates)):
+            statuses = [self.client.get('/posts/').status_code for _ in range(4)]
+            self.assertEqual(statuses, [200, 200, 200, 429])
+            response = self.client.get('/posts/')
+            self.assertGreater(int(response['Retry-After']), 0)
+            # 其它 IP 有自己的桶
+            self.assertEqual(self.client.get('/posts/', REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+            self.client.force_authenticate(self.user)
+            statuses = [self.client.get('/posts/', REMOTE_ADDR=f'10.0.1.{i}').status_code for i in range(3)]
+            self.assertEqual(statuses, [200, 200, 429])
+
+    def test_login_is_throttled_per_number(self):
+        with override_settings(THROTTLE=dict(settings.THROTTLE, STORE_PATH=None, RATES=self.rates)):
+            payload = {'number': '2021001', 'password': 'wrong'}
+            statuses = [self.client.post('/user/custom-token/', payload, REMOTE_ADDR=f'10.0.2.{i}').status_code
+                        for i in range(3)]
+            self.assertEqual(statuses, [401, 401, 429])
+            payload = {'number': '2021002', 'password': 'wrong'}
+            self.assertEqual(self.client.post('/user/custom-token/', payload).status_code, 401)
+
+    def test_sqlite_store_is_shared_between_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'throttle.sqlite3')
+        first, second = throttling.SqliteBucketStore(path), throttling.SqliteBucketStore(path)
+        self.assertEqual(first.take('k', 2, 10, now=100)[0], True)
+        self.assertEqual(second.take('k', 2, 10, now=100)[0], True)
+        allowed, wait = first.take('k', 2, 10, now=100)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 5)
+        self.assertTrue(second.take('k', 2, 10, now=105)[0])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, THROTTLE=dict(settings.THROTTLE, STORE_PATH=None),
+                   METRICS=dict(settings.METRICS, STORE_PATH=None, LOG=False))
+class AsyncReadTests(TransactionTestCase):
+    """异步接口在线程池里用自己的数据库连接查询，测试数据需要真正提交"""
+
+    def setUp(self):
+        caches['default'].clear()
+        throttling.get_store().clear()
+        self.user = CustomUser.objects.create_user(username='alice', number='2021001', password='pass12345')
+        self.post = Post.objects.create(title='async', body='body', author=self.user)
+        self.post.tags.add(Tag.objects.create(name='python'))
+        Comment.objects.create(post=self.post, body='reply', author=self.user)
+
+    async def test_async_endpoints_match_sync_ones(self):
+        client = AsyncClient()
+        for async_path, sync_path in (('/async/posts/', '/posts/'),
+                                      (f'/async/posts/{self.post.id}/', f'/posts/{self.post.id}/'),
+                                      (f'/async/posts/{self.post.id}/comments/', f'/posts/{self.post.id}/comments/'),
+                                      ('/async/posts/?compact=true', '/posts/?compact=true')):
+            response = await client.get(async_path)
+            self.assertEqual(response.status_code, 200, async_path)
+            self.assertIn('db;dur=', response['Server-Timing'])
+            expected = await sync_to_async(self.client.get)(sync_path)
+            self.assertEqual(response.json(), expected.json(), async_path)
+
+        response = await client.post('/async/similar_posts/', {'tags': ['python']}, content_type='application/json')
+        self.assertEqual([post['id'] for post in response.json()], [self.post.id])
+        self.assertEqual((await client.get('/async/posts/999/')).status_code, 404)
+
+    async def test_async_endpoints_are_throttled(self):
+        rates = {'posts': {'ip': (1, 60)}}
+        with override_settings(THROTTLE=dict(settings.THROTTLE, STORE_PATH=None, RATES=rates)):
+            client = AsyncClient()
+            self.assertEqual((await client.get('/async/posts/')).status_code, 200)
+            self.assertEqual((await client.get('/async/posts/')).status_code, 429)
+
+
+
+def parse_events(chunk):
+    """SSE 字节流里带 event 的消息，返回 [(id, event, data)]"""
+    messages = []
+    for block in chunk.decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line and not line.startswith(':'))
+        if 'event' in fields:
+            messages.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return messages
+
+
+class EventHubTests(ForumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        events.get_hub().clear()
+
+    def test_writes_publish_events_after_commit(self):
+        post = self.make_post(images=0)
+        self.client.force_authenticate(self.user)
+        hub = events.get_hub()
+        start = hub.latest
+        with self.captureOnCommitCallbacks(execute=True):
+            comment_id = self.client.post('/comments/', {'post': post.id, 'body': 'first'}, format='json').data['id']
+            self.client.patch(f'/posts/{post.id}/', {'status': 'a'}, format='json')
+        feed, latest = hub.replay([events.FEED], start)
+        self.assertEqual([event.kind for event in feed],
+                         ['comment.created', 'post.status', 'post.updated', 'post.status'])
+        self.assertEqual(json.loads(feed[0].data)['id'], comment_id)
+        self.assertEqual([json.loads(event.data)['status'] for event in feed if event.kind == 'post.status'], ['i', 'a'])
+        other = self.make_post(title='other', images=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/comments/', [{'post': other.id, 'body': 'batch'}], format='json')
+        self.assertEqual([event.kind for event in hub.replay([events.post_channel(post.id)], start)[0]],
+                         [event.kind for event in feed])
+        self.assertEqual([event.kind for event in hub.replay([events.post_channel(other.id)], latest)[0]],
+                         ['comment.created', 'post.status'])
+
+    def test_batch_emits_status_only_for_posts_it_started(self):
+        post = self.make_post(images=0)
+        serializer = CommentSerializer(data=[{'post': post.id, 'body': 'batch'}], many=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        # 校验之后、写入之前，另一个请求已经把帖子改成了 i
+        Post.objects.filter(pk=post.pk).update(status='i')
+        hub = events.get_hub()
+        start = hub.latest
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save(author=self.user)
+        self.assertEqual([event.kind for event in hub.replay([events.FEED], start)[0]], ['comment.created'])
+
+    def test_full_save_emits_status_only_when_it_changes(self):
+        post = self.make_post(images=0)
+        hub = events.get_hub()
+        start = hub.latest
+        with self.captureOnCommitCallbacks(execute=True):
+            post.title = 'renamed'
+            post.save()     # Post.save 整行保存时 update_fields 里总有 status
+        self.assertEqual([event.kind for event in hub.replay([events.FEED], start)[0]], ['post.updated'])
+        start = hub.latest
+        with self.captureOnCommitCallbacks(execute=True):
+            post.status = 'a'
+            post.save()
+        self.assertEqual([event.kind for event in hub.replay([events.FEED], start)[0]],
+                         ['post.updated', 'post.status'])
+
+    def test_replay_reports_lost_history(self):
+        hub = events.MemoryHub(dict(events.get_config(), HISTORY=2))
+        for i in range(4):
+            hub.publish([events.FEED], 'post.deleted', str(i))
+        self.assertEqual([event.id for event in hub.replay([events.FEED], 2)[0]], [3, 4])
+        self.assertEqual(hub.replay([events.FEED], 1), (None, 4))   # 第 2 个事件已经不在历史里
+        self.assertEqual(hub.replay([events.FEED], 9), (None, 4))   # 服务重启后编号重新开始
+        self.assertEqual(hub.replay([events.FEED], None), ([], 4))
+
+    def test_sqlite_hub_is_shared_between_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        config = dict(events.get_config(), STORE_PATH=os.path.join(directory, 'events.sqlite3'))
+        writer, reader = events.SqliteHub(config), events.SqliteHub(config)
+        self.addCleanup(reader.close)
+        first = writer.publish([events.FEED, events.post_channel(1)], 'post.created', '{}')
+        writer.publish([events.FEED, events.post_channel(2)], 'post.created', '{}')
+        backlog, latest = reader.replay([events.post_channel(2)], first.id - 1)
+        self.assertEqual(([event.id for event in backlog], latest), ([first.id + 1], first.id + 1))
+
+        async def live():
+            subscription, _, _ = reader.subscribe([events.FEED])
+            await sync_to_async(writer.publish)([events.FEED], 'post.deleted', '{}')
+            await sync_to_async(reader.poll)()
+            pending = await subscription.get(1)
+            reader.unsubscribe(subscription)
+            return [event.kind for event in pending]
+        self.assertEqual(asyncio.run(live()), ['post.deleted'])
+
+
+@override_settings(EVENTS=dict(settings.EVENTS, STORE_PATH=None, HEARTBEAT=0.05),
+                   METRICS=dict(settings.METRICS, STORE_PATH=None, LOG=False))
+class EventStreamTests(TransactionTestCase):
+    """连接在线程池里查帖子是否存在，测试数据需要真正提交"""
+
+    def setUp(self):
+        events.get_hub().clear()
+        self.user = CustomUser.objects.create_user(username='alice', number='2021001', password='pass12345')
+        self.post = Post.objects.create(title='live', body='body', author=self.user)
+
+    async def test_stream_delivers_new_comments(self):
+        response = await AsyncClient().get(f'/posts/{self.post.id}/events/')
+        self.assertIsInstance(response, EventStreamResponse)
+        self.assertEqual(response['Content-Type'], 'text/event-stream; charset=utf-8')
+        stream = response.stream()
+        head = await stream.__anext__()
+        self.assertIn(b'retry: 3000', head)
+        self.assertIn(f'id: {events.get_hub().latest}'.encode(), head)
+        self.assertEqual(await stream.__anext__(), b': ping\n\n')
+
+        comment = await sync_to_async(Comment.objects.create)(post=self.post, body='hello', author=self.user)
+        received = []
+        while len(received) < 1:
+            received += parse_events(await asyncio.wait_for(stream.__anext__(), 1))
+        self.assertEqual(received[0][1:], ('comment.created', {
+            'id': comment.id, 'post': self.post.id, 'body': 'hello', 'author': self.user.id,
+            'created_at': received[0][2]['created_at']}))
+        await stream.aclose()
+        self.assertEqual(events.get_hub().connections(), 0)
+        self.assertEqual((await AsyncClient().get('/posts/999/events/')).status_code, 404)
+
+    async def test_resume_and_slow_connection(self):
+        hub = events.get_hub()
+        with override_settings(EVENTS=dict(settings.EVENTS, STORE_PATH=None, BUFFER=2)):
+            response = await AsyncClient().get(f'/events/?last_event_id={hub.latest}')
+            stream = response.stream()
+            await stream.__anext__()
+            for i in range(5):
+                hub.publish([events.FEED], 'post.deleted', str(i))
+            delivered = []
+            async for chunk in stream:
+                delivered += parse_events(chunk)
+        # 积压超过 BUFFER 后连接结束，客户端按最后收到的编号重连，补齐剩下的事件
+        self.assertEqual([data for _, _, data in delivered], [0, 1])
+        response = await AsyncClient().get(f'/events/?last_event_id={delivered[-1][0]}')
+        stream = response.stream()
+        self.assertEqual([data for _, _, data in parse_events(await stream.__anext__())], [2, 3, 4])
+        await stream.aclose()
+
+        response = await AsyncClient().get(f'/events/?last_event_id={hub.latest + 100}')
+        stream = response.stream()
+        self.assertEqual([kind for _, kind, _ in parse_events(await stream.__anext__())], ['reset'])
+        await stream.aclose()
+
+    def test_wsgi_returns_backlog_and_ends(self):
+        start = events.get_hub().latest
+        Comment.objects.create(post=self.post, body='hello', author=self.user)
+        response = self.client.get('/events/', HTTP_LAST_EVENT_ID=str(start))
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        self.assertIn(b'retry: 15000', content)
+        self.assertEqual([kind for _, kind, _ in parse_events(content)], ['comment.created'])
+        self.assertEqual(self.client.post('/events/').status_code, 405)
+        # WSGI 下的轮询不查数据库
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/posts/{self.post.id}/events/')
+            self.assertEqual(parse_events(b''.join(response.streaming_content)), [])
+
+    def test_asgi_handler_stops_on_disconnect(self):
+        sent = []
+
+        async def run():
+            received = asyncio.Event()
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                await received.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if message.get('body'):
+                    received.set()
+
+            scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                     'scheme': 'http', 'path': '/events/', 'raw_path': b'/events/', 'query_string': b'',
+                     'root_path': '', 'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0),
+                     'server': ('localhost', 80)}
+            await asyncio.wait_for(EventStreamASGIHandler()(scope, receive, send), 5)
+
+        with override_settings(ALLOWED_HOSTS=['localhost']):
+            asyncio.run(run())
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'Content-Type', b'text/event-stream; charset=utf-8'), sent[0]['headers'])
+        self.assertIn(b'retry: 3000', sent[1]['body'])
+        self.assertEqual(events.get_hub().connections(), 0)
+
+
+class NumberLoginTests(ForumTestCase):
+
+    def test_login_by_number_uses_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.post('/user/custom-token/', {'number': '2021001', 'password': 'pass12345'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {'refresh', 'access'})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        self.assertEqual(self.client.get('/users/').data['results'][0]['number'], '2021001')
+
+    def test_bad_credentials(self):
+        for payload in ({'number': '2021001', 'password': 'wrong'}, {'number': 'nobody', 'password': 'pass12345'}, {}):
+            response = self.client.post('/user/custom-token/', payload, format='json')
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response.data, {'error': 'Invalid number or password'})
+
+    def test_username_login_still_works(self):
+        response = self.client.post('/user/token/', {'username': 'alice', 'password': 'pass12345'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+
+class ClaimsAuthenticationTests(ForumTestCase):
+
+    def login(self):
+        response = self.client.post('/user/custom-token/', {'number': '2021001', 'password': 'pass12345'}, format='json')
+        return response.data
+
+    def test_authenticated_reads_do_not_query_users(self):
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        revocations.is_revoked(self.user.pk, 0)  # 预先载入吊销列表
+        with self.assertNumQueries(2):  # COUNT + 当前用户这一行，没有认证查询
+            response = self.client.get('/users/')
+        self.assertEqual(response.data['results'][0]['id'], self.user.pk)
+
+    def test_writes_use_claims_user_as_author(self):
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        response = self.client.post('/posts/', {'title': 't', 'body': 'b', 'tags': []}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Post.objects.get().author_id, self.user.pk)
+        self.assertEqual(response.data['author']['number'], '2021001')
+
+    def test_password_change_revokes_access_and_refresh(self):
+        tokens = self.login()
+        self.user.set_password('another-pass')
+        self.user.save()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        self.assertEqual(self.client.get('/posts/').status_code, 401)
+        self.client.credentials()
+        response = self.client.post('/user/token/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_tokens_without_claims_are_cached_per_process(self):
+        access = AccessToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        revocations.is_revoked(self.user.pk, 0)
+        with self.assertNumQueries(3):  # 认证查库 + COUNT + 当前用户
+            self.client.get('/users/')
+        with self.assertNumQueries(2):
+            self.client.get('/users/')
+
+
+class PasswordHashingTests(ForumTestCase):
+
+    def login(self):
+        return self.client.post('/user/custom-token/', {'number': '2021001', 'password': 'pass12345'}, format='json')
+
+    def test_new_passwords_use_scrypt(self):
+        self.assertTrue(self.user.password.startswith('scrypt$16384$'))
+        self.assertTrue(self.user.check_password('pass12345'))
+        self.assertFalse(self.user.check_password('wrong'))
+
+    def test_legacy_hash_is_upgraded_on_login_without_revoking_tokens(self):
+        # 模拟升级前用 PBKDF2 保存的密码（直接改库，不经过 signals）
+        CustomUser.objects.filter(pk=self.user.pk).update(password=make_password('pass12345', hasher='pbkdf2_sha256'))
+        tokens = self.login().data
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('scrypt$'))
+        # 升级哈希不是修改密码，刚签发的 token 依然有效
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        self.assertEqual(self.client.get('/posts/').status_code, 200)
+
+    def test_changed_cost_is_applied_on_next_login(self):
+        with override_settings(PASSWORD_HASHING={'SCRYPT_N': 2 ** 10}):
+            self.assertEqual(self.login().status_code, 200)
+            self.user.refresh_from_db()
+            self.assertTrue(self.user.password.startswith('scrypt$1024$'))
+            with self.assertNumQueries(1):  # 参数一致时不再重新计算
+                self.login()
@@ -0,0 +1,176 @@
+"""
+令牌桶限流（DRF throttle_classes）。
+
+每个桶容量为 capacity，每 period 秒补满 capacity 个令牌：允许短时间突发 capacity 个请求，
+长期平均不超过 capacity / period。桶用完时返回 429，Retry-After 为下一个令牌到达的秒数。
+
+桶的状态放在本机的 SQLite 文件里（STORE_PATH），uwsgi 的多个进程共用同一组桶，
+每次取令牌是一个 BEGIN IMMEDIATE 短事务。STORE_PATH 为 None 时放在进程内存里（测试/单进程）。
+存储出错时放行请求，只记日志：限流不能成为接口不可用的原因。
+
+配置 settings.THROTTLE：
+    ENABLED     默认 True
+    STORE_PATH  SQLite 文件路径，默认系统临时目录下的 forum_backend-throttle.sqlite3
+    RATES       {scope: {'ip' / 'user' / 'number': (capacity, period 秒)}}，没有配置的维度不限流
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+# 空闲超过这么久的桶肯定已经补满，可以删掉
+IDLE_SECONDS = 3600
+PRUNE_EVERY = 1000
+
+
+def get_config():
+    config = {
+        'ENABLED': True,
+        'STORE_PATH': os.path.join(tempfile.gettempdir(), 'forum_backend-throttle.sqlite3'),
+        'RATES': {},
+    }
+    config.update(getattr(settings, 'THROTTLE', {}))
+    return config
+
+
+def refill(tokens, updated, now, capacity, period):
+    """返回 (是否放行, 剩余令牌, 需要等待的秒数)"""
+    rate = capacity / period
+    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / rate
+
+
+class MemoryBucketStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def take(self, key, capacity, period, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            allowed, tokens, wait = refill(tokens, updated, now, capacity, period)
+            self.buckets[key] = (tokens, now)
+        return allowed, wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class SqliteBucketStore:
+    """同一台机器上的多个进程共用的桶；每个线程一个连接"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.takes = 0
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # 限流状态丢了无所谓，不需要每次落盘
+            conn.execute('CREATE TABLE IF NOT EXISTS bucket '
+                         '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID')
+            self.local.conn = conn
+        return conn
+
+    def take(self, key, capacity, period, now=None):
+        now = time.time() if now is None else now
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row is not None else (capacity, now)
+            allowed, tokens, wait = refill(tokens, updated, now, capacity, period)
+            conn.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+            self.takes += 1
+            if self.takes % PRUNE_EVERY == 0:
+                conn.execute('DELETE FROM bucket WHERE updated < ?', (now - IDLE_SECONDS,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, wait
+
+    def clear(self):
+        self.connection().execute('DELETE FROM bucket')
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    path = get_config()['STORE_PATH']
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = SqliteBucketStore(path) if path else MemoryBucketStore()
+        return _stores[path]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    子类给出 kind（'ip' / 'user' / 'number'）和 get_key()；视图上设置 throttle_scope。
+    get_key() 返回 None 表示这个请求不按该维度限流。
+    """
+    kind = None
+
+    def get_key(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        config = get_config()
+        scope = getattr(view, 'throttle_scope', None)
+        rate = config['RATES'].get(scope, {}).get(self.kind)
+        if not config['ENABLED'] or rate is None:
+            return True
+        key = self.get_key(request, view)
+        if key is None:
+            return True
+        capacity, period = rate
+        try:
+            allowed, self.retry_after = get_store().take(f'{scope}:{self.kind}:{key}', capacity, period)
+        except sqlite3.Error:
+            logger.warning('throttle store unavailable, request allowed', exc_info=True)
+            return True
+        return allowed
+
+    def wait(self):
+        return getattr(self, 'retry_after', None)
+
+
+class IPThrottle(TokenBucketThrottle):
+    kind = 'ip'
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+
+class UserThrottle(TokenBucketThrottle):
+    """只限制已登录用户；匿名请求由 IPThrottle 负责"""
+    kind = 'user'
+
+    def get_key(self, request, view):
+        user = request.user
+        return user.pk if user and user.is_authenticated else None
+
+
+class LoginNumberThrottle(TokenBucketThrottle):
+    """登录接口按尝试的学号（或用户名）限流，同一账号换 IP 也会被限制"""
+    kind = 'number'
+
+    def get_key(self, request, view):
+        number = request.data.get('number') or request.data.get('username')
+        return str(number)[:64] if number else None
@@ -0,0 +1,345 @@
+"""
+论坛数据的批量导入/导出（JSON Lines，每行一条记录）。
+
+    {"type": "post", "id": 1, "author": {"number": ..., "username": ...}, "title": ..., "body": ...,
+     "status": "n", "created_at": ..., "update_at": ..., "tags": ["a", "b"], "images": [...]}
+    {"type": "comment", "id": 5, "post": 1, "author": {...}, "body": ..., "created_at": ..., "update_at": ...,
+     "images": [...]}
+
+images 里是 {"id", "image"（存储路径）, "status", "renditions"}，只导出文件引用，
+媒体文件（MEDIA_ROOT/blobs）需要另外复制。先导出全部帖子再导出评论，导入时评论引用的帖子已经存在。
+
+两个方向都按主键分块处理，内存占用与数据总量无关：
+- 导出按 id 递增分块读取（预取标签、图片、作者），每块写完记一次检查点；
+- 导入每块在一个事务里用 bulk_create 写入，保留原来的主键，提交后记检查点。
+  已存在的主键会被跳过，所以重复导入同一个文件是安全的。
+
+检查点是输出/输入文件旁边的 <文件名>.checkpoint，记录已经处理到的字节位置，
+中断后带上 resume 重新运行会从该位置继续。
+"""
+import json
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+
+from . import counters, response_cache, search, similarity
+from .models import Comment, CustomUser, Image, ImageBlob, Post, normalize_tag_name
+from .storage import digest_from_name
+from .tagging import normalize_names, resolve_tag_ids
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class TransferError(Exception):
+    pass
+
+
+def checkpoint_path(path):
+    return path + '.checkpoint'
+
+
+def read_checkpoint(path):
+    try:
+        with open(checkpoint_path(path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path, state):
+    # 先写临时文件再改名，中断时不会留下半个检查点
+    tmp = checkpoint_path(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, checkpoint_path(path))
+
+
+def clear_checkpoint(path):
+    try:
+        os.remove(checkpoint_path(path))
+    except FileNotFoundError:
+        pass
+
+
+class Progress:
+    """累计各类记录的行数，按 rows/sec 报告吞吐量"""
+
+    def __init__(self, report=None):
+        self.counts = Counter()
+        self.report = report
+        self.started = time.perf_counter()
+
+    @property
+    def rows(self):
+        return sum(value for key, value in self.counts.items() if not key.startswith('skipped'))
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.rows / elapsed if elapsed else 0.0
+
+    def chunk_done(self):
+        if self.report is not None:
+            self.report(self)
+
+    def summary(self):
+        parts = ', '.join(f'{key}={value}' for key, value in sorted(self.counts.items()))
+        return f'{self.rows} rows in {time.perf_counter() - self.started:.1f}s ({self.rate():.0f} rows/s): {parts}'
+
+
+# ---- 导出 ----
+
+def _author(user):
+    return {'number': user.number, 'username': user.username}
+
+
+def _images(images):
+    return [
+        {'id': image.pk, 'image': image.image.name, 'status': image.status, 'renditions': image.renditions}
+        for image in images
+    ]
+
+
+def post_record(post):
+    return {
+        'type': 'post',
+        'id': post.pk,
+        'author': _author(post.author),
+        'title': post.title,
+        'body': post.body,
+        'status': post.status,
+        'created_at': post.created_at.isoformat(),
+        'update_at': post.update_at.isoformat(),
+        'tags': [tag.name for tag in post.tags.all()],
+        'images': _images(post.image_set.all()),
+    }
+
+
+def comment_record(comment):
+    return {
+        'type': 'comment',
+        'id': comment.pk,
+        'post': comment.post_id,
+        'author': _author(comment.author),
+        'body': comment.body,
+        'created_at': comment.created_at.isoformat(),
+        'update_at': comment.update_at.isoformat(),
+        'images': _images(comment.image_set.all()),
+    }
+
+
+EXPORT_STEPS = (
+    ('post', lambda: Post.objects.with_related(), post_record),
+    ('comment', lambda: Comment.objects.with_related(), comment_record),
+)
+
+
+def export_records(path, chunk_size=DEFAULT_CHUNK_SIZE, resume=False, progress=None):
+    """把帖子和评论写到 path；resume 时从检查点记录的位置继续"""
+    progress = progress or Progress()
+    state = read_checkpoint(path) if resume else None
+    if state is None:
+        state = {'offset': 0, 'type': EXPORT_STEPS[0][0], 'last_id': 0}
+        open(path, 'wb').close()
+
+    with open(path, 'r+b') as out:
+        # 检查点之后写了一半的内容丢掉重写
+        out.seek(state['offset'])
+        out.truncate()
+        types = [name for name, _, _ in EXPORT_STEPS]
+        for name, queryset, to_record in EXPORT_STEPS[types.index(state['type']):]:
+            last_id = state['last_id'] if name == state['type'] else 0
+            while True:
+                chunk = list(queryset().filter(pk__gt=last_id).order_by('pk')[:chunk_size])
+                if not chunk:
+                    break
+                for obj in chunk:
+                    out.write(json.dumps(to_record(obj), ensure_ascii=False).encode() + b'\n')
+                last_id = chunk[-1].pk
+                progress.counts[name + 's'] += len(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+                write_checkpoint(path, {'offset': out.tell(), 'type': name, 'last_id': last_id})
+                progress.chunk_done()
+    clear_checkpoint(path)
+    return progress
+
+
+# ---- 导入 ----
+
+@contextmanager
+def preserve_timestamps(*models):
+    """bulk_create 时保留记录里的 created_at / update_at，不让 auto_now(_add) 改成当前时间"""
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _resolve_authors(records):
+    """按学号找到作者，不存在的用户以不可用的密码创建（需要重置密码后才能登录）"""
+    authors = {record['author']['number']: record['author'] for record in records}
+    found = dict(CustomUser.objects.filter(number__in=authors).values_list('number', 'id'))
+    missing = [author for number, author in authors.items() if number not in found]
+    if missing:
+        password = make_password(None)
+        CustomUser.objects.bulk_create(
+            [CustomUser(username=author.get('username') or author['number'], number=author['number'], password=password)
+             for author in missing],
+            ignore_conflicts=True,
+        )
+        found.update(CustomUser.objects.filter(number__in=[a['number'] for a in missing]).values_list('number', 'id'))
+        unresolved = [author['number'] for author in missing if author['number'] not in found]
+        if unresolved:
+            raise TransferError(f'无法创建用户（用户名已被其他学号占用？）：{unresolved}')
+    return found
+
+
+def _new_records(records, model):
+    """同一块里重复的 id 只保留最后一条，已经存在的 id 跳过"""
+    by_id = {record['id']: record for record in records}
+    existing = set(model.objects.filter(pk__in=by_id).values_list('pk', flat=True))
+    new = [record for record_id, record in by_id.items() if record_id not in existing]
+    return new, len(records) - len(new)
+
+
+def _import_images(owned, progress):
+    """owned: [(image 记录, {'post_id': ...} 或 {'comment_id': ...})]；返回涉及的帖子 id"""
+    by_id = {image['id']: (image, owner) for image, owner in owned}
+    existing = set(Image.objects.filter(pk__in=by_id).values_list('pk', flat=True))
+    new = [(image, owner) for image_id, (image, owner) in by_id.items() if image_id not in existing]
+    progress.counts['skipped_images'] += len(owned) - len(new)
+    if not new:
+        return set()
+
+    refs = Counter(digest_from_name(image['image']) for image, _ in new)
+    refs.pop(None, None)  # 内容寻址之前的旧路径没有 blob
+    names = {digest_from_name(image['image']): image['image'] for image, _ in new}
+    names.pop(None, None)
+    blobs = {}
+    for digest, blob_id, name in ImageBlob.objects.filter(sha256__in=refs).values_list('sha256', 'id', 'name'):
+        blobs[digest], names[digest] = blob_id, name
+    missing = [digest for digest in refs if digest not in blobs]
+    if missing:
+        ImageBlob.objects.bulk_create(
+            [ImageBlob(sha256=digest, name=names[digest], ref_count=0) for digest in missing], ignore_conflicts=True)
+        for digest, blob_id, name in ImageBlob.objects.filter(sha256__in=missing).values_list('sha256', 'id', 'name'):
+            blobs[digest], names[digest] = blob_id, name
+    by_count = {}
+    for digest, count in refs.items():
+        by_count.setdefault(count, []).append(blobs[digest])
+    for count, blob_ids in by_count.items():
+        ImageBlob.objects.filter(pk__in=blob_ids).update(ref_count=F('ref_count') + count)
+
+    Image.objects.bulk_create([
+        # 已有同一内容的 blob 时引用它的文件名（可能与导出时的扩展名不同）
+        Image(pk=image['id'], image=names.get(digest_from_name(image['image']), image['image']),
+              blob_id=blobs.get(digest_from_name(image['image'])),
+              status=image.get('status', Image.READY), renditions=image.get('renditions') or {}, **owner)
+        for image, owner in new
+    ], batch_size=1000)
+    progress.counts['images'] += len(new)
+
+    post_ids = {owner['post_id'] for _, owner in new if 'post_id' in owner}
+    comment_ids = [owner['comment_id'] for _, owner in new if 'comment_id' in owner]
+    post_ids.update(Comment.objects.filter(pk__in=comment_ids).values_list('post_id', flat=True))
+    return post_ids
+
+
+def import_chunk(records, progress, reindex=True):
+    posts = [record for record in records if record.get('type') == 'post']
+    comments = [record for record in records if record.get('type') == 'comment']
+    progress.counts['skipped_unknown'] += len(records) - len(posts) - len(comments)
+    authors = _resolve_authors(posts + comments)
+    images = []
+    affected = set()
+
+    posts, skipped = _new_records(posts, Post)
+    progress.counts['skipped_posts'] += skipped
+    if posts:
+        Post.objects.bulk_create([
+            Post(pk=record['id'], author_id=authors[record['author']['number']], title=record['title'],
+                 body=record['body'], status=record.get('status', 'n'),
+                 created_at=parse_datetime(record['created_at']), update_at=parse_datetime(record['update_at']),
+                 last_activity_at=parse_datetime(record['created_at']))
+            for record in posts
+        ], batch_size=1000)
+        # resolve_tag_ids 会规范化并去重，按规范化后的名字对应 id（'Foo' 和 'foo' 是同一个标签）
+        names = normalize_names([name for record in posts for name in record.get('tags', [])])
+        tag_ids = dict(zip(names, resolve_tag_ids(names))) if names else {}
+        Post.tags.through.objects.bulk_create([
+            Post.tags.through(post_id=record['id'], tag_id=tag_ids[name])
+            for record in posts for name in {normalize_tag_name(name) for name in record.get('tags', [])}
+            if name in tag_ids
+        ], batch_size=1000, ignore_conflicts=True)
+        images.extend((image, {'post_id': record['id']}) for record in posts for image in record.get('images', []))
+        affected.update(record['id'] for record in posts)
+        if reindex:
+            similarity.reindex_posts([record['id'] for record in posts])
+        progress.counts['posts'] += len(posts)
+
+    comments, skipped = _new_records(comments, Comment)
+    progress.counts['skipped_comments'] += skipped
+    if comments:
+        known_posts = set(Post.objects.filter(pk__in={record['post'] for record in comments}).values_list('pk', flat=True))
+        orphans = [record for record in comments if record['post'] not in known_posts]
+        progress.counts['skipped_orphan_comments'] += len(orphans)
+        comments = [record for record in comments if record['post'] in known_posts]
+        Comment.objects.bulk_create([
+            Comment(pk=record['id'], post_id=record['post'], author_id=authors[record['author']['number']],
+                    body=record['body'], created_at=parse_datetime(record['created_at']),
+                    update_at=parse_datetime(record['update_at']))
+            for record in comments
+        ], batch_size=1000)
+        images.extend((image, {'comment_id': record['id']}) for record in comments for image in record.get('images', []))
+        affected.update(record['post'] for record in comments)
+        progress.counts['comments'] += len(comments)
+
+    affected.update(_import_images(images, progress))
+    if affected:
+        # bulk_create 不发送信号：冗余计数、检索索引和响应缓存在这里统一更新
+        counters.reconcile(affected, touch=False)
+        if reindex:
+            search.reindex_posts(affected)
+        response_cache.bump_posts(affected)
+
+
+def import_records(path, chunk_size=DEFAULT_CHUNK_SIZE, resume=False, progress=None, reindex=True):
+    """
+    从 path 导入；resume 时从检查点记录的位置继续。
+    reindex=False 时不维护检索和相似帖子索引（帖子会随后续的评论块重复重建），
+    大批量导入后用 rebuild_search_index / rebuild_tag_index 一次性重建更快。
+    """
+    progress = progress or Progress()
+    state = read_checkpoint(path) if resume else None
+    offset = state['offset'] if state else 0
+
+    with open(path, 'rb') as f, preserve_timestamps(Post, Comment):
+        f.seek(offset)
+        while True:
+            records = []
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+                if len(records) >= chunk_size:
+                    break
+            if not records:
+                break
+            with transaction.atomic():
+                import_chunk(records, progress, reindex)
+            write_checkpoint(path, {'offset': f.tell()})
+            progress.chunk_done()
+    clear_checkpoint(path)
+    return progress
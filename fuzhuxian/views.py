@@ -1,14 +1,24 @@
 from .models import Tag, Post, Comment, Image ,CustomUser
-from .serializers import  PostSerializer, TagSerializer, CommentSerializer, CustomUserSerializer, ImageSerializer
+from .serializers import  PostSerializer, TagSerializer, CommentSerializer, CustomUserSerializer, ImageSerializer, SearchResultSerializer, PostCompactSerializer, issue_tokens
 from rest_framework import viewsets,status
-from rest_framework.permissions import IsAuthenticatedOrReadOnly,AllowAny
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticatedOrReadOnly,AllowAny,IsAdminUser
 from rest_framework.views import APIView
-from rest_framework.test import APIRequestFactory
-from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework import status
-from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework.exceptions import ValidationError
+from django.contrib.auth import authenticate, get_user_model
+from rest_framework_simplejwt.views import TokenObtainPairView
+from .batch import BatchCreateMixin
+from .pagination import OptionalCursorPaginationMixin
+from .conditional import ConditionalGetMixin
+from .fieldsets import requested_fields
+from .response_cache import CachedResponseMixin
+from .throttling import IPThrottle, LoginNumberThrottle, UserThrottle
+from . import instrumentation
+from . import response_cache
+from . import search
+from . import similarity
+from .image_pipeline import validate_upload
+from .tagging import normalize_names
 
 
 class CustomUserViewSet(viewsets.ModelViewSet):
@@ -38,75 +48,66 @@ class CustomUserViewSet(viewsets.ModelViewSet):
         return super(CustomUserViewSet, self).get_permissions()
 
     def get_queryset(self):
-        # 尝试通过JWT认证获取请求用户
-        user = None
-        try:
-            user = JWTAuthentication().authenticate(self.request)
-        except ValidationError:
-            # 如果token无效，可以处理异常或简单地忽略，
-            # 因为下面的代码在`user`为None时会返回所有用户数据
-            pass
-
-        if user is not None:
+        # DRF 已经完成了认证，直接使用 request.user，不再重复解析 JWT
+        if self.request.user.is_authenticated:
             # 已经认证，返回该用户数据
-            return CustomUser.objects.filter(id=user[0].id)
-        else:
-            # 未认证，返回所有用户信息
-            return CustomUser.objects.all()
+            return CustomUser.objects.filter(id=self.request.user.pk)
+        # 未认证，返回所有用户信息
+        return CustomUser.objects.all()
 
 
 User = get_user_model()
 
+LOGIN_THROTTLES = [IPThrottle, LoginNumberThrottle]
+
+
 class CustomTokenObtainView(APIView):
     permission_classes = [AllowAny]
+    authentication_classes = []  # 登录接口不需要先解析调用方的 JWT
+    throttle_classes = LOGIN_THROTTLES
+    throttle_scope = 'login'
     def post(self, request, *args, **kwargs):
         number = request.data.get('number', None)
         password = request.data.get('password', None)
 
-        try:
-            # 根据学号查找对应的用户
-            user = User.objects.get(number=number)
-        except User.DoesNotExist:
+        # 直接按学号认证并签发 token，不再构造内部请求转发给 TokenObtainPairView
+        user = authenticate(request, number=number, password=password)
+        if user is None:
             return Response({'error': 'Invalid number or password'}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response(issue_tokens(user), status=status.HTTP_200_OK)
 
-        # 使用RequestFactory模拟一个请求到/token/接口
-        factory = APIRequestFactory()
-        token_request = factory.post('/user/token/', {
-            'username': user.username,  # 使用找到的用户名
-            'password': password
-        }, format='json')
 
-        # 创建一个TokenObtainPairView实例并调用它的post方法
-        view = TokenObtainPairView.as_view()
-        token_response = view(token_request)
+class LoginTokenObtainPairView(TokenObtainPairView):
+    """按用户名登录（/user/token/），与学号登录共用限流规则"""
+    throttle_classes = LOGIN_THROTTLES
+    throttle_scope = 'login'
 
-        # 从TokenObtainPairView的响应中提取token数据
-        if token_response.status_code == status.HTTP_200_OK:
-            return Response(token_response.data, status=status.HTTP_200_OK)
 
-        return Response({'error': 'Invalid number or password'}, status=token_response.status_code)
-
-
-class TagViewSet(viewsets.ModelViewSet):
-    queryset = Tag.objects.all()
+class TagViewSet(BatchCreateMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Tag.objects.order_by('id')  # 分页需要稳定的顺序
     serializer_class = TagSerializer
     permission_classes = [AllowAny]
 
-class PostViewSet(viewsets.ModelViewSet):
+class PostViewSet(ConditionalGetMixin, CachedResponseMixin, OptionalCursorPaginationMixin, viewsets.ModelViewSet):
     queryset = Post.objects.all().order_by('-created_at',)  # 假设'created'是存储创建时间的字段
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    throttle_classes = [IPThrottle, UserThrottle]
+    throttle_scope = 'posts'
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def validator_versions(self):
+        # 帖子的表示里有作者的用户名，改名不会刷新 update_at，只会给版本号加一
+        return self.current_versions()
 
     def get_queryset(self):
         """
         Optionally restricts the returned posts to a given user,
         by adding a `my_posts` query parameter to the URL.
         """
-        queryset = Post.objects.all().order_by('-created_at')
+        queryset = self.with_requested_related(Post.objects.order_by('-created_at'))
         status = self.request.query_params.get('status')
         if status is not None:
             queryset = queryset.filter(status=status)
@@ -116,11 +117,56 @@ class PostViewSet(viewsets.ModelViewSet):
         if my_posts and self.request.user.is_authenticated:
             queryset = queryset.filter(author=self.request.user)
 
+        # ?order=activity：按最后回复时间排序
+        ordering = self.get_cursor_ordering()
+        if ordering is not None:
+            queryset = queryset.order_by(*ordering)
+
+        return queryset
+
+    def use_compact(self):
+        return self.action == 'list' and self.request.query_params.get('compact') == 'true'
+
+    def get_serializer_class(self):
+        if self.use_compact():
+            return PostCompactSerializer
+        return super().get_serializer_class()
+
+    def with_requested_related(self, queryset):
+        """只预取 ?fields= 里要输出的关联数据"""
+        only, _ = requested_fields(self.request)
+        if self.use_compact() and only is not None and 'thumbnail' in only:
+            queryset = queryset.prefetch_related('image_set')
+        if only is None:
+            return queryset.with_related()
+        if 'author' in only:
+            queryset = queryset.select_related('author')
+        for field, lookup in (('tags', 'tags'), ('images', 'image_set')):
+            if field in only:
+                queryset = queryset.prefetch_related(lookup)
         return queryset
 
+    def get_cursor_ordering(self):
+        if self.request.query_params.get('order') == 'activity':
+            return ('-last_activity_at', '-id')
+        return None
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        全文检索标题、正文和评论：/posts/search/?q=...&status=n&tags=a,b
+        结果按相关度排序，总是使用页码分页。
+        """
+        tags = normalize_names(request.query_params.get('tags', '').split(','))
+        ranked = search.rank_posts(request.query_params.get('q', ''), request.query_params.get('status'), tags)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(ranked, request, view=self)
+        serializer = SearchResultSerializer(search.load_posts(page), many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(BatchCreateMixin, ConditionalGetMixin, OptionalCursorPaginationMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
@@ -130,7 +176,7 @@ class CommentViewSet(viewsets.ModelViewSet):
         serializer.save(author=self.request.user)
 
     def get_queryset(self):
-        queryset = Comment.objects.all()
+        queryset = Comment.objects.with_related()
         post_id = self.kwargs.get('post_pk')
         if post_id is not None:
             queryset = queryset.filter(post__id=post_id)
@@ -163,6 +209,7 @@ class ImageViewSet(viewsets.ModelViewSet):
         image_file = request.FILES.get('image')
         if not image_file:
             return Response({'image': ['No image provided.']}, status=status.HTTP_400_BAD_REQUEST)
+        validate_upload(image_file)
 
         # 创建 Image 实例
         image_instance = Image.objects.create(
@@ -178,36 +225,42 @@ class ImageViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-from django.db.models import Count, Value, When, Case
 from rest_framework.response import Response
-from django.db.models import Q,F
 
-def find_posts(user_tags):
-    total_tags = len(user_tags)
-    split_tags = [word for tag in user_tags for word in tag.split(' ')]
+def find_posts(user_tags, k=None):
+    # 基于标签倒排索引打分，返回与用户给定标签最匹配的 k 个帖子（默认 5 个）
+    return similarity.find_similar_posts(user_tags, similarity.get_top_k(k))
+
+class ResponseCacheStats(APIView):
+    """帖子接口响应缓存的命中/未命中次数，仅管理员可见"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(response_cache.stats())
+
+
+class RequestMetricsView(APIView):
+    """各接口的请求数、每次请求的查询数/字节数和耗时直方图，仅管理员可见；DELETE 清零"""
+    permission_classes = [IsAdminUser]
 
-    # 用Q查询一次性构建所需的筛选条件
-    query = Q(tags__name__icontains=split_tags[0])
-    for tag in split_tags[1:]:
-        query |= Q(tags__name__icontains=tag)
+    def get(self, request):
+        return Response(instrumentation.snapshot())
 
-    # 使用上述筛选条件，找出所有部分或全反精度最高的帖子
-    posts = Post.objects.filter(query) \
-        .annotate(matching_tags=Count('tags')) \
-        .annotate(matching_score=Value(1.0) * F('matching_tags') / total_tags) \
-        .order_by('-matching_score', '-matching_tags')
+    def delete(self, request):
+        instrumentation.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-    # 返回与用户给定标签最匹配的5个帖子
-    return posts[:5] if posts.exists() else None
 
 # 新建一个ViewSet，用于处理与标签匹配的帖子的请求
 class SimilarPostsByTags(viewsets.ViewSet):
 
     permission_classes = [AllowAny]
+    throttle_classes = [IPThrottle, UserThrottle]
+    throttle_scope = 'similar_posts'
 
     def create(self, request):
         tags_list = request.data.get('tags')
-        posts = find_posts(tags_list)
+        posts = find_posts(tags_list, request.data.get('k'))
 
         # 我们在此假设你有一个PostSerializer类，可用于序列化Post对象
         serializer = PostSerializer(posts, many=True)